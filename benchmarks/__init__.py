@@ -0,0 +1,25 @@
+"""
+Benchmarks of the exchange rate service, run them from the project root
+with ``python -m benchmarks.<name>``.
+"""
+import os
+import tempfile
+
+
+def setup_django(database=None):
+    """
+    Configure Django on a scratch SQLite database (or DATABASE_URL if
+    given) and create its tables.
+    """
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+        os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    else:
+        os.environ['DATABASE_URL'] = database
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'exchange_rate.settings')
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('migrate', verbosity=0)
@@ -0,0 +1,171 @@
+"""
+Requests per second and latency of /latest/ with many concurrent
+connections, served by 3 sync gunicorn workers and by 3 uvicorn
+workers with the async view, while slow stand-in providers keep a
+refresh in flight (EXCHANGE_RATE_UPDATE_INTERVAL=0).
+
+    python -m benchmarks.asgi_capacity [--connections 10 100 500] [--seconds 10]
+        [--latency 2] [--interval 0] [--workers 3]
+
+The load generator runs on the same host, give it its own CPUs.
+"""
+import os
+import sys
+import time
+import uuid
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks import setup_django
+
+PAYLOADS = os.path.join(os.path.dirname(__file__), 'payloads')
+
+
+def provider_server(latency):
+    """Stand-in of the providers answering their recorded payloads after latency"""
+    payloads = {}
+    for prefix, name in (('/banxico', 'banxico.xml'), ('/dof', 'dof.html'), ('/fixer', 'fixer.json')):
+        with open(os.path.join(PAYLOADS, name), 'rb') as f:
+            payloads[prefix] = f.read()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            body = next(body for prefix, body in payloads.items() if self.path.startswith(prefix))
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(command, env, port):
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{command[0]} did not start')
+
+
+async def load(url, api_key, connections, seconds):
+    """connections clients requesting url in a loop for seconds"""
+    import httpx
+
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        end = time.monotonic() + seconds
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < end:
+                start = time.monotonic()
+                try:
+                    response = await client.get(url, headers={'Authorization': f'Token {api_key}'})
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.monotonic() - start)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(connections)))
+    return sorted(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connections', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--latency', type=float, default=2, help='Seconds of the providers')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--interval', default='0', help='EXCHANGE_RATE_UPDATE_INTERVAL, 0 refreshes all the time')
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    setup_django(f'sqlite:///{database}')
+    from core.models import ApiKey, User
+
+    user = User.objects.create_user(username='asgi', email='asgi@testing.com')
+    api_key = str(ApiKey.objects.create(user=user, name='asgi', api_key=uuid.uuid4()).api_key)
+
+    providers = provider_server(args.latency)
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{database}',
+        BANXICO_API_URL=f'{providers}/banxico',
+        DOF_URL=f'{providers}/dof',
+        FIXER_API_URL=f'{providers}/fixer',
+        EXCHANGE_RATE_UPDATE_INTERVAL=args.interval,
+        MAX_REQUEST_USAGE='1000000000',
+        RATE_LIMIT_KEY_SECOND='0', RATE_LIMIT_KEY_MINUTE='0',
+        RATE_LIMIT_USER_SECOND='0', RATE_LIMIT_USER_MINUTE='0',
+        SHARED_SNAPSHOT_DIR=tempfile.mkdtemp(),
+        APP_ENV='production',
+    )
+    servers = {
+        f'gunicorn sync, {args.workers} workers': (
+            [sys.executable, '-m', 'gunicorn', 'exchange_rate.wsgi', '-w', str(args.workers),
+             '--timeout', '120'],
+            dict(env),
+        ),
+        f'uvicorn async, {args.workers} workers': (
+            [sys.executable, '-m', 'uvicorn', 'exchange_rate.asgi:application',
+             '--workers', str(args.workers), '--no-access-log'],
+            dict(env, EXCHANGE_RATE_ASYNC='true'),
+        ),
+    }
+
+    print(f'providers latency {args.latency} s, update interval {args.interval} min')
+    print(f'{"server":<28} {"connections":>11} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for name, (command, server_env) in servers.items():
+        port = free_port()
+        bind = ['-b', f'127.0.0.1:{port}'] if 'gunicorn' in command else ['--port', str(port)]
+        process = start_server(command + bind, server_env, port)
+        try:
+            for connections in args.connections:
+                latencies, errors = asyncio.run(
+                    load(f'http://127.0.0.1:{port}/latest/', api_key, connections, args.seconds)
+                )
+                if latencies:
+                    p50 = latencies[len(latencies) // 2] * 1e3
+                    p99 = latencies[int(len(latencies) * 0.99)] * 1e3
+                else:
+                    p50 = p99 = float('nan')
+                print(
+                    f'{name:<28} {connections:>11} {len(latencies) / args.seconds:8.0f} '
+                    f'{p50:8.1f} {p99:8.1f} {errors:>7}'
+                )
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
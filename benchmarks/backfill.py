@@ -0,0 +1,82 @@
+"""
+Backfill throughput against a local stand-in of the Banxico SIE API,
+30 years of daily SF43718 and SF60653 observations (10k+ rows).
+
+    python -m benchmarks.backfill [--years 30] [--database URL]
+"""
+import time
+import argparse
+from threading import Thread
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks import setup_django
+
+
+class BanxicoStandIn(BaseHTTPRequestHandler):
+    """Answer /series/<ids>/datos/<start>/<end> with one rate per day"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        series = parts[-4].split(',')
+        start = date.fromisoformat(parts[-2])
+        end = date.fromisoformat(parts[-1])
+
+        chunks = ['<?xml version="1.0" encoding="UTF-8"?><series>']
+        for offset, serie in enumerate(series):
+            chunks.append(f'<serie idSerie="{serie}" titulo="{serie}">')
+            day = start
+            while day <= end:
+                rate = 10 + (day.toordinal() % 1000) / 100 + offset / 1000
+                chunks.append(
+                    f'<Obs><fecha>{day:%d/%m/%Y}</fecha>'
+                    f'<dato>{rate:.4f}</dato></Obs>'
+                )
+                day += timedelta(days=1)
+            chunks.append('</serie>')
+        chunks.append('</series>')
+        body = ''.join(chunks).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, default=30)
+    parser.add_argument('--database', help='Database URL, a scratch SQLite by default')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BanxicoStandIn)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    setup_django(args.database)
+    from django.conf import settings
+    from core.models import ExchangeRateHistory
+    from utils.backfill import backfill
+
+    settings.BANXICO_API_URL = f'http://127.0.0.1:{server.server_port}'
+    end = date(2022, 1, 31)
+    start = end - timedelta(days=365 * args.years)
+
+    for label in ('first run', 'second run (idempotent)'):
+        begin = time.perf_counter()
+        rows = sum(written for _, _, written in backfill(start, end))
+        elapsed = time.perf_counter() - begin
+        print(
+            f'{label:<24} {rows:7} rows {elapsed:7.2f} s '
+            f'{rows / elapsed:10.0f} rows/s'
+        )
+    print(f'rows stored: {ExchangeRateHistory.objects.count()}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
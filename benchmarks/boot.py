@@ -0,0 +1,54 @@
+"""
+Import time and RSS of a worker boot (the WSGI application and the
+URLconf), each run in a fresh interpreter, and the heavy modules it
+loads.
+
+    python -m benchmarks.boot [--runs 10]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Loaded by the provider fetches only
+LAZY_MODULES = ('bs4', 'lxml', 'httpx', 'utils.async_http_client')
+
+BOOT = '''
+import sys, json, time, resource
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+import exchange_rate.urls
+print(json.dumps({
+    'seconds': time.perf_counter() - start,
+    'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    'modules': sorted(sys.modules),
+}))
+'''
+
+
+def boot():
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='exchange_rate.settings')
+    output = subprocess.run(
+        [sys.executable, '-c', BOOT], env=env, capture_output=True, check=True, text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [boot() for _ in range(args.runs)]
+    seconds = statistics.median(run['seconds'] for run in runs)
+    rss = statistics.median(run['rss'] for run in runs)
+    loaded = [name for name in LAZY_MODULES if name in runs[0]['modules']]
+    print(f'boot {seconds * 1e3:.0f} ms, RSS {rss / 2 ** 20:.1f} MiB, {len(runs[0]["modules"])} modules')
+    print(f'provider modules loaded: {", ".join(loaded) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Compare a sequential refresh against ``fetch_rates`` using slow stand-in
+providers, the concurrent refresh should take about the slowest one.
+
+    python -m benchmarks.concurrent_fetch
+"""
+import time
+from decimal import Decimal
+from datetime import date
+
+from utils.exchange_rates_sources import fetch_rates
+
+LATENCIES = {
+    'dof': 0.6,
+    'fixer': 0.3,
+    'banxico': 0.45,
+}
+
+
+def slow_provider(latency):
+    def fetch():
+        time.sleep(latency)
+        return {
+            'date': date.today(),
+            'rate': Decimal('20.1234'),
+        }
+
+    return fetch
+
+
+def main(rounds=3):
+    providers = {
+        name: slow_provider(latency) for name, latency in LATENCIES.items()
+    }
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        {name: fetch() for name, fetch in providers.items()}
+    sequential = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fetch_rates(providers)
+    concurrent = (time.perf_counter() - start) / rounds
+
+    print(f'providers latency: {LATENCIES}')
+    print(f'sequential refresh: {sequential * 1000:8.1f} ms')
+    print(f'concurrent refresh: {concurrent * 1000:8.1f} ms')
+    print(f'speedup:            {sequential / concurrent:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Conversion of a batch of amounts: a per-item Decimal loop like the
+clients do, the batch conversion of /convert/, and the whole endpoint.
+
+    python -m benchmarks.convert [--amounts 50000] [--database URL]
+"""
+import random
+import timeit
+import argparse
+from decimal import ROUND_HALF_EVEN, Decimal
+from datetime import date, datetime, timezone
+
+from benchmarks import setup_django
+
+
+def measure(func):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='Database URL, a scratch SQLite by default')
+    parser.add_argument('--amounts', type=int, default=50000)
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from django.conf import settings
+    from rest_framework.test import APIRequestFactory, force_authenticate
+    from core.models import ProviderRate, User
+    from core.views import ConvertView
+    from utils.convert import convert_amounts, parse_amounts
+
+    settings.ALLOWED_HOSTS = ['*']
+    settings.CONVERT_MAX_AMOUNTS = args.amounts
+    user = User.objects.create_user(username='convert', email='convert@testing.com')
+    rate = Decimal('20.473100')
+    ProviderRate.objects.create(
+        provider='banxico', date=date(2022, 1, 3),
+        fetched_at=datetime(2022, 1, 3, tzinfo=timezone.utc), rate=rate,
+    )
+    random.seed(0)
+    values = [f'{random.randrange(10 ** 7)}.{random.randrange(100):02d}' for _ in range(args.amounts)]
+    cents = Decimal('0.01')
+
+    def per_item():
+        return [str((Decimal(value) * rate).quantize(cents, rounding=ROUND_HALF_EVEN)) for value in values]
+
+    def batch():
+        return list(map(str, convert_amounts(parse_amounts(values), rate)))
+
+    assert per_item() == batch()
+
+    factory = APIRequestFactory()
+    view = ConvertView.as_view()
+
+    def endpoint():
+        User.objects.filter(pk=user.pk).update(usage=0)
+        request = factory.post('/convert/?provider=banxico', {'amounts': values}, format='json')
+        force_authenticate(request, user)
+        return b''.join(view(request).streaming_content)
+
+    print(f'{args.amounts} amounts')
+    print(f'{"":<24} {"time":>10} {"amounts/s":>12}')
+    for name, func in [
+        ('per-item Decimal loop', per_item),
+        ('batch conversion', batch),
+        ('/convert/ request', endpoint),
+    ]:
+        seconds = measure(func)
+        print(f'{name:<24} {seconds * 1e3:7.1f} ms {args.amounts / seconds:12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+CPU used by idle /events/ streams of one event loop and the time to push
+a new rate to all of them.
+
+    python -m benchmarks.event_streams [--streams 100 1000 10000] [--idle 5]
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+from decimal import Decimal
+
+from benchmarks import setup_django
+
+
+async def measure(streams, idle):
+    from asgiref.sync import sync_to_async
+    from core.models import ExchangeRateHistory
+    from utils.rate_cache import publish_rate
+    from utils.rate_events import rate_events
+
+    async def client(events, received):
+        async for part in events:
+            received.append(time.perf_counter())
+
+    received = []
+    clients = [asyncio.ensure_future(client(rate_events(), received)) for _ in range(streams)]
+    while len(received) < streams:
+        await asyncio.sleep(0.01)
+
+    cpu = time.process_time()
+    await asyncio.sleep(idle)
+    cpu = time.process_time() - cpu
+
+    def add_rate():
+        publish_rate(ExchangeRateHistory.objects.create(
+            dof_rate=Decimal('20.5'), fixer_rate=Decimal('20.5'), banxico_rate=Decimal('20.5'),
+        ))
+
+    received.clear()
+    start = time.perf_counter()
+    await sync_to_async(add_rate)()
+    while len(received) < streams:
+        await asyncio.sleep(0.001)
+    fan_out = max(received) - start
+
+    for task in clients:
+        task.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    return cpu / idle, fan_out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--idle', type=float, default=5, help='Seconds without new rates')
+    args = parser.parse_args()
+
+    os.environ.setdefault('SHARED_SNAPSHOT_DIR', tempfile.mkdtemp())
+    os.environ['EXCHANGE_RATE_BACKGROUND_REFRESH'] = 'true'
+    setup_django()
+    from core.models import ExchangeRateHistory
+    from utils.rate_cache import publish_rate
+
+    publish_rate(ExchangeRateHistory.objects.create(
+        dof_rate=Decimal('20.1'), fixer_rate=Decimal('20.1'), banxico_rate=Decimal('20.1'),
+    ))
+
+    print(f'{"streams":>8} {"idle CPU":>9} {"new rate to all":>16}')
+    for streams in args.streams:
+        cpu, fan_out = asyncio.run(measure(streams, args.idle))
+        print(f'{streams:>8} {cpu * 100:8.2f}% {fan_out * 1e3:13.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
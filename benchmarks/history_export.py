@@ -0,0 +1,79 @@
+"""
+Peak memory and throughput of the /history/ NDJSON and CSV exports as
+the history grows, the peak should not grow with the rows.
+
+    python -m benchmarks.history_export [--rows 200000] [--database URL]
+"""
+import time
+import argparse
+import tracemalloc
+from decimal import Decimal
+from datetime import timedelta
+
+from benchmarks import setup_django
+
+CHECKPOINTS = [10000, 50000, 200000]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='Database URL, a scratch SQLite by default')
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from django.conf import settings
+    from django.utils import timezone
+    from rest_framework.test import APIRequestFactory, force_authenticate
+    from core.models import ExchangeRateHistory, User
+    from core.views import HistoryView
+
+    settings.ALLOWED_HOSTS = ['*']
+    user = User.objects.create_user(username='export', email='export@testing.com')
+    factory = APIRequestFactory()
+    view = HistoryView.as_view()
+
+    def export(format):
+        request = factory.get('/history/', {'format': format})
+        force_authenticate(request, user)
+        size = 0
+        for chunk in view(request).streaming_content:
+            size += len(chunk)
+        return size
+
+    start = timezone.now() - timedelta(minutes=args.rows)
+    checkpoints = [n for n in CHECKPOINTS if n < args.rows] + [args.rows]
+    stored = 0
+    print(f'{"rows":>8} {"format":>7} {"rows/s":>10} {"MiB":>8} {"peak KiB":>10}')
+    for checkpoint in checkpoints:
+        while stored < checkpoint:
+            batch = min(10000, checkpoint - stored)
+            ExchangeRateHistory.objects.bulk_create(
+                ExchangeRateHistory(
+                    banxico_rate=Decimal('20.6887'),
+                    dof_rate=Decimal('20.4717'),
+                    fixer_rate=Decimal('20.6832'),
+                    created=start + timedelta(minutes=stored + i),
+                )
+                for i in range(batch)
+            )
+            stored += batch
+
+        for format in ('ndjson', 'csv'):
+            User.objects.filter(pk=user.pk).update(usage=0)
+            begin = time.perf_counter()
+            size = export(format)
+            elapsed = time.perf_counter() - begin
+            # Again with tracemalloc, it slows down the export
+            tracemalloc.start()
+            export(format)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f'{stored:>8} {format:>7} {stored / elapsed:10.0f} '
+                f'{size / 2 ** 20:8.1f} {peak / 1024:10.1f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Latency of the /latest/ database read (the query of a cache miss) as the
+exchange rate history grows to 1M+ rows, with the index on created and
+optionally without it.
+
+    python -m benchmarks.history_size [--rows 1000000] [--without-index] [--database URL]
+"""
+import timeit
+import argparse
+from decimal import Decimal
+from datetime import timedelta
+
+from benchmarks import setup_django
+
+CHECKPOINTS = [1000, 10000, 100000, 1000000]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='Database URL, a scratch SQLite by default')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--without-index', action='store_true', help='Drop the index on created')
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from django.db import connection
+    from django.utils import timezone
+    from core.models import ExchangeRateHistory
+    from utils.provider_rates import latest_rate
+
+    if args.without_index:
+        with connection.schema_editor() as editor:
+            for index in ExchangeRateHistory._meta.indexes:
+                if index.fields == ['created']:
+                    editor.remove_index(ExchangeRateHistory, index)
+
+    start = timezone.now() - timedelta(minutes=args.rows)
+    checkpoints = [n for n in CHECKPOINTS if n < args.rows] + [args.rows]
+    stored = 0
+    print(f'{"rows":>10} {"latest query":>14}')
+    for checkpoint in checkpoints:
+        while stored < checkpoint:
+            batch = min(10000, checkpoint - stored)
+            ExchangeRateHistory.objects.bulk_create(
+                ExchangeRateHistory(
+                    banxico_rate=Decimal('20.6887'),
+                    dof_rate=Decimal('20.4717'),
+                    fixer_rate=Decimal('20.6832'),
+                    created=start + timedelta(minutes=stored + i),
+                )
+                for i in range(batch)
+            )
+            stored += batch
+
+        timer = timeit.Timer(latest_rate)
+        number, _ = timer.autorange()
+        seconds = min(timer.repeat(repeat=3, number=number)) / number
+        print(f'{stored:>10} {seconds * 1e6:11.1f} us')
+
+    sql, params = ExchangeRateHistory.objects.order_by('-created')[:1].query.sql_with_params()
+    explain = 'EXPLAIN QUERY PLAN' if connection.vendor == 'sqlite' else 'EXPLAIN'
+    with connection.cursor() as cursor:
+        cursor.execute(f'{explain} {sql}', params)
+        print('\n'.join(str(row) for row in cursor.fetchall()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Read latency of the latest rate: the ORM query of every request before
+the caches, the shared memory snapshot and the per process cache.
+
+    python -m benchmarks.latest_snapshot [--database URL]
+"""
+import timeit
+import argparse
+from decimal import Decimal
+from datetime import date
+
+from benchmarks import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='Database URL, a scratch SQLite by default')
+    parser.add_argument('--rows', type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from django.utils import timezone
+    from core.models import ExchangeRateHistory
+    from utils.rate_cache import (
+        decode_rate, latest_rate_cache, latest_snapshot, publish_rate)
+
+    now = timezone.now()
+    ExchangeRateHistory.objects.bulk_create(
+        ExchangeRateHistory(
+            banxico_rate=Decimal('20.6887'), banxico_date=date.today(), banxico_last_updated=now,
+            dof_rate=Decimal('20.4717'), dof_date=date.today(), dof_last_updated=now,
+            fixer_rate=Decimal('20.6832'), fixer_date=date.today(), fixer_last_updated=now,
+            created=now,
+        )
+        for _ in range(args.rows)
+    )
+    publish_rate(ExchangeRateHistory.objects.order_by('-created').first())
+
+    cases = {
+        'ORM query': lambda: ExchangeRateHistory.objects.filter()
+        .order_by('-created')
+        .first(),
+        'shared snapshot read + decode': lambda: decode_rate(latest_snapshot().read()[1]),
+        'process cache hit': latest_rate_cache.get,
+    }
+    for name, func in cases.items():
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        seconds = min(timer.repeat(repeat=3, number=number)) / number
+        print(f'{name:<32} {seconds * 1e6:10.2f} us')
+
+
+if __name__ == '__main__':
+    main()
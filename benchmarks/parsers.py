@@ -0,0 +1,182 @@
+"""
+Time and peak memory per parse of the recorded provider payloads, run
+offline against the files in benchmarks/payloads.
+
+    python -m benchmarks.parsers
+    python -m benchmarks.parsers --save baseline.json
+    python -m benchmarks.parsers --compare baseline.json --tolerance 0.25
+
+With --compare it exits with an error if a parser got slower or uses
+more memory than the baseline plus the tolerance.
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+import warnings
+import tracemalloc
+import xml.etree.ElementTree as ElementTree
+from pathlib import Path
+from decimal import Decimal
+from datetime import datetime, timezone
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'exchange_rate.settings')
+django.setup()
+
+from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning  # noqa: E402
+from lxml import etree  # noqa: E402
+
+from core.models import ExchangeRateHistory  # noqa: E402
+from utils.exchange_rates_sources import (  # noqa: E402
+    parse_banxico_rate, parse_dof_rate, parse_fixer_rate)
+from utils.format_data import exchange_rate_format  # noqa: E402
+
+PAYLOADS = Path(__file__).resolve().parent / 'payloads'
+
+warnings.filterwarnings('ignore', category=XMLParsedAsHTMLWarning)
+
+
+def read_payload(name):
+    with open(PAYLOADS / name, newline='') as f:
+        return f.read()
+
+
+def legacy_dof_rate(text):
+    """The DOF parser before the streaming one, kept as the baseline"""
+    soup = BeautifulSoup(text, 'html.parser')
+    for i in range(5, 28, 4):
+        temp_date = soup.find_all('table')[8].find_all('td')[i].text
+        temp_rate = soup.find_all('table')[8].find_all('td')[i+1].text
+        if 'N/E' not in temp_rate:
+            break
+
+    d = datetime.strptime(
+        temp_date.replace('\r\n', '').strip(),
+        '%d/%m/%Y',
+    ).date()
+    temp_rate = temp_rate.replace('\r\n', '').strip()
+    if temp_rate == 'N/E':
+        return None
+    return {
+        'date': d,
+        'rate': Decimal(temp_rate),
+    }
+
+
+def observation(root):
+    """First observation of a Banxico response, tags are case insensitive"""
+    for element in root.iter():
+        if isinstance(element.tag, str) and element.tag.lower() == 'obs':
+            values = {child.tag.lower(): child.text for child in element}
+            return {
+                'date': datetime.strptime(values['fecha'], '%d/%m/%Y').date(),
+                'rate': Decimal(values['dato']),
+            }
+
+
+def lxml_banxico_rate(text):
+    """Banxico parser with lxml.etree, without BeautifulSoup"""
+    return observation(etree.fromstring(text.encode()))
+
+
+def elementtree_banxico_rate(text):
+    """Banxico parser with the standard library ElementTree"""
+    return observation(ElementTree.fromstring(text.encode()))
+
+
+def history_row():
+    dt = datetime(2022, 1, 31, 18, tzinfo=timezone.utc)
+    return ExchangeRateHistory(
+        banxico_rate=Decimal('20.6887'),
+        banxico_date=dt.date(),
+        banxico_last_updated=dt,
+        dof_rate=Decimal('20.4717'),
+        dof_date=dt.date(),
+        dof_last_updated=dt,
+        fixer_rate=Decimal('20.6832'),
+        fixer_date=dt.date(),
+        fixer_last_updated=dt,
+        created=dt,
+    )
+
+
+def cases():
+    banxico = read_payload('banxico.xml')
+    dof = read_payload('dof.html')
+    fixer = read_payload('fixer.json')
+    return [
+        ('banxico (BeautifulSoup lxml)', parse_banxico_rate, banxico),
+        ('banxico (lxml.etree)', lxml_banxico_rate, banxico),
+        ('banxico (ElementTree)', elementtree_banxico_rate, banxico),
+        ('dof (BeautifulSoup, legacy)', legacy_dof_rate, dof),
+        ('dof (streaming)', parse_dof_rate, dof),
+        ('fixer (json + Decimal)', lambda text: parse_fixer_rate(json.loads(text)), fixer),
+        ('exchange_rate_format', exchange_rate_format, history_row()),
+    ]
+
+
+def measure(parse, payload):
+    """Return the mean seconds and the peak bytes allocated per parse"""
+    timer = timeit.Timer(lambda: parse(payload))
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=3, number=number)) / number
+
+    tracemalloc.start()
+    parse(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def check(results, baseline, tolerance):
+    """Return the cases slower or bigger than the baseline"""
+    regressions = []
+    for name, (seconds, peak) in results.items():
+        if name not in baseline:
+            continue
+        base_seconds, base_peak = baseline[name]
+        if seconds > base_seconds * (1 + tolerance):
+            regressions.append(f'{name}: {base_seconds * 1e6:.1f} -> {seconds * 1e6:.1f} us')
+        if peak > base_peak * (1 + tolerance):
+            regressions.append(f'{name}: {base_peak} -> {peak} bytes peak')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--save', help='Save the results as a JSON baseline')
+    parser.add_argument('--compare', help='Compare with a JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    banxico = read_payload('banxico.xml')
+    assert parse_banxico_rate(banxico) == lxml_banxico_rate(banxico)
+    assert parse_banxico_rate(banxico) == elementtree_banxico_rate(banxico)
+    dof = read_payload('dof.html')
+    assert legacy_dof_rate(dof) == parse_dof_rate(dof)
+
+    results = {}
+    print(f'{"parser":<32} {"time/parse":>15} {"peak memory":>14}')
+    for name, parse, payload in cases():
+        seconds, peak = measure(parse, payload)
+        results[name] = (seconds, peak)
+        print(f'{name:<32} {seconds * 1e6:12.1f} us {peak / 1024:10.1f} KiB')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = check(results, json.load(f), args.tolerance)
+        if regressions:
+            print('\nRegressions:')
+            print('\n'.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
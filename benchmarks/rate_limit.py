@@ -0,0 +1,52 @@
+"""
+Cost of a rate limit check of /latest/: the sliding window limiter
+alone and the DRF throttle with the per key and per user limits.
+
+    python -m benchmarks.rate_limit [--keys 10000]
+"""
+import timeit
+import argparse
+import itertools
+from types import SimpleNamespace
+
+from benchmarks import setup_django
+
+
+def measure(func):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=10000, help='Distinct api keys checked')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import override_settings
+    from utils.throttling import ApiKeyRateThrottle, SlidingWindowLimiter, rate_limiter
+
+    limiter = SlidingWindowLimiter()
+    limits = [(('key', 'k', 1), 10 ** 9, 1), (('key', 'k', 60), 10 ** 9, 60)]
+
+    requests = [
+        SimpleNamespace(user=SimpleNamespace(pk=i, is_authenticated=True), auth=f'key-{i}')
+        for i in range(args.keys)
+    ]
+    requests_iter = itertools.cycle(requests)
+    throttle = ApiKeyRateThrottle()
+
+    cases = {
+        'limiter, 2 windows': lambda: limiter.hit(1, limits),
+        'throttle, 1 key': lambda: throttle.allow_request(requests[0], None),
+        f'throttle, {args.keys} keys': lambda: throttle.allow_request(next(requests_iter), None),
+    }
+    with override_settings(RATE_LIMIT_KEY=(10 ** 9, 10 ** 9), RATE_LIMIT_USER=(10 ** 9, 10 ** 9)):
+        for name, func in cases.items():
+            rate_limiter.clear()
+            print(f'{name:<28} {measure(func) * 1e6:8.2f} us')
+
+
+if __name__ == '__main__':
+    main()
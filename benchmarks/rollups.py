@@ -0,0 +1,65 @@
+"""
+A year of daily OHLC of a provider read from the rollups and computed
+from the raw history, and the time to rebuild the rollups.
+
+    python -m benchmarks.rollups [--days 365] [--every 10] [--database URL]
+"""
+import time
+import timeit
+import argparse
+from decimal import Decimal
+from datetime import datetime, timedelta, timezone
+
+from benchmarks import setup_django
+
+
+def measure(func):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='Database URL, a scratch SQLite by default')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--every', type=int, default=10, help='Minutes between refreshes')
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from core.models import ExchangeRateHistory, RateRollup
+    from utils.rollups import compute_rollups, rebuild_rollups
+
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    rows = args.days * 24 * 60 // args.every
+    for offset in range(0, rows, 10000):
+        ExchangeRateHistory.objects.bulk_create(
+            ExchangeRateHistory(
+                dof_rate=Decimal(20) + Decimal(i % 997) / 1000,
+                fixer_rate=Decimal(20) + Decimal(i % 991) / 1000,
+                banxico_rate=Decimal(20) + Decimal(i % 983) / 1000,
+                created=start + timedelta(minutes=i * args.every),
+            )
+            for i in range(offset, min(offset + 10000, rows))
+        )
+
+    begin = time.perf_counter()
+    written = rebuild_rollups()
+    print(f'{rows} history rows, rollups {written} rebuilt in {time.perf_counter() - begin:.2f} s')
+
+    def from_rollups():
+        return list(RateRollup.objects.filter(period='day', provider='dof'))
+
+    def from_history():
+        return list(compute_rollups('day', 'dof'))
+
+    print(f'{"daily dof OHLC of the year":<32} {"rows read":>10} {"time":>12}')
+    for name, func, read in [
+        ('from the rollups', from_rollups, len(from_rollups())),
+        ('from the history', from_history, rows),
+    ]:
+        print(f'{name:<32} {read:>10} {measure(func) * 1e3:9.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Load test of the usage accounting: concurrent requests of a few hot
+users counted with a save() per request like /latest/ did, and with the
+buffered usage counter. Prints the throughput and the increments lost.
+
+    python -m benchmarks.usage [--database URL] [--threads 8] [--requests 500]
+"""
+import time
+import argparse
+from threading import Thread
+
+from benchmarks import setup_django
+
+
+def run(threads, requests, users, count):
+    """Run count(user) from every thread, return the seconds it took"""
+    def work(i):
+        from django.db import connection
+        for j in range(requests):
+            count(users[(i + j) % len(users)])
+        connection.close()
+
+    workers = [Thread(target=work, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='Database URL, a scratch SQLite by default')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per thread')
+    parser.add_argument('--users', type=int, default=4)
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from core.models import User
+    from utils.usage import UsageCounter
+
+    users = [
+        User.objects.create_user(username=f'load{i}', email=f'load{i}@testing.com')
+        for i in range(args.users)
+    ]
+    expected = args.threads * args.requests
+
+    def save_per_request(user):
+        user = User.objects.get(pk=user.pk)
+        user.usage = user.usage + 1
+        user.save(update_fields=['usage'])
+
+    counter = UsageCounter()
+
+    def buffered(user):
+        counter.add(user)
+
+    print(f'{args.threads} threads x {args.requests} requests, {args.users} users')
+    print(f'{"accounting":<20} {"requests/s":>12} {"lost":>8}')
+    for name, count in [('save per request', save_per_request), ('buffered counter', buffered)]:
+        User.objects.update(usage=0)
+        seconds = run(args.threads, args.requests, users, count)
+        counter.flush()
+        counted = sum(User.objects.values_list('usage', flat=True))
+        print(f'{name:<20} {expected / seconds:12.0f} {expected - counted:8}')
+
+
+if __name__ == '__main__':
+    main()
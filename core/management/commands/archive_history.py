@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.archive import archive_history
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the exchange rate history older than the retention days to '
+        'gzip CSV files, in batches deleted once their file is written. '
+        'The latest rate is always kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.HISTORY_RETENTION_DAYS,
+            help='Keep the rows of the last days, HISTORY_RETENTION_DAYS by default.',
+        )
+        parser.add_argument(
+            '--dir',
+            default=settings.HISTORY_ARCHIVE_DIR,
+            help='Directory of the archive files, HISTORY_ARCHIVE_DIR by default.',
+        )
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['days'] <= 0:
+            raise CommandError('Set the retention days with --days or HISTORY_RETENTION_DAYS')
+
+        total = 0
+        begin = time.perf_counter()
+        try:
+            for path, rows in archive_history(
+                options['days'],
+                options['dir'],
+                batch_size=options['batch_size'],
+            ):
+                total += rows
+                self.stdout.write(f'{path}: {rows} rows')
+        except OSError as e:
+            raise CommandError(f'{e}, {total} rows archived, run it again to resume')
+
+        elapsed = time.perf_counter() - begin
+        self.stdout.write(f'{total} rows archived in {elapsed:.2f} s')
@@ -0,0 +1,59 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.backfill import backfill
+
+
+class Command(BaseCommand):
+    help = (
+        'Backfill the exchange rate history between two dates from the '
+        'Banxico series and CSV dumps (provider,date,rate). It can be run '
+        'again, the rates already stored are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', type=date.fromisoformat, help='YYYY-MM-DD')
+        parser.add_argument('end', type=date.fromisoformat, help='YYYY-MM-DD')
+        parser.add_argument(
+            '--file',
+            action='append',
+            default=[],
+            help='CSV dump with the columns provider, date and rate.',
+        )
+        parser.add_argument(
+            '--no-api',
+            action='store_true',
+            help='Only read the dumps, do not call Banxico.',
+        )
+        parser.add_argument(
+            '--window-days',
+            type=int,
+            default=365,
+            help='Days requested to Banxico and written per transaction.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['start'] > options['end']:
+            raise CommandError('The start date must be before the end date')
+
+        total = 0
+        begin = time.perf_counter()
+        try:
+            for start, end, rows in backfill(
+                options['start'],
+                options['end'],
+                files=options['file'],
+                use_api=not options['no_api'],
+                window_days=options['window_days'],
+                batch_size=options['batch_size'],
+            ):
+                total += rows
+                self.stdout.write(f'{start} - {end}: {rows} rows')
+        except (IOError, ValueError) as e:
+            raise CommandError(f'{e}, {total} rows written, run it again to resume')
+
+        elapsed = time.perf_counter() - begin
+        self.stdout.write(f'{total} rows written in {elapsed:.2f} s')
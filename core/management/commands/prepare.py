@@ -0,0 +1,57 @@
+import os
+import hashlib
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+# Ignored by collectstatic by default
+IGNORE_PATTERNS = ['CVS', '.*', '*~']
+
+
+def pending_migrations():
+    executor = MigrationExecutor(connection)
+    return executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+
+def static_fingerprint():
+    """Hash of the path, size and mtime of every static file to collect"""
+    files = []
+    for finder in get_finders():
+        for path, storage in finder.list(IGNORE_PATTERNS):
+            stat = os.stat(storage.path(path))
+            files.append(f'{path}:{stat.st_size}:{stat.st_mtime_ns}')
+    return hashlib.sha1('\n'.join(sorted(files)).encode()).hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        'Apply the pending migrations and collect the static files if they '
+        'changed since the last time, in one process. Run it on boot instead '
+        'of migrate and collectstatic.'
+    )
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        if pending_migrations():
+            call_command('migrate', interactive=False, verbosity=verbosity)
+        else:
+            self.stdout.write('No migrations to apply')
+
+        fingerprint = static_fingerprint()
+        path = os.path.join(settings.STATIC_ROOT, '.fingerprint')
+        try:
+            with open(path) as f:
+                collected = f.read()
+        except OSError:
+            collected = None
+        if collected == fingerprint:
+            self.stdout.write('Static files up to date')
+            return
+
+        call_command('collectstatic', interactive=False, verbosity=verbosity)
+        with open(path, 'w') as f:
+            f.write(fingerprint)
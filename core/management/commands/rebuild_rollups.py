@@ -0,0 +1,37 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.rollups import archived_until, rebuild_rollups, start_of_day
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the hourly and daily rate rollups from the exchange rate '
+        'history, all of them or the ones between two dates. Run it after '
+        'a backfill, the rows written in bulk do not update the rollups. '
+        'The rollups of the archived history are kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='YYYY-MM-DD')
+        parser.add_argument('--end', type=date.fromisoformat, help='YYYY-MM-DD, included')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = options['start'] and start_of_day(options['start'])
+        end = options['end'] and start_of_day(options['end'] + timedelta(days=1))
+        if start and end and start >= end:
+            raise CommandError('The start date must be before the end date')
+
+        until = archived_until()
+        if until is not None:
+            self.stdout.write(f'The rollups before {until:%Y-%m-%d} kept, their history is archived')
+
+        begin = time.perf_counter()
+        written = rebuild_rollups(start, end, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - begin
+        for period, rollups in written.items():
+            self.stdout.write(f'{rollups} {period} rollups')
+        self.stdout.write(f'Rebuilt in {elapsed:.2f} s')
@@ -0,0 +1,79 @@
+import os
+import signal
+import socket
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.models import Lease
+from utils.provider_rates import latest_rate
+from utils.refresh import REFRESH_LEASE, rate_is_outdated, refresh_exchange_rate
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Keep the exchange rates updated in the background. Every instance '
+        'competes for a database lease and only the holder refreshes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Refresh once if the rates are outdated and exit.',
+        )
+        parser.add_argument(
+            '--poll',
+            type=int,
+            default=settings.EXCHANGE_RATE_WORKER_POLL,
+            help='Seconds between lease renewals and update checks.',
+        )
+
+    def handle(self, *args, **options):
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.running = True
+        if not options['once']:
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        try:
+            while self.running:
+                self.run_once()
+                if options['once']:
+                    break
+                self.sleep(options['poll'])
+        finally:
+            Lease.release(REFRESH_LEASE, self.owner)
+
+    def stop(self, signum, frame):
+        self.running = False
+
+    def sleep(self, seconds):
+        end = time.monotonic() + seconds
+        while self.running and time.monotonic() < end:
+            time.sleep(min(1, end - time.monotonic()))
+
+    def run_once(self):
+        close_old_connections()
+        try:
+            if not Lease.acquire(
+                REFRESH_LEASE,
+                self.owner,
+                settings.EXCHANGE_RATE_LEASE_SECONDS,
+            ):
+                return
+
+            last_rate = latest_rate()
+            if rate_is_outdated(last_rate):
+                last_rate = refresh_exchange_rate(last_rate)
+                if last_rate is None:
+                    logger.warning('Exchange rates not available')
+                else:
+                    self.stdout.write(f'Exchange rates updated at {last_rate.created}')
+        except Exception:
+            logger.exception('Error refreshing the exchange rates')
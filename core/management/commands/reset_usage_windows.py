@@ -0,0 +1,28 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from utils.quota import reset_windows, utc_today
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Start a new usage window for every user whose window is over, '
+        'with a single UPDATE. Run it daily so the requests do not write it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date',
+            type=date.fromisoformat,
+            default=None,
+            help='Reset the windows over on this day (YYYY-MM-DD), today by default.',
+        )
+
+    def handle(self, *args, **options):
+        today = options['date'] or utc_today()
+        users = reset_windows(User.objects.all(), today)
+        self.stdout.write(f'{users} usage windows reset')
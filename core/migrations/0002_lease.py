@@ -0,0 +1,26 @@
+# Generated by Django 3.2.11 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('owner', models.CharField(max_length=255)),
+                ('expires', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'Leases',
+                'db_table': 'lease',
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.2.11 on 2026-10-18 19:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_lease'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exchangeratehistory',
+            name='banxico_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='exchangeratehistory',
+            name='banxico_last_updated',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='exchangeratehistory',
+            name='banxico_rate',
+            field=models.DecimalField(decimal_places=6, default=0, max_digits=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='exchangeratehistory',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='exchangeratehistory',
+            name='dof_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='exchangeratehistory',
+            name='dof_last_updated',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='exchangeratehistory',
+            name='dof_rate',
+            field=models.DecimalField(decimal_places=6, default=0, max_digits=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='exchangeratehistory',
+            name='fixer_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='exchangeratehistory',
+            name='fixer_last_updated',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='exchangeratehistory',
+            name='fixer_rate',
+            field=models.DecimalField(decimal_places=6, default=0, max_digits=16, null=True),
+        ),
+    ]
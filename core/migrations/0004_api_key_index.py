@@ -0,0 +1,18 @@
+# Generated by Django 3.2.11 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_history_backfill'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apikey',
+            name='api_key',
+            field=models.UUIDField(db_index=True, null=True),
+        ),
+    ]
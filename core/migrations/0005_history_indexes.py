@@ -0,0 +1,29 @@
+# Generated by Django 3.2.11 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_api_key_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exchangeratehistory',
+            index=models.Index(fields=['created'], name='history_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeratehistory',
+            index=models.Index(fields=['banxico_date'], name='history_banxico_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeratehistory',
+            index=models.Index(fields=['dof_date'], name='history_dof_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeratehistory',
+            index=models.Index(fields=['fixer_date'], name='history_fixer_date_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.11 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('provider', models.CharField(max_length=20)),
+                ('open', models.DecimalField(decimal_places=6, max_digits=16)),
+                ('high', models.DecimalField(decimal_places=6, max_digits=16)),
+                ('low', models.DecimalField(decimal_places=6, max_digits=16)),
+                ('close', models.DecimalField(decimal_places=6, max_digits=16)),
+                ('sum', models.DecimalField(decimal_places=6, max_digits=20)),
+                ('count', models.IntegerField()),
+                ('first_created', models.DateTimeField()),
+                ('last_created', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'Rate rollups',
+                'db_table': 'rate_rollup',
+                'ordering': ['period', 'provider', 'bucket'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='raterollup',
+            constraint=models.UniqueConstraint(fields=('period', 'provider', 'bucket'), name='rate_rollup_bucket_unique'),
+        ),
+    ]
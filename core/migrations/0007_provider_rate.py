@@ -0,0 +1,66 @@
+# Generated by Django 3.2.11 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+PROVIDERS = ['dof', 'fixer', 'banxico']
+
+
+def convert_history(apps, schema_editor):
+    """
+    One ProviderRate per rate fetched, the rows repeat the rates of the
+    providers that did not answer a refresh so the repeats are skipped.
+    """
+    ExchangeRateHistory = apps.get_model('core', 'ExchangeRateHistory')
+    ProviderRate = apps.get_model('core', 'ProviderRate')
+
+    previous = {}
+    batch = []
+    for row in ExchangeRateHistory.objects.order_by('created', 'id').iterator(chunk_size=2000):
+        for provider in PROVIDERS:
+            rate = getattr(row, f'{provider}_rate')
+            date = getattr(row, f'{provider}_date')
+            fetched_at = getattr(row, f'{provider}_last_updated')
+            if rate is None or date is None or fetched_at is None:
+                continue
+            if previous.get(provider) == (date, fetched_at):
+                continue
+            previous[provider] = (date, fetched_at)
+            batch.append(ProviderRate(provider=provider, date=date, fetched_at=fetched_at, rate=rate))
+        if len(batch) >= 2000:
+            ProviderRate.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    ProviderRate.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_rate_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=20)),
+                ('date', models.DateField()),
+                ('fetched_at', models.DateTimeField()),
+                ('rate', models.DecimalField(decimal_places=6, max_digits=16)),
+            ],
+            options={
+                'verbose_name_plural': 'Provider rates',
+                'db_table': 'provider_rate',
+                'ordering': ['provider', '-fetched_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='providerrate',
+            index=models.Index(fields=['provider', '-fetched_at', '-id'], name='provider_rate_latest_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='providerrate',
+            constraint=models.UniqueConstraint(fields=('provider', 'date', 'fetched_at'), name='provider_rate_unique'),
+        ),
+        migrations.RunPython(convert_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.11 on 2026-10-18 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_provider_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyRates',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base', models.CharField(max_length=3)),
+                ('date', models.DateField()),
+                ('timestamp', models.DateTimeField(unique=True)),
+                ('fetched_at', models.DateTimeField()),
+                ('symbols', models.TextField()),
+                ('rates', models.BinaryField()),
+            ],
+            options={
+                'verbose_name_plural': 'Currency rates',
+                'db_table': 'currency_rates',
+                'ordering': ['-timestamp'],
+            },
+        ),
+    ]
@@ -1,9 +1,11 @@
 from datetime import datetime, timedelta
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
 from django.utils.timezone import utc
 from django.contrib.auth.models import AbstractUser
-from django.conf import settings
+
+from utils.quota import over_limit, usage_window
 
 
 class User(AbstractUser):
@@ -21,54 +23,45 @@ class User(AbstractUser):
     def percentage_usage(self):
         return self.usage
 
-    def reset_usage(self):
-        """ Reset the user's usage. """
-        today = datetime.utcnow().replace(tzinfo=utc).date()
-        self.usage_end_date = today + timedelta(days=30)
-        self.usage = 0
-        self.save(update_fields=['usage_end_date', 'usage'])
+    def usage_window(self):
+        """ The usage and end date of the current usage window, a window
+        over is reported as a new one without saving it. """
+        return usage_window(self.usage, self.usage_end_date)
 
     def check_usage_limit(self):
         """ Check if the user has reached his usage limit. 
         If the user has reached his usage limit, return True. """
-        today = datetime.utcnow().replace(tzinfo=utc).date()
-        if self.usage_end_date is None or self.usage is None:
-            self.reset_usage()
-            return False
-
-        elif today >= self.usage_end_date:
-            self.reset_usage()
-            return False
-        
-        elif (
-            self.usage_end_date  > today 
-            and settings.MAX_REQUEST_USAGE > self.usage
-        ):
-            return False
-        
-        else:
-            return True
+        usage, _ = self.usage_window()
+        return over_limit(usage)
 
 
 class ExchangeRateHistory(models.Model):
-    banxico_rate = models.DecimalField(max_digits=16, decimal_places=6, default=0)
-    banxico_date = models.DateField()
-    banxico_last_updated = models.DateTimeField()
+    # The providers are null in the rows of the refreshes (or backfilled
+    # dates) without a rate of theirs
+    banxico_rate = models.DecimalField(max_digits=16, decimal_places=6, default=0, null=True)
+    banxico_date = models.DateField(null=True)
+    banxico_last_updated = models.DateTimeField(null=True)
 
-    dof_rate = models.DecimalField(max_digits=16, decimal_places=6, default=0)
-    dof_date = models.DateField()
-    dof_last_updated = models.DateTimeField()
+    dof_rate = models.DecimalField(max_digits=16, decimal_places=6, default=0, null=True)
+    dof_date = models.DateField(null=True)
+    dof_last_updated = models.DateTimeField(null=True)
 
-    fixer_rate = models.DecimalField(max_digits=16, decimal_places=6, default=0)
-    fixer_date = models.DateField()
-    fixer_last_updated = models.DateTimeField()
+    fixer_rate = models.DecimalField(max_digits=16, decimal_places=6, default=0, null=True)
+    fixer_date = models.DateField(null=True)
+    fixer_last_updated = models.DateTimeField(null=True)
 
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(default=timezone.now)
 
     class Meta:
         verbose_name_plural = "Exchange rate history"
         db_table = "exchange_rate_history"
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['created'], name='history_created_idx'),
+            models.Index(fields=['banxico_date'], name='history_banxico_date_idx'),
+            models.Index(fields=['dof_date'], name='history_dof_date_idx'),
+            models.Index(fields=['fixer_date'], name='history_fixer_date_idx'),
+        ]
 
     def __str__(self):
         return str(self.created)
@@ -77,7 +70,7 @@ class ExchangeRateHistory(models.Model):
 class ApiKey(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='keys')
     name = models.CharField(max_length=100)
-    api_key = models.UUIDField(null=True)
+    api_key = models.UUIDField(null=True, db_index=True)
 
     class Meta:
         verbose_name_plural = "Api keys"
@@ -86,3 +79,175 @@ class ApiKey(models.Model):
 
     def __str__(self):
         return str(self.name)
+
+
+class ProviderRate(models.Model):
+    """
+    A rate of a provider, the date of the rate and when it was fetched.
+    ExchangeRateHistory keeps one row per refresh with the rates fetched by
+    it, the latest rate of the providers that did not answer is read here.
+    """
+    provider = models.CharField(max_length=20)
+    date = models.DateField()
+    fetched_at = models.DateTimeField()
+    rate = models.DecimalField(max_digits=16, decimal_places=6)
+
+    class Meta:
+        verbose_name_plural = "Provider rates"
+        db_table = "provider_rate"
+        ordering = ['provider', '-fetched_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['provider', 'date', 'fetched_at'],
+                name='provider_rate_unique',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['provider', '-fetched_at', '-id'], name='provider_rate_latest_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.provider} {self.date} {self.rate}'
+
+
+class CurrencyRates(models.Model):
+    """
+    The rates of every currency of a Fixer response against its base,
+    the symbols comma separated and the rates packed as doubles in the
+    same order. One row per Fixer update (timestamp).
+    """
+    base = models.CharField(max_length=3)
+    date = models.DateField()
+    timestamp = models.DateTimeField(unique=True)
+    fetched_at = models.DateTimeField()
+    symbols = models.TextField()
+    rates = models.BinaryField()
+
+    class Meta:
+        verbose_name_plural = "Currency rates"
+        db_table = "currency_rates"
+        ordering = ['-timestamp']
+
+    def __str__(self):
+        return f'{self.base} {self.timestamp}'
+
+
+class Lease(models.Model):
+    """
+    A named lock shared by every process through the database, the
+    owner keeps it while it renews the lease before it expires.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    owner = models.CharField(max_length=255)
+    expires = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = "Leases"
+        db_table = "lease"
+
+    def __str__(self):
+        return str(self.name)
+
+    @classmethod
+    def acquire(cls, name, owner, seconds):
+        """ Acquire or renew the lease, return True if owner holds it. """
+        now = datetime.utcnow().replace(tzinfo=utc)
+        expires = now + timedelta(seconds=seconds)
+        updated = (
+            cls.objects.filter(name=name)
+            .filter(models.Q(owner=owner) | models.Q(expires__lte=now))
+            .update(owner=owner, expires=expires)
+        )
+        if updated:
+            return True
+
+        try:
+            with transaction.atomic():
+                cls.objects.create(name=name, owner=owner, expires=expires)
+        except IntegrityError:
+            return False
+        return True
+
+    @classmethod
+    def release(cls, name, owner):
+        """ Release the lease if owner holds it. """
+        now = datetime.utcnow().replace(tzinfo=utc)
+        cls.objects.filter(name=name, owner=owner).update(expires=now)
+
+
+class CacheVersion(models.Model):
+    """
+    Version of a cache of the processes shared by every node through the
+    database, bumped with the change that makes the cached data stale.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Cache versions"
+        db_table = "cache_version"
+
+    def __str__(self):
+        return str(self.name)
+
+    @classmethod
+    def bump(cls, name):
+        """ Increment the version of name. """
+        if cls.objects.filter(name=name).update(version=models.F('version') + 1):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(name=name, version=1)
+        except IntegrityError:
+            cls.objects.filter(name=name).update(version=models.F('version') + 1)
+
+    @classmethod
+    def current(cls, name):
+        """ The version of name, 0 if it was never bumped. """
+        return cls.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+
+class RateRollup(models.Model):
+    """
+    Open, high, low, close, sum and count of the rates of a provider (or
+    of the spread between the providers) in an hour or a day, updated
+    with every new ExchangeRateHistory row.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIODS = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIODS)
+    bucket = models.DateTimeField()
+    provider = models.CharField(max_length=20)
+
+    open = models.DecimalField(max_digits=16, decimal_places=6)
+    high = models.DecimalField(max_digits=16, decimal_places=6)
+    low = models.DecimalField(max_digits=16, decimal_places=6)
+    close = models.DecimalField(max_digits=16, decimal_places=6)
+    sum = models.DecimalField(max_digits=20, decimal_places=6)
+    count = models.IntegerField()
+    # created of the rows of the open and the close
+    first_created = models.DateTimeField()
+    last_created = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = "Rate rollups"
+        db_table = "rate_rollup"
+        ordering = ['period', 'provider', 'bucket']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'provider', 'bucket'],
+                name='rate_rollup_bucket_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.provider} {self.period} {self.bucket}'
+
+    @property
+    def mean(self):
+        return self.sum / self.count
@@ -1,15 +1,19 @@
 import uuid
 import logging
-from datetime import datetime, timedelta
 
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.utils import timezone
-from django.utils.timezone import utc
+from django.utils.dateparse import parse_datetime
 
 from rest_framework import serializers
 
-from core.models import ApiKey
+from core.models import ApiKey, RateRollup
+from utils.convert import MAX_PLACES
+from utils.exchange_rates_sources import PROVIDERS
+from utils.quota import USAGE_PERIOD, utc_today
+from utils.rollups import PERIODS, ROLLUP_PROVIDERS
+from utils.usage import usage_counter
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -19,6 +23,85 @@ class UUIDSerializer(serializers.Serializer):
     api_key = serializers.UUIDField(format='hex_verbose')
 
 
+class HistoryQuerySerializer(serializers.Serializer):
+    provider = serializers.ChoiceField(choices=list(PROVIDERS), required=False)
+
+    def get_fields(self):
+        # from is a keyword
+        fields = super().get_fields()
+        fields['from'] = serializers.DateField(required=False)
+        fields['to'] = serializers.DateField(required=False)
+        return fields
+
+    def validate(self, data):
+        if data.get('from') and data.get('to') and data['from'] > data['to']:
+            raise serializers.ValidationError('from must be before to')
+        return data
+
+
+class RollupQuerySerializer(HistoryQuerySerializer):
+    provider = serializers.ChoiceField(choices=ROLLUP_PROVIDERS, required=False)
+    period = serializers.ChoiceField(choices=PERIODS, default=RateRollup.DAY)
+
+
+class ConvertQuerySerializer(serializers.Serializer):
+    provider = serializers.ChoiceField(choices=list(PROVIDERS))
+    date = serializers.DateField(required=False)
+    places = serializers.IntegerField(min_value=0, max_value=MAX_PLACES, default=2)
+
+
+class RatesQuerySerializer(serializers.Serializer):
+    base = serializers.CharField(default='USD')
+    symbols = serializers.CharField(required=False)
+
+    def validate_base(self, value):
+        return value.strip().upper()
+
+    def validate_symbols(self, value):
+        return [symbol.strip().upper() for symbol in value.split(',') if symbol.strip()]
+
+
+class LatestQuerySerializer(serializers.Serializer):
+    """
+    The long poll of /latest/: since is the created of the row or the
+    ETag the client has, wait the seconds to wait for a newer one.
+    """
+    since = serializers.CharField(required=False)
+    wait = serializers.IntegerField(min_value=0, default=0)
+
+    def validate_since(self, value):
+        try:
+            created = parse_datetime(value.strip().replace(' ', '+'))
+        except ValueError:
+            raise serializers.ValidationError('Enter a valid date and time.')
+        if created is not None:
+            if timezone.is_naive(created):
+                created = timezone.make_aware(created, timezone.utc)
+            return created
+        value = value.strip()
+        if value.startswith('W/'):
+            value = value[2:]
+        return value if value.startswith('"') else f'"{value}"'
+
+    def validate_wait(self, value):
+        if value > settings.LATEST_MAX_WAIT:
+            raise serializers.ValidationError(
+                f'Ensure this value is less than or equal to {settings.LATEST_MAX_WAIT}.'
+            )
+        return value
+
+
+class RateRollupSerializer(serializers.ModelSerializer):
+    mean = serializers.DecimalField(max_digits=16, decimal_places=6)
+
+    class Meta:
+        model = RateRollup
+        fields = [
+            'period', 'bucket', 'provider', 'open', 'high', 'low', 'close',
+            'mean', 'count',
+        ]
+
+
 class ApiKeySerializer(serializers.ModelSerializer):
     class Meta:
         model = ApiKey
@@ -60,10 +143,8 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         ]
 
     def get_percentage_usage(self, obj):
-        if obj.usage is None or obj.usage_end_date is None:
-            return 0
-        else:
-            return (obj.usage * 100) / settings.MAX_REQUEST_USAGE
+        # The usage of the current window, like the usage limit of /latest/
+        return (usage_counter.usage(obj) * 100) / settings.MAX_REQUEST_USAGE
 
     def validate_email(self, value):
         if User.objects.filter(email=value).count() > 0:
@@ -71,6 +152,5 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         return value
 
     def create(self, validated_data):
-        dt = datetime.utcnow().replace(tzinfo=utc) + timedelta(days=30)
-        validated_data['usage_end_date'] = dt.date()
+        validated_data['usage_end_date'] = utc_today() + USAGE_PERIOD
         return User.objects.create_user(**validated_data)
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import ApiKey, ExchangeRateHistory, User
+from utils.authentication import api_key_cache, bump_api_keys_version, expire_api_keys
+from utils.provider_rates import complete_rate
+from utils.rate_cache import latest_rate_cache, publish_rate
+from utils.rollups import update_rollups
+
+
+@receiver(post_save, sender=ExchangeRateHistory)
+def share_latest_rate(sender, instance, created, **kwargs):
+    """Share the new rate with the other processes once it is committed"""
+    if created:
+        latest_rate_cache.invalidate()
+        transaction.on_commit(lambda: publish_rate(complete_rate(instance)))
+
+
+@receiver(post_save, sender=ExchangeRateHistory)
+def update_rate_rollups(sender, instance, created, **kwargs):
+    """Add the new rates to the hourly and daily rollups"""
+    if created:
+        update_rollups(instance)
+
+
+@receiver(post_save, sender=ApiKey)
+@receiver(post_delete, sender=ApiKey)
+def expire_api_key(sender, instance, **kwargs):
+    """
+    A changed or revoked key stops working right away in every process
+    of the node, and after API_KEY_VERSION_CHECK seconds in the others
+    """
+    if instance.api_key is not None:
+        api_key_cache.invalidate(instance.api_key)
+    bump_api_keys_version()
+    transaction.on_commit(expire_api_keys)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def expire_user_api_keys(sender, instance, created=False, update_fields=None, **kwargs):
+    """The keys of a deactivated or deleted user stop working too"""
+    if created or (update_fields is not None and 'is_active' not in update_fields):
+        return
+    bump_api_keys_version()
+    transaction.on_commit(expire_api_keys)
@@ -1,17 +1,56 @@
+import os
+import csv
+import asyncio
+import gzip
+import time
+import shutil
+import tempfile
+from importlib import import_module
+from io import StringIO
 from json import loads
 from uuid import uuid4
-from datetime import datetime, timedelta
+from decimal import Decimal
+from datetime import date, datetime, timedelta
+from unittest.mock import patch
+from asgiref.sync import async_to_sync, sync_to_async
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
 from django.contrib.auth import get_user_model
 from django.shortcuts import reverse
+from django.apps import apps
 from django.conf import settings
 from django.utils.timezone import utc
 
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
 
-from core.models import ApiKey
+from benchmarks.boot import LAZY_MODULES, boot
+from core.models import (
+    ApiKey, CurrencyRates, ExchangeRateHistory, Lease, ProviderRate, RateRollup)
+from core.serializers import UserSerializer
+from core.views import AsyncExchangeRateView, RateEventsView
+from utils import http_client
+from utils.asgi import ASGIHandler, AsyncStreamingResponse, _receive
+from utils.archive import archive_history
+from utils.authentication import ApiKeyCache, api_key_cache
+from utils.circuit_breaker import CircuitBreaker, get_breaker
+from utils.currency_rates import cross_rates_cache
+from utils.rate_cache import LatestRateCache, latest_rate_cache, latest_snapshot, render_rate
+from utils.rate_events import HEARTBEAT, get_broadcaster, missed_rates
+from utils.shared_snapshot import HEADER, SharedSnapshot
+from utils.exchange_rates_sources import (
+    fetch_rates, fetch_rates_async, get_dof_rate, parse_banxico_rate,
+    parse_banxico_series, parse_dof_rate, parse_fixer_rate, table_cells)
+from utils.refresh import REFRESH_LEASE, refresh_exchange_rate, refresh_if_outdated
+from utils.provider_rates import latest_provider_rates, latest_rate, with_latest_rates
+from utils.quota import USAGE_PERIOD
+from utils.throttling import SlidingWindowLimiter, rate_limiter
+from utils.usage import UsageCounter, usage_counter
 
 User = get_user_model()
 
@@ -318,6 +357,10 @@ class ApiKeyTestCase(TestCase):
 class ExchangeRateTestCase(TestCase):
     def setUp(self):
         """Set up"""
+        latest_rate_cache.clear()
+        usage_counter.clear()
+        self.addCleanup(usage_counter.clear)
+        rate_limiter.clear()
         self.user = User.objects.create_user(**user_data)
         self.key = ApiKey.objects.create(
             user=self.user,
@@ -421,3 +464,1928 @@ class ExchangeRateTestCase(TestCase):
         user['username'] = 'usage_end_date'
         user = User.objects.create_user(**user)
         self.assertEqual(user.check_usage_limit(), True)
+
+
+def fake_provider(rate, latency=0):
+    def fetch():
+        time.sleep(latency)
+        return {
+            'date': today,
+            'rate': Decimal(rate),
+        }
+
+    return fetch
+
+
+def failing_provider():
+    return None
+
+
+@patch.dict('utils.circuit_breaker._breakers', clear=True)
+class ExchangeRateRefreshTestCase(TestCase):
+    def test_fetch_rates_is_concurrent(self):
+        """Fetch rates takes about the slowest provider"""
+        providers = {
+            'dof': fake_provider('20.1', 0.3),
+            'fixer': fake_provider('20.2', 0.3),
+            'banxico': fake_provider('20.3', 0.3),
+        }
+        start = time.perf_counter()
+        data = fetch_rates(providers)
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(data['dof']['rate'], Decimal('20.1'))
+        self.assertEqual(data['fixer']['rate'], Decimal('20.2'))
+        self.assertEqual(data['banxico']['rate'], Decimal('20.3'))
+
+    def test_fetch_rates_provider_error(self):
+        """A provider that raises returns None"""
+        def broken():
+            raise ValueError('broken page')
+
+        data = fetch_rates({'dof': broken, 'fixer': fake_provider('20.2')})
+        self.assertIsNone(data['dof'])
+        self.assertEqual(data['fixer']['rate'], Decimal('20.2'))
+
+    def test_refresh_first_rate_needs_all_providers(self):
+        """First refresh fails if a provider fails"""
+        providers = {
+            'dof': fake_provider('20.1'),
+            'fixer': failing_provider,
+            'banxico': fake_provider('20.3'),
+        }
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers):
+            self.assertIsNone(refresh_exchange_rate())
+        self.assertEqual(ExchangeRateHistory.objects.count(), 0)
+
+    def test_refresh_keeps_failed_provider_values(self):
+        """Refresh keeps the previous values of the providers that fail"""
+        providers = {
+            'dof': fake_provider('20.1'),
+            'fixer': fake_provider('20.2'),
+            'banxico': fake_provider('20.3'),
+        }
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers):
+            first = refresh_exchange_rate()
+
+        providers = {
+            'dof': fake_provider('21.1'),
+            'fixer': failing_provider,
+            'banxico': fake_provider('21.3'),
+        }
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers):
+            second = refresh_exchange_rate(
+                ExchangeRateHistory.objects.get(pk=first.pk)
+            )
+
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertEqual(ExchangeRateHistory.objects.count(), 2)
+        self.assertEqual(second.fixer_rate, Decimal('20.2'))
+        latest = latest_rate()
+        self.assertEqual(latest.pk, second.pk)
+        self.assertEqual(latest.dof_rate, Decimal('21.1'))
+        self.assertEqual(latest.fixer_rate, Decimal('20.2'))
+        self.assertEqual(latest.fixer_last_updated, first.fixer_last_updated)
+        self.assertEqual(latest.banxico_rate, Decimal('21.3'))
+
+        # The row only stores the rates fetched
+        second.refresh_from_db()
+        self.assertEqual(second.dof_rate, Decimal('21.1'))
+        self.assertIsNone(second.fixer_rate)
+        self.assertIsNone(second.fixer_last_updated)
+
+
+providers_ok = {
+    'dof': fake_provider('20.1'),
+    'fixer': fake_provider('20.2'),
+    'banxico': fake_provider('20.3'),
+}
+
+
+@patch.dict('utils.circuit_breaker._breakers', clear=True)
+class BackgroundRefreshTestCase(TestCase):
+    def setUp(self):
+        latest_rate_cache.clear()
+        self.user = User.objects.create_user(**user_data)
+
+    def test_lease_has_one_owner(self):
+        """Only one owner holds the lease until it expires"""
+        self.assertTrue(Lease.acquire('test', 'worker-1', 60))
+        self.assertFalse(Lease.acquire('test', 'worker-2', 60))
+        self.assertTrue(Lease.acquire('test', 'worker-1', 60))
+        Lease.release('test', 'worker-1')
+        self.assertTrue(Lease.acquire('test', 'worker-2', 60))
+
+    def test_expired_lease_can_be_taken(self):
+        """An expired lease can be taken by other owner"""
+        self.assertTrue(Lease.acquire('test', 'worker-1', -1))
+        self.assertTrue(Lease.acquire('test', 'worker-2', 60))
+        self.assertFalse(Lease.acquire('test', 'worker-1', 60))
+
+    def test_worker_refreshes_rates(self):
+        """refresh_rates worker saves the rates and releases the lease"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            call_command('refresh_rates', '--once', stdout=StringIO())
+        self.assertEqual(ExchangeRateHistory.objects.count(), 1)
+        self.assertTrue(Lease.acquire(REFRESH_LEASE, 'other', 60))
+
+    def test_worker_without_lease_does_nothing(self):
+        """refresh_rates worker without the lease does not refresh"""
+        Lease.acquire(REFRESH_LEASE, 'other', 60)
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            call_command('refresh_rates', '--once')
+        self.assertEqual(ExchangeRateHistory.objects.count(), 0)
+
+    @override_settings(EXCHANGE_RATE_BACKGROUND_REFRESH=True)
+    def test_latest_does_not_fetch_with_worker(self):
+        """/latest/ only reads the rates with the background refresh"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with patch('utils.refresh.fetch_rates') as fetch:
+            response = client.get(reverse('latest'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(fetch.called)
+
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            call_command('refresh_rates', '--once', stdout=StringIO())
+        with patch('utils.refresh.fetch_rates') as fetch:
+            response = client.get(reverse('latest'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(fetch.called)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Keep-alive HTTP server answering with the queued status codes"""
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+    body = b'{}'
+
+    def do_GET(self):
+        code = self.statuses.pop(0) if self.statuses else 200
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in_server(handler=StandInHandler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/'
+
+
+@override_settings(PROVIDER_RETRY_BACKOFF=0)
+class HttpClientTestCase(TestCase):
+    def setUp(self):
+        self.server, self.url = start_stand_in_server()
+        StandInHandler.statuses = []
+        patcher = patch.object(http_client, '_session', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        """The providers reuse the keep-alive connection"""
+        for _ in range(5):
+            self.assertEqual(http_client.get('fixer', self.url).status_code, 200)
+        stats = http_client.connection_stats()
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['opened'], 1)
+        self.assertEqual(stats['reused'], 4)
+
+    def test_retries_server_errors(self):
+        """Server errors are retried a bounded number of times"""
+        StandInHandler.statuses = [503, 502]
+        self.assertEqual(http_client.get('dof', self.url).status_code, 200)
+
+        StandInHandler.statuses = [503, 503, 503, 503]
+        self.assertEqual(http_client.get('dof', self.url).status_code, 503)
+        self.assertEqual(StandInHandler.statuses, [503])
+
+    def test_provider_timeout(self):
+        """Requests use the timeout of the provider"""
+        with override_settings(PROVIDER_TIMEOUTS={'banxico': 1.5}):
+            with patch('requests.Session.get') as get:
+                http_client.get('banxico', self.url)
+                http_client.get('other', self.url)
+        self.assertEqual(get.call_args_list[0].kwargs['timeout'], 1.5)
+        self.assertEqual(
+            get.call_args_list[1].kwargs['timeout'], settings.PROVIDER_TIMEOUT
+        )
+
+
+def dof_page(rates):
+    """DOF page with the rates table after eight layout tables"""
+    rows = ''.join(
+        f'<tr><td>\r\n {day} \r\n</td><td>\r\n {rate} \r\n</td>'
+        '<td>1</td><td>2</td></tr>'
+        for day, rate in rates
+    )
+    return (
+        '<html><body>'
+        + '<table><tr><td>layout</td></tr></table>' * 8
+        + '<table><tr><td>title</td></tr>'
+        + '<tr><td>Fecha</td><td>DOF</td><td>FIX</td><td>Pagos</td></tr>'
+        + rows
+        + '</table><table><tr><td>footer</td></tr></table></body></html>'
+    )
+
+
+def read_payload(name):
+    path = settings.BASE_DIR / 'benchmarks' / 'payloads' / name
+    with open(path, newline='') as f:
+        return f.read()
+
+
+class ProviderParsersTestCase(TestCase):
+    def test_parse_banxico_recorded_payload(self):
+        """Banxico parser reads the recorded payload"""
+        data = parse_banxico_rate(read_payload('banxico.xml'))
+        self.assertEqual(data['date'], date(2022, 1, 31))
+        self.assertEqual(data['rate'], Decimal('20.6887'))
+
+    def test_parse_fixer_recorded_payload(self):
+        """Fixer parser converts the EUR based rates to USD"""
+        data = parse_fixer_rate(loads(read_payload('fixer.json')))
+        self.assertEqual(data['date'], date(2022, 1, 31))
+        self.assertEqual(data['rate'], Decimal('20.6832'))
+
+    def test_parse_dof_recorded_page(self):
+        """DOF parser reads the recorded page"""
+        data = parse_dof_rate(read_payload('dof.html'))
+        self.assertEqual(data['date'], date(2022, 1, 28))
+        self.assertEqual(data['rate'], Decimal('20.4717'))
+
+    def test_parse_skips_not_available(self):
+        """DOF parser skips the dates without rate"""
+        data = parse_dof_rate(dof_page([
+            ('31/01/2022', 'N/E'),
+            ('30/01/2022', '20.5000'),
+        ]))
+        self.assertEqual(data['date'], date(2022, 1, 30))
+        self.assertEqual(data['rate'], Decimal('20.5'))
+
+    def test_parse_all_not_available(self):
+        """DOF parser returns None if no date has rate"""
+        rates = [(f'{day:02}/01/2022', 'N/E') for day in range(1, 10)]
+        self.assertIsNone(parse_dof_rate(dof_page(rates)))
+
+    def test_table_cells_nested_tables(self):
+        """Table cells include the cells of nested tables in order"""
+        html = (
+            '<table><tr><td>a</td></tr></table>'
+            '<table><tr><td>b<table><tr><td>c</td></tr></table></td>'
+            '<td>d &amp; e</td></tr></table>'
+        )
+        self.assertEqual(table_cells(html, 1, 10), ['bc', 'c', 'd & e'])
+        self.assertEqual(table_cells(html, 2, 10), ['c'])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@patch.dict('utils.circuit_breaker._breakers', clear=True)
+@override_settings(CIRCUIT_BREAKER_FAILURES=2, CIRCUIT_BREAKER_RESET=60)
+class CircuitBreakerTestCase(TestCase):
+    def test_breaker_states(self):
+        """Circuit opens after the failures and closes after a good trial"""
+        clock = FakeClock()
+        breaker = CircuitBreaker('test', 2, 60, clock=clock)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow_request())
+
+        clock.now = 60
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+
+        clock.now = 120
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(breaker.failures, 0)
+
+    def test_cancelled_fetch_gives_back_the_trial(self):
+        """A fetch cancelled during the trial of a half-open circuit lets the next one through"""
+        clock = FakeClock()
+        breaker = get_breaker('dof')
+        breaker.clock = clock
+        breaker.record_failure()
+        breaker.record_failure()
+        clock.now = 60
+
+        async def hanging():
+            await asyncio.sleep(60)
+
+        async def cancel_fetch():
+            task = asyncio.ensure_future(fetch_rates_async({'dof': get_dof_rate}))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with patch.dict('utils.exchange_rates_sources.ASYNC_PROVIDERS', {get_dof_rate: hanging}):
+            async_to_sync(cancel_fetch)()
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertTrue(breaker.allow_request())
+
+    def test_open_circuit_serves_last_good_fields(self):
+        """Refresh does not call a provider with open circuit"""
+        calls = []
+
+        def broken_fixer():
+            calls.append(1)
+            return None
+
+        providers = dict(providers_ok)
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers):
+            last_rate = refresh_exchange_rate()
+
+        providers['fixer'] = broken_fixer
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers):
+            for _ in range(4):
+                last_rate = refresh_exchange_rate(last_rate)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(get_breaker('fixer').state, 'open')
+        self.assertEqual(get_breaker('dof').state, 'closed')
+        self.assertEqual(last_rate.fixer_rate, Decimal('20.2'))
+
+    def test_status(self):
+        """Status shows the circuit of every provider to a superuser only"""
+        get_breaker('banxico').record_failure()
+        get_breaker('banxico').record_failure()
+        client = APIClient()
+        self.assertEqual(client.get(reverse('status')).status_code, status.HTTP_403_FORBIDDEN)
+        user = User.objects.create_user(**user_data)
+        client.force_authenticate(user)
+        self.assertEqual(client.get(reverse('status')).status_code, status.HTTP_403_FORBIDDEN)
+        user.is_superuser = True
+        user.save()
+        response = client.get(reverse('status'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = loads(response.content)
+        self.assertEqual(data['providers']['banxico']['state'], 'open')
+        self.assertEqual(data['providers']['dof']['state'], 'closed')
+        self.assertIn('reused', data['connections'])
+
+
+class BanxicoSeriesHandler(StandInHandler):
+    body = (
+        b'<?xml version="1.0" encoding="UTF-8"?><series>'
+        b'<serie idSerie="SF43718" titulo="FIX">'
+        b'<Obs><fecha>03/01/2022</fecha><dato>20.5000</dato></Obs>'
+        b'<Obs><fecha>04/01/2022</fecha><dato>N/E</dato></Obs>'
+        b'<Obs><fecha>05/01/2022</fecha><dato>20.7000</dato></Obs>'
+        b'</serie>'
+        b'<serie idSerie="SF60653" titulo="DOF">'
+        b'<Obs><fecha>04/01/2022</fecha><dato>20.5000</dato></Obs>'
+        b'</serie></series>'
+    )
+
+
+class BackfillTestCase(TestCase):
+    def setUp(self):
+        self.server, url = start_stand_in_server(BanxicoSeriesHandler)
+        self.settings_override = override_settings(BANXICO_API_URL=url.rstrip('/'))
+        self.settings_override.enable()
+        patcher = patch.object(http_client, '_session', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dump = tempfile.NamedTemporaryFile('w', suffix='.csv')
+        self.dump.write(
+            'provider,date,rate\n'
+            'fixer,2022-01-03,20.4000\n'
+            'fixer,05/01/2022,20.6000\n'
+            'fixer,2022-02-01,21.0000\n'
+        )
+        self.dump.flush()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.server.shutdown()
+        self.server.server_close()
+        self.dump.close()
+
+    def test_parse_banxico_series(self):
+        """Banxico series parser skips the dates without rate"""
+        series = parse_banxico_series(BanxicoSeriesHandler.body)
+        self.assertEqual(len(series['SF43718']), 2)
+        self.assertEqual(series['SF60653'], [(date(2022, 1, 4), Decimal('20.5'))])
+
+    def test_backfill(self):
+        """Backfill writes one row per date with the rates of that date"""
+        call_command(
+            'backfill_rates', '2022-01-01', '2022-01-31',
+            '--file', self.dump.name, stdout=StringIO(),
+        )
+        rows = list(ExchangeRateHistory.objects.order_by('created'))
+        self.assertEqual(len(rows), 3)
+        first, second, third = rows
+        self.assertEqual(first.created.date(), date(2022, 1, 3))
+        self.assertEqual(first.banxico_rate, Decimal('20.5'))
+        self.assertEqual(first.fixer_rate, Decimal('20.4'))
+        self.assertIsNone(first.dof_rate)
+        self.assertEqual(second.dof_date, date(2022, 1, 4))
+        self.assertIsNone(second.banxico_date)
+        self.assertEqual(third.banxico_rate, Decimal('20.7'))
+        self.assertEqual(third.fixer_rate, Decimal('20.6'))
+        self.assertIsNone(third.dof_rate)
+
+        # The previous rates are read from provider_rate
+        first, second, third = with_latest_rates(ExchangeRateHistory.objects.order_by('created'))
+        self.assertEqual(second.banxico_date, date(2022, 1, 3))
+        self.assertEqual(third.dof_rate, Decimal('20.5'))
+
+    def test_backfill_is_idempotent(self):
+        """Backfill skips the rates already stored"""
+        for window in ('2', '31', '31'):
+            call_command(
+                'backfill_rates', '2022-01-01', '2022-01-31',
+                '--file', self.dump.name, '--window-days', window,
+                stdout=StringIO(),
+            )
+        self.assertEqual(ExchangeRateHistory.objects.count(), 3)
+
+    def test_backfill_dump_only(self):
+        """Backfill can read only the dumps"""
+        call_command(
+            'backfill_rates', '2022-01-01', '2022-12-31',
+            '--file', self.dump.name, '--no-api', stdout=StringIO(),
+        )
+        self.assertEqual(
+            list(ExchangeRateHistory.objects.values_list('fixer_rate', flat=True)),
+            [Decimal('21'), Decimal('20.6'), Decimal('20.4')],
+        )
+
+
+class SingleFlightRefreshTestCase(TransactionTestCase):
+    def setUp(self):
+        patcher = patch.dict('utils.circuit_breaker._breakers', clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = []
+
+        def counted(rate):
+            fetch = fake_provider(rate, 0.2)
+
+            def provider():
+                self.calls.append(rate)
+                return fetch()
+
+            return provider
+
+        self.providers = {
+            'dof': counted('21.1'),
+            'fixer': counted('21.2'),
+            'banxico': counted('21.3'),
+        }
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            self.stale = refresh_exchange_rate()
+        self.stale.created = self.stale.created - timedelta(
+            minutes=settings.EXCHANGE_RATE_UPDATE_INTERVAL + 1
+        )
+        self.stale.save()
+
+    def test_one_refresh_per_interval(self):
+        """Concurrent requests with an outdated rate refresh only once"""
+        results = []
+
+        def request():
+            last_rate = ExchangeRateHistory.objects.get(pk=self.stale.pk)
+            start = time.perf_counter()
+            rate = refresh_if_outdated(last_rate)
+            results.append((rate.pk, time.perf_counter() - start))
+            connection.close()
+
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', self.providers):
+            threads = [Thread(target=request) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # The new rate is not outdated, so nobody refreshes again
+            refresh_if_outdated(ExchangeRateHistory.objects.first())
+
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(ExchangeRateHistory.objects.count(), 2)
+        served_stale = [elapsed for pk, elapsed in results if pk == self.stale.pk]
+        self.assertEqual(len(served_stale), 7)
+        self.assertLess(max(served_stale), 0.2)
+
+    def test_lease_held_by_other_process(self):
+        """A request serves the previous rate while other process refreshes"""
+        Lease.acquire(REFRESH_LEASE, 'other-host:1', 60)
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', self.providers):
+            rate = refresh_if_outdated(self.stale)
+        self.assertEqual(rate.pk, self.stale.pk)
+        self.assertEqual(self.calls, [])
+
+    def test_rate_refreshed_by_other_process(self):
+        """A request does not refresh if other process just did it"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            fresh = refresh_exchange_rate(
+                ExchangeRateHistory.objects.get(pk=self.stale.pk)
+            )
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', self.providers):
+            rate = refresh_if_outdated(self.stale)
+        self.assertEqual(rate.pk, fresh.pk)
+        self.assertEqual(self.calls, [])
+
+
+@patch.dict('utils.circuit_breaker._breakers', clear=True)
+class LatestRateCacheTestCase(TestCase):
+    def setUp(self):
+        latest_rate_cache.clear()
+        usage_counter.clear()
+        self.addCleanup(usage_counter.clear)
+        rate_limiter.clear()
+        self.user = User.objects.create_user(
+            usage_end_date=today + timedelta(days=30),
+            **user_data,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_latest_is_cached(self):
+        """/latest/ does not query the database while the rate is cached"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            rate = refresh_exchange_rate()
+        latest_rate_cache.get()
+        hits = latest_rate_cache.hits
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('latest'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(loads(response.content)['provider_1']['rate'], 20.1)
+        self.assertEqual(latest_rate_cache.hits, hits + 1)
+        self.assertEqual(latest_rate_cache.rate.pk, rate.pk)
+
+    def test_cache_expires_with_next_refresh(self):
+        """The cached rate expires when its refresh is due"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            rate = refresh_exchange_rate()
+        latest_rate_cache.get()
+        self.assertEqual(
+            latest_rate_cache.expires,
+            rate.created + timedelta(minutes=settings.EXCHANGE_RATE_UPDATE_INTERVAL),
+        )
+        latest_rate_cache.expires = rate.created
+        misses = latest_rate_cache.misses
+        self.assertEqual(latest_rate_cache.get().pk, rate.pk)
+        self.assertEqual(latest_rate_cache.misses, misses + 1)
+
+    def test_new_rate_is_shared(self):
+        """A new rate is shared with the caches of the other processes"""
+        other_process = LatestRateCache()
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            first = refresh_exchange_rate()
+            self.assertEqual(other_process.get().pk, first.pk)
+            with self.captureOnCommitCallbacks(execute=True):
+                second = refresh_exchange_rate(first)
+
+        self.assertIsNone(latest_rate_cache.expires)
+        with self.assertNumQueries(0):
+            self.assertEqual(other_process.get().pk, second.pk)
+            self.assertEqual(latest_rate_cache.get().pk, second.pk)
+        self.assertEqual(other_process.get().fixer_rate, second.fixer_rate)
+        self.assertEqual(other_process.get().created, second.created)
+
+    def test_older_rate_is_not_shared(self):
+        """An older rate does not replace the shared one"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            with self.captureOnCommitCallbacks(execute=True):
+                rate = refresh_exchange_rate()
+        version = latest_snapshot().version()
+        with self.captureOnCommitCallbacks(execute=True):
+            ExchangeRateHistory.objects.create(created=rate.created - timedelta(days=1))
+        self.assertEqual(latest_snapshot().version(), version)
+        self.assertEqual(latest_rate_cache.get().pk, rate.pk)
+
+    def test_unreadable_snapshot_is_a_miss(self):
+        """A row shared by other schema or a broken one is read from the database"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            rate = refresh_exchange_rate()
+        for data in (b'{"id": 1}', b'{"id": 1, "created": "not a date"', b'[]'):
+            latest_rate_cache.invalidate()
+            latest_snapshot().update(lambda current: data)
+            self.assertEqual(latest_rate_cache.get().pk, rate.pk)
+            # And it is shared again
+            self.assertEqual(loads(latest_snapshot().read()[1])['id'], rate.pk)
+
+        # A new field is shared in other snapshot
+        fields = ExchangeRateHistory._meta.concrete_fields
+        path = latest_snapshot().path
+        with patch.object(ExchangeRateHistory._meta, 'concrete_fields', fields[:-1]):
+            self.assertNotEqual(latest_snapshot().path, path)
+
+    def test_latest_conditional_get(self):
+        """/latest/ answers 304 to a matching ETag or date and counts it"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            rate = refresh_exchange_rate()
+        response = self.client.get(reverse('latest'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        self.assertEqual(
+            response.content,
+            self.client.get(reverse('latest')).content,
+        )
+
+        response = self.client.get(reverse('latest'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(reverse('latest'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        usage_counter.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.usage, 4)
+
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            with self.captureOnCommitCallbacks(execute=True):
+                refresh_exchange_rate(rate)
+        response = self.client.get(reverse('latest'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_shared_snapshot(self):
+        """Shared snapshot versions every write"""
+        path = tempfile.NamedTemporaryFile(delete=False).name
+        self.addCleanup(os.remove, path)
+        writer = SharedSnapshot(path, 64)
+        reader = SharedSnapshot(path, 64)
+        self.assertEqual(reader.read(), (0, None))
+        self.assertEqual(writer.update(lambda current: b'first'), 1)
+        self.assertEqual(reader.read(), (1, b'first'))
+        self.assertEqual(writer.update(lambda current: None), 1)
+        self.assertEqual(writer.update(lambda current: current + b'!'), 2)
+        self.assertEqual(reader.read(), (2, b'first!'))
+        self.assertEqual(writer.clear(), 3)
+        self.assertEqual(reader.read(), (3, None))
+        with self.assertRaises(ValueError):
+            writer.update(lambda current: b'x' * 64)
+
+    def test_shared_snapshot_torn_write(self):
+        """A writer killed in the middle of a write does not block the readers"""
+        path = tempfile.NamedTemporaryFile(delete=False).name
+        self.addCleanup(os.remove, path)
+        writer = SharedSnapshot(path, 64)
+        reader = SharedSnapshot(path, 64)
+        writer.update(lambda current: b'first')
+        # The seq of a write that never finished
+        HEADER.pack_into(writer.open(), 0, 3, 5)
+        self.assertEqual(reader.read(), (1, None))
+
+        # The next write starts from a consistent seq
+        self.assertEqual(writer.update(lambda current: current or b'second'), 3)
+        self.assertEqual(reader.read(), (3, b'second'))
+        self.assertEqual(writer.update(lambda current: current + b'!'), 4)
+        self.assertEqual(reader.read(), (4, b'second!'))
+
+    def test_shared_snapshot_threads(self):
+        """The writes of the threads of a process do not interleave"""
+        path = tempfile.NamedTemporaryFile(delete=False).name
+        self.addCleanup(os.remove, path)
+        snapshot = SharedSnapshot(path, 64)
+
+        def add_one(current):
+            value = int(current or 0) + 1
+            # Let other thread run in the middle of the write
+            time.sleep(0)
+            return str(value).encode()
+
+        def increment():
+            for _ in range(200):
+                snapshot.update(add_one)
+
+        threads = [Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(snapshot.read(), (1600, b'1600'))
+
+
+class ApiKeyAuthenticationTestCase(TestCase):
+    def setUp(self):
+        latest_rate_cache.clear()
+        api_key_cache.clear()
+        usage_counter.clear()
+        self.addCleanup(usage_counter.clear)
+        rate_limiter.clear()
+        self.user = User.objects.create_user(
+            usage_end_date=today + timedelta(days=30),
+            **user_data,
+        )
+        self.key = ApiKey.objects.create(user=self.user, name='app', api_key=uuid4())
+        with self.captureOnCommitCallbacks(execute=True):
+            ExchangeRateHistory.objects.create()
+        latest_rate_cache.get()
+        self.url = f'{reverse("latest")}?api_key={self.key.api_key}'
+
+    def test_api_key_is_cached(self):
+        """The key is read with its user in one query and then cached"""
+        # And the version of the api keys of the other nodes
+        with self.assertNumQueries(2):
+            response = APIClient().get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.key.api_key}')
+        with self.assertNumQueries(0):
+            response = client.get(reverse('latest'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        usage_counter.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.usage, 2)
+
+    def test_invalid_api_key(self):
+        """A malformed key is a bad request and an unknown one is not found"""
+        response = APIClient().get(f'{reverse("latest")}?api_key=invalid')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = APIClient().get(f'{reverse("latest")}?api_key={uuid4()}')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_revoked_api_key(self):
+        """A deleted key stops working right away, also in other processes"""
+        other_process = ApiKeyCache()
+        self.assertEqual(other_process.get(self.key.api_key).pk, self.user.pk)
+        self.assertEqual(APIClient().get(self.url).status_code, status.HTTP_200_OK)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.delete(f'{reverse("key-list")}{self.key.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(APIClient().get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(other_process.get(self.key.api_key))
+
+    @override_settings(API_KEY_VERSION_CHECK=5)
+    def test_revoked_in_other_node(self):
+        """A key revoked in other node stops working after the version check"""
+        clock = FakeClock()
+        other_node = ApiKeyCache(clock=clock)
+        self.assertEqual(other_node.get(self.key.api_key).pk, self.user.pk)
+
+        # Other node has its own snapshot, only the database is shared
+        with patch('core.signals.expire_api_keys'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.key.delete()
+        self.assertEqual(other_node.get(self.key.api_key).pk, self.user.pk)
+        clock.now = 5
+        self.assertIsNone(other_node.get(self.key.api_key))
+
+    def test_inactive_user(self):
+        """The keys of a deactivated user stop working"""
+        self.assertEqual(APIClient().get(self.url).status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(APIClient().get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(API_KEY_CACHE_SIZE=2, API_KEY_CACHE_TTL=60)
+    def test_cache_is_bounded(self):
+        """The least recently used keys are dropped and entries expire"""
+        clock = FakeClock()
+        cache = ApiKeyCache(clock=clock)
+        keys = [
+            ApiKey.objects.create(user=self.user, name=str(i), api_key=uuid4()).api_key
+            for i in range(3)
+        ]
+        for key in keys:
+            cache.get(key)
+        self.assertEqual(list(cache.users), keys[1:])
+        cache.get(keys[1])
+        self.assertEqual(list(cache.users), [keys[2], keys[1]])
+
+        with self.assertNumQueries(0):
+            cache.get(keys[2])
+        clock.now = 60
+        # The key and the version of the api keys, checked again
+        with self.assertNumQueries(2):
+            cache.get(keys[2])
+
+    def test_usage_limit(self):
+        """The usage is counted in the database up to the limit"""
+        User.objects.filter(pk=self.user.pk).update(usage=settings.MAX_REQUEST_USAGE - 1)
+        self.assertEqual(APIClient().get(self.url).status_code, status.HTTP_200_OK)
+        self.assertEqual(APIClient().get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        usage_counter.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.usage, settings.MAX_REQUEST_USAGE)
+
+
+@override_settings(USAGE_FLUSH_INTERVAL=60)
+class UsageCounterTestCase(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.counter = UsageCounter(stripes=4, clock=self.clock)
+        self.user = User.objects.create_user(
+            usage_end_date=today + timedelta(days=30),
+            **user_data,
+        )
+        self.other = User.objects.create_user(
+            usage_end_date=today + timedelta(days=30),
+            **user_error_data,
+        )
+
+    def test_usage_is_flushed(self):
+        """The usage is written once per flush interval"""
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                self.counter.add(self.user)
+            self.counter.add(self.other, 4)
+        self.assertEqual(self.counter.pending(self.user.pk), 3)
+
+        self.clock.now = 60
+        # One UPDATE for both users and one SELECT of their usage, plus
+        # the savepoint of the transaction inside the test
+        with self.assertNumQueries(4):
+            self.counter.add(self.user)
+        self.assertEqual(self.counter.pending(self.user.pk), 0)
+        self.user.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.user.usage, 4)
+        self.assertEqual(self.other.usage, 4)
+        self.assertEqual(self.counter.flush(), 0)
+
+    def test_quota_includes_pending_usage(self):
+        """The quota counts the usage not flushed and the one read back"""
+        User.objects.filter(pk=self.user.pk).update(usage=settings.MAX_REQUEST_USAGE - 2)
+        self.user.usage = 0
+        self.assertFalse(self.counter.check_usage_limit(self.user))
+        self.counter.add(self.user)
+        self.counter.flush()
+
+        # A cached user older than the flush
+        self.user.usage = 0
+        self.assertFalse(self.counter.check_usage_limit(self.user))
+        self.counter.add(self.user)
+        self.user.usage = 0
+        self.assertTrue(self.counter.check_usage_limit(self.user))
+
+    def test_failed_flush_keeps_counts(self):
+        """The counts of a failed flush are written by the next one"""
+        self.counter.add(self.user, 2)
+        with patch('utils.usage.User.objects.filter', side_effect=DatabaseError):
+            self.assertEqual(self.counter.flush(), 0)
+        self.assertEqual(self.counter.pending(self.user.pk), 2)
+        self.assertEqual(self.counter.flush(), 2)
+
+    def test_concurrent_requests(self):
+        """No increment is lost with concurrent requests of the same user"""
+        def requests():
+            for _ in range(500):
+                self.counter.add(self.user)
+
+        threads = [Thread(target=requests) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.counter.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.usage, 4000)
+
+
+class RateLimitTestCase(TestCase):
+    def setUp(self):
+        latest_rate_cache.clear()
+        api_key_cache.clear()
+        usage_counter.clear()
+        self.addCleanup(usage_counter.clear)
+        rate_limiter.clear()
+        self.user = User.objects.create_user(
+            usage_end_date=today + timedelta(days=30),
+            **user_data,
+        )
+        self.keys = [
+            ApiKey.objects.create(user=self.user, name=str(i), api_key=uuid4())
+            for i in range(2)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            ExchangeRateHistory.objects.create()
+
+    def get(self, key):
+        return APIClient().get(f'{reverse("latest")}?api_key={key.api_key}')
+
+    def test_sliding_window(self):
+        """The previous window counts for the part still inside the window"""
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter(clock=clock)
+        limits = [('key', 2, 10)]
+        self.assertEqual(limiter.hit(1, limits), (True, None, (2, 1, 10)))
+        clock.now = 5
+        self.assertEqual(limiter.hit(1, limits), (True, None, (2, 0, 5)))
+        allowed, wait, _ = limiter.hit(1, limits)
+        self.assertFalse(allowed)
+        self.assertEqual(wait, 10)
+
+        # Half of the previous window is still inside
+        clock.now = 15
+        self.assertEqual(limiter.hit(1, limits), (True, None, (2, 0, 5)))
+        self.assertFalse(limiter.hit(1, limits)[0])
+        clock.now = 30
+        self.assertTrue(limiter.hit(1, limits)[0])
+
+    def test_rejected_request_is_not_counted(self):
+        """A request over one limit does not count for the others"""
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter(clock=clock)
+        limits = [('second', 1, 1), ('minute', 2, 60)]
+        self.assertTrue(limiter.hit(1, limits)[0])
+        self.assertFalse(limiter.hit(1, limits)[0])
+        clock.now = 2
+        self.assertTrue(limiter.hit(1, limits)[0])
+        # The 2 requests of the minute leave the window once it is moved
+        # by half of it
+        self.assertEqual(limiter.hit(1, limits)[1], 88)
+
+    @override_settings(RATE_LIMIT_KEY=(2, 0), RATE_LIMIT_USER=(3, 0))
+    def test_latest_is_throttled(self):
+        """/latest/ limits each key and each user with rate limit headers"""
+        patcher = patch.object(rate_limiter, 'clock', FakeClock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        response = self.get(self.keys[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-RateLimit-Limit'], '2')
+        self.assertEqual(response['X-RateLimit-Remaining'], '1')
+        self.assertEqual(response['X-RateLimit-Reset'], '1')
+        self.assertEqual(self.get(self.keys[0]).status_code, status.HTTP_200_OK)
+
+        response = self.get(self.keys[0])
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # The 2 requests leave the window once it is moved by half of it
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(response['X-RateLimit-Remaining'], '0')
+
+        # The other key of the user is only limited by the user limit
+        self.assertEqual(self.get(self.keys[1]).status_code, status.HTTP_200_OK)
+        response = self.get(self.keys[1])
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['X-RateLimit-Limit'], '3')
+
+        usage_counter.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.usage, 3)
+
+
+class QuotaTestCase(TestCase):
+    def setUp(self):
+        usage_counter.clear()
+        self.addCleanup(usage_counter.clear)
+        self.expired = User.objects.create_user(
+            usage=settings.MAX_REQUEST_USAGE,
+            usage_end_date=today - timedelta(days=1),
+            **user_data,
+        )
+        self.current = User.objects.create_user(
+            usage=10,
+            usage_end_date=today + timedelta(days=10),
+            **user_error_data,
+        )
+
+    def test_check_does_not_write(self):
+        """An expired window is a new one for the check without writing it"""
+        with self.assertNumQueries(0):
+            self.assertFalse(self.expired.check_usage_limit())
+            self.assertFalse(usage_counter.check_usage_limit(self.expired))
+        self.assertEqual(self.expired.usage_window(), (0, today + USAGE_PERIOD))
+        self.expired.refresh_from_db()
+        self.assertEqual(self.expired.usage, settings.MAX_REQUEST_USAGE)
+
+    def test_flush_starts_new_window(self):
+        """The flush starts the window of the users with an expired one"""
+        usage_counter.add(self.expired, 2)
+        usage_counter.add(self.current, 2)
+        usage_counter.flush()
+        self.expired.refresh_from_db()
+        self.current.refresh_from_db()
+        self.assertEqual(self.expired.usage, 2)
+        self.assertEqual(self.expired.usage_end_date, today + USAGE_PERIOD)
+        self.assertEqual(self.current.usage, 12)
+        self.assertEqual(self.current.usage_end_date, today + timedelta(days=10))
+
+    def test_reset_usage_windows(self):
+        """The command resets every expired window in one UPDATE"""
+        User.objects.create_user(username='new', email='new@testing.com')
+        out = StringIO()
+        with self.assertNumQueries(1):
+            call_command('reset_usage_windows', stdout=out)
+        self.assertIn('2 usage windows reset', out.getvalue())
+        self.assertEqual(
+            User.objects.filter(usage=0, usage_end_date=today + USAGE_PERIOD).count(),
+            2,
+        )
+        self.current.refresh_from_db()
+        self.assertEqual(self.current.usage, 10)
+
+    def test_percentage_usage(self):
+        """The percentage is the usage of the current window"""
+        usage_counter.add(self.current, 5)
+        data = UserSerializer(
+            [self.expired, self.current],
+            many=True,
+            context={'request': None},
+        ).data
+        self.assertEqual(data[0]['percentage_usage'], 0)
+        self.assertEqual(
+            data[1]['percentage_usage'],
+            15 * 100 / settings.MAX_REQUEST_USAGE,
+        )
+
+
+class ArchiveHistoryTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        now = datetime.utcnow().replace(tzinfo=utc)
+        ExchangeRateHistory.objects.bulk_create(
+            ExchangeRateHistory(
+                fixer_rate=Decimal('20.1'),
+                fixer_date=(now - timedelta(days=days)).date(),
+                created=now - timedelta(days=days),
+            )
+            for days in range(10, 0, -1)
+        )
+
+    def read_archives(self):
+        rows = []
+        for name in sorted(os.listdir(self.dir)):
+            with gzip.open(os.path.join(self.dir, name), 'rt', newline='') as f:
+                rows.extend(csv.DictReader(f))
+        return rows
+
+    def test_archive_history(self):
+        """The rows older than the retention go to gzip CSV files in batches"""
+        kept = list(
+            ExchangeRateHistory.objects.filter(
+                created__gte=datetime.utcnow().replace(tzinfo=utc) - timedelta(days=4, hours=12),
+            ).values_list('pk', flat=True)
+        )
+        out = StringIO()
+        call_command(
+            'archive_history', days=5, dir=self.dir, batch_size=2, stdout=out,
+        )
+        self.assertIn('6 rows archived', out.getvalue())
+        self.assertEqual(len(os.listdir(self.dir)), 3)
+        self.assertCountEqual(
+            ExchangeRateHistory.objects.values_list('pk', flat=True), kept,
+        )
+
+        rows = self.read_archives()
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]['fixer_rate'], '20.100000')
+        self.assertEqual(rows[0]['banxico_date'], '')
+        self.assertEqual(
+            [row['created'] for row in rows],
+            sorted(row['created'] for row in rows),
+        )
+
+    def test_latest_row_is_kept(self):
+        """The latest row is kept even if it is older than the retention"""
+        list(archive_history(0, self.dir))
+        self.assertEqual(ExchangeRateHistory.objects.count(), 1)
+        self.assertEqual(len(self.read_archives()), 9)
+
+    def test_retention_is_required(self):
+        """The command does nothing without retention days"""
+        with self.assertRaises(CommandError):
+            call_command('archive_history', dir=self.dir)
+
+
+class ApiKeyTestMixin:
+    """Empty per process caches and a client authenticated with a new api key"""
+
+    def setUp(self):
+        api_key_cache.clear()
+        usage_counter.clear()
+        self.addCleanup(usage_counter.clear)
+        rate_limiter.clear()
+        latest_rate_cache.clear()
+        self.user = User.objects.create_user(
+            usage_end_date=today + timedelta(days=30),
+            **user_data,
+        )
+        self.key = ApiKey.objects.create(user=self.user, name='app', api_key=uuid4())
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key.api_key}')
+
+
+class HistoryTestCase(ApiKeyTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        start = datetime(2022, 1, 1, 18, tzinfo=utc)
+        ExchangeRateHistory.objects.bulk_create(
+            ExchangeRateHistory(
+                fixer_rate=Decimal(f'20.{day}'),
+                fixer_date=(start + timedelta(days=day)).date(),
+                dof_rate=None if day % 2 else Decimal('20.5'),
+                dof_date=None if day % 2 else (start + timedelta(days=day)).date(),
+                created=start + timedelta(days=day),
+            )
+            for day in range(5)
+        )
+
+    def test_cursor_pagination(self):
+        """The history is paginated newest first with a cursor"""
+        response = self.client.get(reverse('history'), {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('X-RateLimit-Remaining', response)
+        data = loads(response.content)
+        self.assertEqual([row['fixer_rate'] for row in data['results']], [20.4, 20.3])
+        self.assertIsNone(data['previous'])
+
+        rows = data['results']
+        while data['next']:
+            data = loads(self.client.get(data['next']).content)
+            rows += data['results']
+        self.assertEqual([row['fixer_date'] for row in rows], [
+            '2022-01-05', '2022-01-04', '2022-01-03', '2022-01-02', '2022-01-01',
+        ])
+        usage_counter.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.usage, 3)
+
+    def test_filters(self):
+        """The history is filtered by the created dates and the provider"""
+        response = self.client.get(
+            reverse('history'),
+            {'from': '2022-01-02', 'to': '2022-01-04', 'provider': 'dof'},
+        )
+        rows = loads(response.content)['results']
+        self.assertEqual([row['created'] for row in rows], ['2022-01-03T18:00:00Z'])
+        self.assertEqual(
+            list(rows[0]),
+            ['id', 'created', 'dof_rate', 'dof_date', 'dof_last_updated'],
+        )
+
+        response = self.client.get(reverse('history'), {'provider': 'unknown'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('history'), {'from': '2022-01-04', 'to': '2022-01-02'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ndjson_export(self):
+        """The history is streamed as NDJSON"""
+        # The api keys version, the api key and one query of the rows
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('history'), {'format': 'ndjson'})
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(loads(lines[0])['fixer_rate'], 20.4)
+        self.assertIsNone(loads(lines[1])['dof_rate'])
+
+    def test_csv_export(self):
+        """The history is streamed as CSV"""
+        response = self.client.get(
+            reverse('history'),
+            {'format': 'csv', 'provider': 'fixer', 'to': '2022-01-01'},
+        )
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(
+            b''.join(response.streaming_content).decode().splitlines(),
+        ))
+        self.assertEqual(rows[0], [
+            'id', 'created', 'fixer_rate', 'fixer_date', 'fixer_last_updated',
+        ])
+        self.assertEqual(rows[1][1:], [
+            '2022-01-01T18:00:00+00:00', '20.000000', '2022-01-01', '',
+        ])
+
+    def test_usage_limit(self):
+        """The history counts for the usage limit of /latest/"""
+        User.objects.filter(pk=self.user.pk).update(usage=settings.MAX_REQUEST_USAGE)
+        api_key_cache.clear()
+        response = self.client.get(reverse('history'), {'format': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(APIClient().get(reverse('history')).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RateRollupTestCase(ApiKeyTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        start = datetime(2022, 1, 1, tzinfo=utc)
+        # Out of order, two days with two hours each
+        for hours, dof, fixer in [
+            (1, '20.5', '20.0'), (0, '20.1', '20.4'), (1, '20.3', '20.2'),
+            (26, '21.0', None), (25, '20.8', '20.6'),
+        ]:
+            ExchangeRateHistory.objects.create(
+                dof_rate=Decimal(dof),
+                fixer_rate=fixer and Decimal(fixer),
+                banxico_rate=Decimal('20.3'),
+                created=start + timedelta(hours=hours),
+            )
+
+    def rollups(self):
+        return sorted(
+            (r.period, r.provider, r.bucket, r.open, r.high, r.low, r.close, r.sum, r.count)
+            for r in RateRollup.objects.all()
+        )
+
+    def test_rollups_are_updated(self):
+        """Every new row updates the hourly and daily rollups"""
+        dof = RateRollup.objects.get(period='day', provider='dof', bucket=datetime(2022, 1, 1, tzinfo=utc))
+        self.assertEqual(
+            (dof.open, dof.high, dof.low, dof.close, dof.count),
+            (Decimal('20.1'), Decimal('20.5'), Decimal('20.1'), Decimal('20.3'), 3),
+        )
+        self.assertEqual(dof.mean, Decimal('20.3'))
+
+        hour = RateRollup.objects.get(period='hour', provider='fixer', bucket=datetime(2022, 1, 1, 1, tzinfo=utc))
+        self.assertEqual((hour.open, hour.close, hour.count), (Decimal('20.0'), Decimal('20.2'), 2))
+
+        # The spread needs the three providers
+        spread = RateRollup.objects.filter(period='day', provider='spread').order_by('bucket')
+        self.assertEqual(
+            [(s.high, s.low, s.count) for s in spread],
+            [(Decimal('0.5'), Decimal('0.1'), 3), (Decimal('0.5'), Decimal('0.5'), 1)],
+        )
+
+    def test_rebuild_rollups(self):
+        """The rebuild computes the same rollups as the updates"""
+        updated = self.rollups()
+        RateRollup.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_rollups', stdout=out)
+        self.assertIn('8 day rollups', out.getvalue())
+        self.assertEqual(self.rollups(), updated)
+
+        # Only the buckets between the dates are replaced
+        RateRollup.objects.filter(bucket__gte=datetime(2022, 1, 2, tzinfo=utc)).update(count=0)
+        call_command('rebuild_rollups', start=date(2022, 1, 1), end=date(2022, 1, 1), stdout=out)
+        self.assertEqual(RateRollup.objects.filter(count=0).count(), 10)
+
+    def test_rebuild_keeps_archived_rollups(self):
+        """The rollups of the archived history are not rebuilt from what is left"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        list(archive_history(0, directory))
+        ExchangeRateHistory.objects.create(
+            dof_rate=Decimal('21.2'), fixer_rate=Decimal('21.1'), banxico_rate=Decimal('21.0'),
+            created=datetime(2022, 1, 3, 12, tzinfo=utc),
+        )
+        updated = self.rollups()
+        RateRollup.objects.filter(bucket__gte=datetime(2022, 1, 3, tzinfo=utc)).delete()
+        out = StringIO()
+        call_command('rebuild_rollups', stdout=out)
+        self.assertIn('4 day rollups', out.getvalue())
+        self.assertIn('before 2022-01-03 kept', out.getvalue())
+        self.assertEqual(self.rollups(), updated)
+
+        call_command('rebuild_rollups', start=date(2022, 1, 1), end=date(2022, 1, 2), stdout=out)
+        self.assertEqual(self.rollups(), updated)
+
+    def test_rollups_endpoint(self):
+        """/rollups/ returns the rollups of a period and a provider"""
+        response = self.client.get(reverse('rollups'), {'provider': 'dof', 'from': '2022-01-02'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(loads(response.content)['results'], [{
+            'period': 'day',
+            'bucket': '2022-01-02T00:00:00Z',
+            'provider': 'dof',
+            'open': '20.800000',
+            'high': '21.000000',
+            'low': '20.800000',
+            'close': '21.000000',
+            'mean': '20.900000',
+            'count': 2,
+        }])
+
+        rows = loads(self.client.get(reverse('rollups'), {'period': 'hour'}).content)['results']
+        self.assertEqual(len(rows), 14)
+        self.assertEqual(rows[0]['bucket'], '2022-01-02T02:00:00Z')
+        response = self.client.get(reverse('rollups'), {'period': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@patch.dict('utils.circuit_breaker._breakers', clear=True)
+class ProviderRateTestCase(TestCase):
+    def setUp(self):
+        latest_rate_cache.clear()
+
+    def test_refresh_stores_fetched_rates(self):
+        """A refresh stores only the rates of the providers that answered"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            first = refresh_exchange_rate()
+        providers = dict(providers_ok, fixer=failing_provider)
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers):
+            refresh_exchange_rate(ExchangeRateHistory.objects.get(pk=first.pk))
+        self.assertEqual(ExchangeRateHistory.objects.count(), 2)
+        self.assertEqual(
+            sorted(ProviderRate.objects.values_list('provider', flat=True)),
+            ['banxico', 'banxico', 'dof', 'dof', 'fixer'],
+        )
+        self.assertIsNone(ExchangeRateHistory.objects.latest('created').fixer_rate)
+
+    def test_latest_rate(self):
+        """The rates a refresh did not get are read from provider_rate with the row"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            first = refresh_exchange_rate()
+        providers = dict(providers_ok, dof=fake_provider('21.1'), fixer=failing_provider)
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers):
+            second = refresh_exchange_rate(first)
+
+        latest_rate_cache.clear()
+        with self.assertNumQueries(1):
+            rate = latest_rate_cache.get()
+        self.assertEqual(rate.pk, second.pk)
+        self.assertEqual(rate.dof_rate, Decimal('21.1'))
+        self.assertEqual((rate.fixer_rate, rate.fixer_last_updated), (first.fixer_rate, first.fixer_last_updated))
+        self.assertEqual(latest_rate_cache.render(rate).body, render_rate(second).body)
+
+        # The events replay reads the rows the same way
+        self.assertEqual(missed_rates(first.pk, 10)[0].fixer_rate, first.fixer_rate)
+
+    def test_latest_provider_rates(self):
+        """The latest rate of every provider is read with one query"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            refresh_exchange_rate()
+            rate = refresh_exchange_rate(ExchangeRateHistory.objects.latest('created'))
+        with self.assertNumQueries(1):
+            rates = latest_provider_rates()
+        for provider in ('dof', 'fixer', 'banxico'):
+            self.assertEqual(rates[provider].rate, getattr(rate, f'{provider}_rate'))
+            self.assertEqual(rates[provider].fetched_at, getattr(rate, f'{provider}_last_updated'))
+
+    def test_convert_history(self):
+        """The migration stores each rate fetched once"""
+        created = datetime(2022, 1, 1, tzinfo=utc)
+        for minutes, banxico in ((0, created), (10, created), (20, created + timedelta(minutes=20))):
+            ExchangeRateHistory.objects.create(
+                created=created + timedelta(minutes=minutes),
+                dof_rate=None,
+                fixer_rate=Decimal('20.2'),
+                fixer_date=date(2022, 1, 1),
+                fixer_last_updated=created,
+                banxico_rate=Decimal('20.3') + minutes,
+                banxico_date=date(2022, 1, 1),
+                banxico_last_updated=banxico,
+            )
+        ProviderRate.objects.all().delete()
+
+        migration = import_module('core.migrations.0007_provider_rate')
+        migration.convert_history(apps, None)
+        migration.convert_history(apps, None)
+        self.assertEqual(
+            list(ProviderRate.objects.values_list('provider', 'rate')),
+            [('banxico', Decimal('40.3')), ('banxico', Decimal('20.3')), ('fixer', Decimal('20.2'))],
+        )
+
+
+class ConvertTestCase(ApiKeyTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        fetched_at = datetime(2022, 1, 3, 18, tzinfo=utc)
+        ProviderRate.objects.bulk_create([
+            ProviderRate(provider='banxico', date=date(2022, 1, 3), fetched_at=fetched_at, rate=Decimal('20')),
+            ProviderRate(
+                provider='banxico', date=date(2022, 1, 5),
+                fetched_at=fetched_at + timedelta(days=2), rate=Decimal('20.4731'),
+            ),
+        ])
+
+    def convert(self, query, data, **kwargs):
+        """The response and its content, streamed or not"""
+        response = self.client.post(f'{reverse("convert")}?{query}', data, **kwargs)
+        if response.streaming:
+            return response, b''.join(response.streaming_content)
+        return response, response.content
+
+    def test_convert(self):
+        """The amounts are converted with the latest rate rounding half to even"""
+        response, content = self.convert(
+            'provider=banxico',
+            {'amounts': ['1.005', 2, 0.125, '-1.005']},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(loads(content), {
+            'provider': 'banxico',
+            'date': '2022-01-05',
+            'rate': '20.473100',
+            'places': 2,
+            'count': 4,
+            'results': ['20.58', '40.95', '2.56', '-20.58'],
+        })
+
+        # The rate of a date, the last one before it on the days without rate
+        response, content = self.convert(
+            'provider=banxico&date=2022-01-04&places=0',
+            {'amounts': ['0.025', '0.075']},
+            format='json',
+        )
+        self.assertEqual(loads(content)['results'], ['0', '2'])
+
+        # A batch counts as one request
+        usage_counter.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.usage, 2)
+
+    def test_convert_csv(self):
+        """The amounts can be sent and returned as CSV"""
+        response, content = self.convert(
+            'provider=banxico&format=csv',
+            'amount\n1\n2.5\n',
+            content_type='text/csv',
+        )
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            list(csv.reader(StringIO(content.decode()))),
+            [['amount', 'converted'], ['1', '20.47'], ['2.5', '51.18']],
+        )
+
+    @override_settings(CONVERT_MAX_AMOUNTS=2)
+    def test_convert_errors(self):
+        """Invalid batches are rejected before any usage"""
+        for query, amounts in [
+            ('provider=banxico', ['1', 'NaN']),
+            ('provider=banxico', ['Infinity']),
+            ('provider=banxico', ['1', '-inf']),
+            ('provider=banxico', ['1e15']),
+            ('provider=banxico', ['1', '2', '3']),
+            ('provider=banxico', []),
+            ('provider=unknown', ['1']),
+            ('provider=banxico&places=7', ['1']),
+        ]:
+            response, content = self.convert(query, {'amounts': amounts}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, (query, amounts))
+        response, content = self.convert('provider=banxico', {'amounts': ['1', '-inf']}, format='json')
+        self.assertEqual(loads(content), {'amounts': ['A valid amount is required at 1.']})
+        response, content = self.convert('provider=dof', {'amounts': ['1']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(usage_counter.usage(self.user), 0)
+
+
+fixer_data = {
+    'success': True,
+    'timestamp': 1643644743,
+    'base': 'EUR',
+    'date': '2022-01-31',
+    'rates': {'USD': 1.123744, 'MXN': 23.242616, 'CAD': 1.43, 'GBP': 0.836},
+}
+
+
+@patch.dict('utils.circuit_breaker._breakers', clear=True)
+class CurrencyRatesTestCase(ApiKeyTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cross_rates_cache.clear()
+        self.addCleanup(cross_rates_cache.clear)
+        providers = dict(providers_ok, fixer=lambda: parse_fixer_rate(fixer_data))
+        patcher = patch.dict('utils.exchange_rates_sources.PROVIDERS', providers)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_refresh_stores_every_currency(self):
+        """A refresh stores the rates of every currency once per Fixer update"""
+        with self.captureOnCommitCallbacks(execute=True):
+            first = refresh_exchange_rate()
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_exchange_rate(first)
+        self.assertEqual(first.fixer_rate, Decimal('20.6832'))
+        row = CurrencyRates.objects.get()
+        self.assertEqual(row.symbols, 'CAD,EUR,GBP,MXN,USD')
+        self.assertEqual(len(row.rates), 5 * 8)
+        self.assertEqual(row.timestamp, datetime(2022, 1, 31, 15, 59, 3, tzinfo=utc))
+
+    def test_rates(self):
+        """/rates/ slices the cross rates of the latest Fixer update"""
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_exchange_rate()
+        response = self.client.get(reverse('rates'), {'symbols': 'mxn,EUR'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = loads(response.content)
+        self.assertEqual(data['base'], 'USD')
+        self.assertEqual(data['date'], '2022-01-31')
+        self.assertEqual(list(data['rates']), ['MXN', 'EUR'])
+        self.assertAlmostEqual(data['rates']['MXN'], 20.683195, places=6)
+        self.assertAlmostEqual(data['rates']['EUR'], 0.889882, places=6)
+
+        # The matrix is kept until there is a new refresh
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('rates'), {'base': 'MXN'})
+        self.assertFalse([query for query in queries if 'currency_rates' in query['sql']])
+        rates = loads(response.content)['rates']
+        self.assertEqual(len(rates), 5)
+        self.assertEqual(rates['MXN'], 1)
+        self.assertAlmostEqual(rates['USD'], 1 / 20.683195, places=6)
+
+        for query in ({'base': 'XXX'}, {'symbols': 'MXN,XXX'}):
+            response = self.client.get(reverse('rates'), query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProvidersHandler(StandInHandler):
+    """The recorded payload of the provider of the path"""
+    payloads = {
+        '/banxico': ('application/xml', 'banxico.xml'),
+        '/dof': ('text/html', 'dof.html'),
+        '/fixer': ('application/json', 'fixer.json'),
+    }
+
+    def do_GET(self):
+        code = self.statuses.pop(0) if self.statuses else 200
+        content_type, name = next(
+            payload for prefix, payload in self.payloads.items() if self.path.startswith(prefix)
+        )
+        body = read_payload(name).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@override_settings(PROVIDER_RETRY_BACKOFF=0)
+@patch.dict('utils.circuit_breaker._breakers', clear=True)
+class AsyncLatestTestCase(ApiKeyTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.view = async_to_sync(AsyncExchangeRateView.as_view())
+
+    def get(self, **headers):
+        request = self.factory.get(
+            reverse('latest'),
+            HTTP_AUTHORIZATION=f'Token {self.key.api_key}',
+            **headers,
+        )
+        response = self.view(request)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_async_latest(self):
+        """The async view refreshes and serves the latest rate"""
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', providers_ok):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = loads(response.content)
+        self.assertEqual(data['provider_1']['rate'], 20.1)
+        self.assertEqual(data['provider_3']['rate'], 20.3)
+        self.assertIn('X-RateLimit-Remaining', response)
+
+        # Served from the cache of the process without a refresh
+        with patch('utils.refresh.fetch_rates_async') as fetch:
+            response = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(fetch.called)
+        self.assertEqual(usage_counter.usage(self.user), 2)
+
+    def test_async_latest_errors(self):
+        """The async view checks the request like the sync one"""
+        response = self.view(self.factory.get(reverse('latest')))
+        response.render()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.view(self.factory.post(
+            reverse('latest'), HTTP_AUTHORIZATION=f'Token {self.key.api_key}',
+        ))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        with patch.dict('utils.exchange_rates_sources.PROVIDERS', {'dof': failing_provider}):
+            self.assertEqual(self.get().status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_fetch_rates_async(self):
+        """The providers are fetched with the async client"""
+        server, url = start_stand_in_server(ProvidersHandler)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        ProvidersHandler.statuses = []
+        urls = {
+            'BANXICO_API_URL': f'{url}banxico',
+            'DOF_URL': f'{url}dof',
+            'FIXER_API_URL': f'{url}fixer',
+        }
+        with override_settings(**urls):
+            data = async_to_sync(fetch_rates_async)()
+        self.assertEqual(data['banxico']['rate'], Decimal('20.6887'))
+        self.assertEqual(data['dof']['rate'], Decimal('20.4717'))
+        self.assertEqual(data['fixer']['rate'], Decimal('20.6832'))
+
+        # Server errors are retried, then the provider fails
+        ProvidersHandler.statuses = [503, 503, 503]
+        with override_settings(**urls):
+            data = async_to_sync(fetch_rates_async)({'dof': get_dof_rate})
+        self.assertIsNone(data['dof'])
+        self.assertEqual(get_breaker('dof').failures, 1)
+
+
+def read_events(events, count):
+    """The next count parts of an event stream, failing after a second"""
+    async def read():
+        return [await asyncio.wait_for(events.__anext__(), 1) for _ in range(count)]
+    return read()
+
+
+@override_settings(
+    EXCHANGE_RATE_BACKGROUND_REFRESH=True,
+    EVENTS_POLL_INTERVAL=0.01,
+    EVENTS_HEARTBEAT=60,
+)
+class RateEventsTestCase(ApiKeyTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.view = RateEventsView.as_view()
+        self.first = self.add_rate('20.1')
+
+    def add_rate(self, rate):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ExchangeRateHistory.objects.create(
+                dof_rate=Decimal(rate),
+                fixer_rate=Decimal(rate),
+                banxico_rate=Decimal(rate),
+            )
+
+    def request(self, **extra):
+        return self.factory.get(
+            '/events/',
+            HTTP_AUTHORIZATION=f'Token {self.key.api_key}',
+            HTTP_ACCEPT='text/event-stream',
+            **extra,
+        )
+
+    def test_new_rates_are_pushed(self):
+        """Each stream gets the latest rate and then every new row once"""
+        @async_to_sync
+        async def scenario():
+            streams = [(await self.view(self.request())).streaming_content for _ in range(3)]
+            first = [await read_events(events, 1) for events in streams]
+            row = await sync_to_async(self.add_rate)('20.5')
+            pushed = [await read_events(events, 1) for events in streams]
+            broadcaster = get_broadcaster()
+            subscribers = broadcaster.subscribers
+            for events in streams:
+                await events.aclose()
+            return row, first, pushed, subscribers, broadcaster
+
+        row, first, pushed, subscribers, broadcaster = scenario()
+        for part in first:
+            self.assertTrue(part[0].startswith(f'id: {self.first.pk}\nevent: rate\ndata: '.encode()))
+        event = pushed[0][0]
+        self.assertTrue(event.startswith(f'id: {row.pk}\nevent: rate\ndata: '.encode()))
+        data = loads(event.split(b'data: ', 1)[1])
+        self.assertEqual(data, loads(latest_rate_cache.render(row).body))
+        self.assertEqual(pushed, [[event]] * 3)
+
+        # One poller for the streams, stopped with the last one
+        self.assertEqual(subscribers, 3)
+        self.assertEqual(broadcaster.subscribers, 0)
+        self.assertIsNone(broadcaster.task)
+        self.assertEqual(usage_counter.usage(self.user), 3)
+
+    @override_settings(EXCHANGE_RATE_BACKGROUND_REFRESH=False, EXCHANGE_RATE_UPDATE_INTERVAL=-1)
+    def test_refresh_outlives_the_streams(self):
+        """The last stream leaving does not cancel a refresh half done"""
+        @async_to_sync
+        async def scenario():
+            answer = asyncio.Event()
+
+            async def fetch_rates():
+                await answer.wait()
+                return {'dof': None}
+
+            with patch('utils.refresh.fetch_rates_async', fetch_rates):
+                broadcaster = get_broadcaster()
+                broadcaster.join()
+                while broadcaster.refreshing is None:
+                    await asyncio.sleep(0.01)
+                broadcaster.leave()
+                answer.set()
+                return await asyncio.wait_for(broadcaster.refreshing, 1)
+
+        rate = scenario()
+        self.assertEqual(ExchangeRateHistory.objects.count(), 2)
+        self.assertEqual(rate.dof_rate, self.first.dof_rate)
+
+    @override_settings(EVENTS_HEARTBEAT=0)
+    def test_heartbeat(self):
+        """Idle streams get a comment so the connection stays open"""
+        @async_to_sync
+        async def scenario():
+            events = (await self.view(self.request())).streaming_content
+            parts = await read_events(events, 2)
+            await events.aclose()
+            return parts
+
+        self.assertEqual(scenario()[1], HEARTBEAT)
+
+    @override_settings(EVENTS_HEARTBEAT=0)
+    def test_last_event_id(self):
+        """A reconnection gets the rows missed since Last-Event-ID"""
+        second = self.add_rate('20.2')
+        third = self.add_rate('20.3')
+
+        def first_ids(request, count=2):
+            @async_to_sync
+            async def scenario():
+                events = (await self.view(request)).streaming_content
+                parts = await read_events(events, count)
+                await events.aclose()
+                return parts
+            return [
+                part.split(b'\n', 1)[0].decode() if part != HEARTBEAT else 'heartbeat'
+                for part in scenario()
+            ]
+
+        self.assertEqual(
+            first_ids(self.request(HTTP_LAST_EVENT_ID=str(self.first.pk))),
+            [f'id: {second.pk}', f'id: {third.pk}'],
+        )
+        self.assertEqual(
+            first_ids(self.request(HTTP_LAST_EVENT_ID=str(third.pk)), 1),
+            ['heartbeat'],
+        )
+        # An unknown row gets the latest one
+        self.assertEqual(
+            first_ids(self.factory.get(
+                f'/events/?api_key={self.key.api_key}&last_event_id=0',
+                HTTP_ACCEPT='text/event-stream',
+            ), 1),
+            [f'id: {third.pk}'],
+        )
+
+        response = async_to_sync(self.view)(self.request(HTTP_LAST_EVENT_ID='last'))
+        response.render()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.content.startswith(b'event: error\ndata: '))
+
+        response = async_to_sync(self.view)(self.factory.get('/events/', HTTP_ACCEPT='text/event-stream'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_asgi_handler_stops_on_disconnect(self):
+        """The stream of a client that disconnected is closed"""
+        closed = []
+
+        async def stream():
+            try:
+                while True:
+                    yield b'data: 1\n\n'
+                    await asyncio.sleep(0)
+            finally:
+                closed.append(True)
+
+        sent = []
+        disconnected = asyncio.Event()
+
+        async def send(message):
+            sent.append(message)
+            if len(sent) == 3:
+                disconnected.set()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        @async_to_sync
+        async def scenario():
+            _receive.set(receive)
+            await ASGIHandler().send_response(AsyncStreamingResponse(stream()), send)
+
+        scenario()
+        self.assertEqual(closed, [True])
+        self.assertEqual(sent[0]['type'], 'http.response.start')
+        self.assertEqual(sent[1], {'type': 'http.response.body', 'body': b'data: 1\n\n', 'more_body': True})
+
+
+@override_settings(EXCHANGE_RATE_BACKGROUND_REFRESH=True, EVENTS_POLL_INTERVAL=0.01)
+class LongPollTestCase(ApiKeyTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.view = AsyncExchangeRateView.as_view()
+        self.first = self.add_rate('20.1')
+        self.etag = latest_rate_cache.render(self.first).etag
+
+    def add_rate(self, rate):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ExchangeRateHistory.objects.create(
+                dof_rate=Decimal(rate),
+                fixer_rate=Decimal(rate),
+                banxico_rate=Decimal(rate),
+            )
+
+    def get(self, **params):
+        return self.client.get(reverse('latest'), params)
+
+    def test_since(self):
+        """A newer rate is served right away, else a 304"""
+        response = self.get(since=self.etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], self.etag)
+
+        response = self.get(since=self.etag.strip('"'), wait=30)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.get(since=self.first.created.isoformat())
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.get(since=(self.first.created - timedelta(seconds=1)).isoformat())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.get(since='"other"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(usage_counter.usage(self.user), 5)
+
+        with override_settings(LATEST_MAX_WAIT=10):
+            response = self.get(since=self.etag, wait=11)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('wait', response.json())
+
+        response = self.get(since='2022-13-45T00:00:00')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('since', response.json())
+
+    def test_long_poll(self):
+        """The async view answers when a new rate is written"""
+        request = self.factory.get(
+            reverse('latest'),
+            {'since': self.etag, 'wait': 5},
+            HTTP_AUTHORIZATION=f'Token {self.key.api_key}',
+        )
+
+        @async_to_sync
+        async def scenario():
+            start = time.monotonic()
+            response = asyncio.ensure_future(self.view(request))
+            await asyncio.sleep(0.1)
+            self.assertFalse(response.done())
+            row = await sync_to_async(self.add_rate)('20.5')
+            return row, await response, time.monotonic() - start
+
+        row, response, elapsed = scenario()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(loads(response.content)['provider_1']['rate'], 20.5)
+        self.assertEqual(response['ETag'], latest_rate_cache.render(row).etag)
+        self.assertLess(elapsed, 5)
+
+    def test_long_poll_timeout(self):
+        """Without a new rate it answers a 304 after wait seconds"""
+        request = self.factory.get(
+            reverse('latest'),
+            {'since': self.first.created.isoformat(), 'wait': 1},
+            HTTP_AUTHORIZATION=f'Token {self.key.api_key}',
+        )
+        start = time.monotonic()
+        response = async_to_sync(self.view)(request)
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(usage_counter.usage(self.user), 1)
+
+
+# Budgets of a worker boot in a fresh interpreter, about 3 times what it
+# takes (0.5 s, 60 MiB), a regression past them fails
+BOOT_SECONDS = 1.5
+BOOT_RSS = 180 * 2 ** 20
+
+
+class BootTestCase(TestCase):
+    def test_prepare_skips_what_is_done(self):
+        """prepare only migrates and collects when there is something to do"""
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        with override_settings(STATIC_ROOT=static_root):
+            out = StringIO()
+            call_command('prepare', verbosity=0, stdout=out)
+            self.assertIn('No migrations to apply', out.getvalue())
+            self.assertTrue(os.path.exists(os.path.join(static_root, 'index.html')))
+
+            out = StringIO()
+            with patch('django.contrib.staticfiles.management.commands.collectstatic.Command.handle') as collect:
+                call_command('prepare', verbosity=0, stdout=out)
+            self.assertFalse(collect.called)
+            self.assertIn('Static files up to date', out.getvalue())
+
+    def test_boot_budget(self):
+        """A worker boots within the budgets without the provider stack"""
+        # The best of 3, the first one can pay for a cold disk cache
+        runs = [boot() for _ in range(3)]
+        self.assertLess(min(run['seconds'] for run in runs), BOOT_SECONDS)
+        self.assertLess(min(run['rss'] for run in runs), BOOT_RSS)
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, runs[0]['modules'])
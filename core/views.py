@@ -1,22 +1,49 @@
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
 
 from django.conf import settings
-from django.utils.timezone import utc
 from django.contrib.auth import get_user_model
+from django.core.exceptions import SynchronousOnlyOperation
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import MethodNotAllowed, PermissionDenied, ValidationError
+from rest_framework.settings import api_settings
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework import viewsets
-from django.shortcuts import get_object_or_404
 
-from core.models import ExchangeRateHistory, ApiKey
-from core.serializers import ApiKeySerializer, UserSerializer, UUIDSerializer
-from utils.exchange_rates_sources import (
-    get_dof_rate, get_fixer_rate, get_banxico_rate)
-from utils.format_data import exchange_rate_format
+from core.models import ApiKey, ExchangeRateHistory, ProviderRate, RateRollup
+from core.serializers import (
+    ApiKeySerializer, ConvertQuerySerializer, HistoryQuerySerializer,
+    LatestQuerySerializer, RateRollupSerializer, RatesQuerySerializer,
+    RollupQuerySerializer, UserSerializer)
+from utils.asgi import AsyncStreamingResponse
+from utils.authentication import ApiKeyAuthentication, api_key_cache
+from utils.circuit_breaker import breakers_status
+from utils.convert import convert_amounts, parse_amounts, stream_conversion
+from utils.currency_rates import cross_rates_cache
+from utils.exchange_rates_sources import PROVIDERS
+from utils.format_data import exchange_rate_format, history_columns
+from utils.http_client import connection_stats
+from utils.pagination import HistoryPagination, RollupPagination
+from utils.parsers import CSVParser
+from utils.provider_rates import latest_provider_rates
+from utils.rate_cache import latest_rate_cache
+from utils.rate_events import current_rate, next_rate, rate_events
+from utils.refresh import refresh_if_outdated
+from utils.rollups import start_of_day
+from utils.renderers import CSVRenderer, EventStreamRenderer, NDJSONRenderer, StreamingRenderer
+from utils.throttling import ApiKeyRateThrottle, RateLimitHeadersMixin
+from utils.usage import usage_counter
 from utils.permissions import SuperOnly, CurrentUserObj
 
 logger = logging.getLogger(__name__)
@@ -24,100 +51,416 @@ logger = logging.getLogger(__name__)
 User = get_user_model()
 
 
-class ExchageRateView(APIView):
+class ApiKeyView(RateLimitHeadersMixin, APIView):
+    """
+    View of the api key users, the requests are rate limited and count
+    for their usage limit.
+    """
+    authentication_classes = [
+        SessionAuthentication,
+        ApiKeyAuthentication,
+    ]
+    throttle_classes = [
+        ApiKeyRateThrottle,
+    ]
+
+    def get_user(self, request):
+        """The user of the request if he has not reached his usage limit"""
+        if not request.user.is_authenticated:
+            raise ValidationError({'api_key': ['This field is required.']})
+        if usage_counter.check_usage_limit(request.user):
+            raise PermissionDenied('You have reached your usage limit.')
+        return request.user
+
+
+class ExchageRateView(ApiKeyView):
+    """
+    The latest rate. With ?since= (the created or the ETag of the rate
+    the client has) it answers a 304 when there is no newer one, the
+    async view waits up to ?wait= seconds for it first (long poll).
+    """
+
     def get(self, request, format=None):
-        if request.user.is_authenticated:
-            user = request.user
+        user = self.get_user(request)
+        query = self.get_query(request)
+
+        last_rate = latest_rate_cache.get()
+
+        if not settings.EXCHANGE_RATE_BACKGROUND_REFRESH:
+            # Without the refresh_rates worker the request updates the rates
+            last_rate = refresh_if_outdated(last_rate)
+
+        return self.latest_response(request, user, last_rate, query.get('since'))
+
+    def get_query(self, request):
+        query = LatestQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return query.validated_data
+
+    def is_newer(self, rate, since):
+        """If rate is newer than the created or ETag since"""
+        if isinstance(since, datetime):
+            return rate.created > since
+        return latest_rate_cache.render(rate).etag != since
+
+    def count_usage(self, user):
+        usage_counter.add(user)
+
+    def latest_response(self, request, user, last_rate, since=None):
+        """The response of last_rate, a 304 if the client has it"""
+        if last_rate is None:
+            return Response(
+                {
+                    'detail': 'No data available',
+                },
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        # A 304 is a served request too
+        self.count_usage(user)
+
+        rendered = latest_rate_cache.render(last_rate)
+        if since is not None and not self.is_newer(last_rate, since):
+            response = HttpResponseNotModified()
         else:
-            temp_token = (
-                request.headers.get(
-                    'Authorization',
-                    request.query_params.get('api_key', ''),
-                )
-                .replace('Token ', '')
-                .strip()
+            response = get_conditional_response(
+                request,
+                etag=rendered.etag,
+                last_modified=rendered.last_modified,
             )
+        if response is None:
+            if isinstance(request.accepted_renderer, JSONRenderer):
+                response = HttpResponse(rendered.body, content_type='application/json')
+            else:
+                response = Response(exchange_rate_format(last_rate), status=status.HTTP_200_OK)
+        response['ETag'] = rendered.etag
+        response['Last-Modified'] = http_date(rendered.last_modified)
+        return response
+
+
+class AsyncExchangeRateView(ExchageRateView):
+    """
+    /latest/ as an async view for the ASGI server (EXCHANGE_RATE_ASYNC).
+    The cached api keys and rate are served from the event loop, the
+    database is only used from a thread on a cache miss, and a refresh
+    fetches the providers with non-blocking HTTP, so the worker keeps
+    serving other requests while it waits for them.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        async def view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            return await self.async_dispatch(request, *args, **kwargs)
+
+        view.cls = cls
+        view.initkwargs = initkwargs
+        # Like APIView, the session authentication enforces CSRF
+        view.csrf_exempt = True
+        return view
+
+    def check_request(self, request):
+        """The checks of APIView.initial, returns the user of the request"""
+        self.initial(request)
+        return self.get_user(request)
+
+    def count_usage(self, user):
+        # Flushed by async_dispatch, out of the event loop
+        usage_counter.count(user)
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        """APIView.dispatch of get without blocking the event loop"""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            if request.method.lower() not in ('get', 'head', 'options'):
+                raise MethodNotAllowed(request.method)
+            try:
+                # With the api key and the user cached it does not use
+                # the database, a thread is only needed on a miss
+                user = self.check_request(request)
+            except SynchronousOnlyOperation:
+                user = await sync_to_async(self.check_request)(request)
+            if request.method.lower() == 'options':
+                response = self.options(request, *args, **kwargs)
+            else:
+                response = await self.async_get(request, user)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        if usage_counter.flush_due():
+            await sync_to_async(usage_counter.flush)(blocking=False)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def async_get(self, request, user):
+        query = self.get_query(request)
+        since = query.get('since')
+        last_rate = await current_rate()
+        waits = since is not None and query['wait'] and last_rate is not None
+        if waits and not self.is_newer(last_rate, since):
+            # Parked in the event loop until a new rate or the timeout
+            newer = await next_rate(lambda rate: self.is_newer(rate, since), query['wait'])
+            last_rate = newer or last_rate
+        return self.latest_response(request, user, last_rate, since)
+
+
+class RateEventsView(AsyncExchangeRateView):
+    """
+    Server-Sent Events of the latest rate for the ASGI server: a 'rate'
+    event with the /latest/ body and the id of the row every time there
+    is a new row, a comment as heartbeat, and the rows missed since the
+    Last-Event-ID header (or ?last_event_id=) on a reconnection. A
+    stream counts as one request for the usage.
+    """
+    renderer_classes = [
+        *api_settings.DEFAULT_RENDERER_CLASSES,
+        EventStreamRenderer,
+    ]
+
+    async def async_get(self, request, user):
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID') or request.query_params.get('last_event_id')
+        if last_event_id is not None:
+            try:
+                last_event_id = int(last_event_id)
+            except ValueError:
+                raise ValidationError({'last_event_id': ['A valid integer is required.']})
+
+        self.count_usage(user)
+        response = AsyncStreamingResponse(rate_events(last_event_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Sent as they come through nginx
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class HistoryView(ApiKeyView):
+    """
+    Exchange rate history between the dates from and to (created), of
+    every provider or of one. Paginated with a cursor, or the whole
+    history streamed with ?format=ndjson or ?format=csv.
+    """
+    renderer_classes = [
+        *api_settings.DEFAULT_RENDERER_CLASSES,
+        NDJSONRenderer,
+        CSVRenderer,
+    ]
+    pagination_class = HistoryPagination
+
+    def get(self, request, format=None):
+        user = self.get_user(request)
+        query = HistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        providers = [query.validated_data.get('provider')]
+        if providers == [None]:
+            providers = list(PROVIDERS)
+        queryset = self.get_queryset(query.validated_data)
+        columns = history_columns(providers)
+
+        # A page or the whole export count as one request
+        usage_counter.add(user)
 
-            token = UUIDSerializer(
-                data={
-                    'api_key': temp_token,
-                }
+        renderer = request.accepted_renderer
+        if isinstance(renderer, StreamingRenderer):
+            rows = queryset.order_by('-created', '-id').values_list(*columns).iterator(
+                chunk_size=settings.HISTORY_EXPORT_CHUNK_SIZE,
+            )
+            response = StreamingHttpResponse(
+                renderer.stream(columns, rows),
+                content_type=renderer.media_type,
+            )
+            response['Content-Disposition'] = (
+                f'attachment; filename="exchange_rate_history.{renderer.format}"'
+            )
+            return response
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset.values(*columns), request, view=self)
+        return paginator.get_paginated_response(page)
+
+    def get_queryset(self, filters):
+        queryset = ExchangeRateHistory.objects.all()
+        if filters.get('from'):
+            queryset = queryset.filter(created__gte=start_of_day(filters['from']))
+        if filters.get('to'):
+            queryset = queryset.filter(
+                created__lt=start_of_day(filters['to'] + timedelta(days=1)),
+            )
+        if filters.get('provider'):
+            queryset = queryset.filter(**{f'{filters["provider"]}_date__isnull': False})
+        return queryset
+
+
+class RollupView(ApiKeyView):
+    """
+    Hourly or daily open, high, low, close and mean of the rates of each
+    provider and of their spread, between the dates from and to.
+    """
+    pagination_class = RollupPagination
+
+    def get(self, request, format=None):
+        user = self.get_user(request)
+        query = RollupQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        filters = query.validated_data
+
+        queryset = RateRollup.objects.filter(period=filters['period'])
+        if filters.get('provider'):
+            queryset = queryset.filter(provider=filters['provider'])
+        if filters.get('from'):
+            queryset = queryset.filter(bucket__gte=start_of_day(filters['from']))
+        if filters.get('to'):
+            queryset = queryset.filter(
+                bucket__lt=start_of_day(filters['to'] + timedelta(days=1)),
             )
-            token.is_valid(raise_exception=True)
 
-            user = get_object_or_404(
-                ApiKey,
-                api_key=token.data.get('api_key', ''),
-            ).user
+        usage_counter.add(user)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(RateRollupSerializer(page, many=True).data)
 
-        if user.check_usage_limit():
+
+class ConvertView(ApiKeyView):
+    """
+    Convert a batch of amounts, {"amounts": [...]} or a CSV column, with
+    the latest rate of a provider or its rate of a date. The batch counts
+    as one request and the results are streamed.
+    """
+    parser_classes = [
+        JSONParser,
+        CSVParser,
+    ]
+    renderer_classes = [
+        JSONRenderer,
+        NDJSONRenderer,
+        CSVRenderer,
+    ]
+
+    def post(self, request, format=None):
+        user = self.get_user(request)
+        query = ConvertQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        filters = query.validated_data
+        amounts = self.get_amounts(request.data)
+
+        rate = self.get_rate(filters['provider'], filters.get('date'))
+        if rate is None:
             return Response(
                 {
-                    'detail': 'You have reached your usage limit.',
+                    'detail': 'No data available',
                 },
-                status=status.HTTP_403_FORBIDDEN,
+                status=status.HTTP_404_NOT_FOUND,
             )
 
-        dt = datetime.utcnow().replace(tzinfo=utc)
-        last_rate = (
-            ExchangeRateHistory.objects.filter()
-            .order_by(
-                '-created',
+        usage_counter.add(user)
+
+        converted = convert_amounts(amounts, rate.rate, filters['places'])
+        renderer = request.accepted_renderer
+        if isinstance(renderer, StreamingRenderer):
+            content = renderer.stream(
+                ['amount', 'converted'],
+                zip(map(str, request.data['amounts']), map(str, converted)),
             )
+        else:
+            content = stream_conversion(
+                {
+                    'provider': rate.provider,
+                    'date': rate.date,
+                    'rate': str(rate.rate),
+                    'places': filters['places'],
+                    'count': len(amounts),
+                },
+                converted,
+            )
+        return StreamingHttpResponse(content, content_type=renderer.media_type)
+
+    def get_amounts(self, data):
+        amounts = data.get('amounts') if isinstance(data, dict) else None
+        if not isinstance(amounts, list) or not amounts:
+            raise ValidationError({'amounts': ['Expected a non empty list of amounts.']})
+        if len(amounts) > settings.CONVERT_MAX_AMOUNTS:
+            raise ValidationError({
+                'amounts': [f'Ensure there are no more than {settings.CONVERT_MAX_AMOUNTS} amounts.'],
+            })
+        try:
+            return parse_amounts(amounts)
+        except ValueError as exc:
+            raise ValidationError({'amounts': [f'A valid amount is required at {exc.args[0]}.']})
+
+    def get_rate(self, provider, date=None):
+        """The latest rate of provider, or the one of date (or before it)"""
+        if date is None:
+            return latest_provider_rates([provider]).get(provider)
+        return (
+            ProviderRate.objects.filter(provider=provider, date__lte=date)
+            .order_by('-date', '-fetched_at')
             .first()
         )
 
-        if last_rate is None:
-            dof_data = get_dof_rate()
-            fixer_data = get_fixer_rate()
-            banxico_data = get_banxico_rate()
-            if dof_data is None or fixer_data is None or banxico_data is None:
-                return Response(
-                    {
-                        'detail': 'No data available',
-                    },
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-            else:
-                last_rate = ExchangeRateHistory.objects.create(
-                    dof_rate=dof_data['rate'],
-                    dof_date=dof_data['date'],
-                    dof_last_updated=dt,
-                    fixer_rate=fixer_data['rate'],
-                    fixer_date=fixer_data['date'],
-                    fixer_last_updated=dt,
-                    banxico_rate=banxico_data['rate'],
-                    banxico_date=banxico_data['date'],
-                    banxico_last_updated=dt,
-                )
-        else:
-            diff_dt = dt - last_rate.created
-            if diff_dt.total_seconds() / 60.0 > settings.EXCHANGE_RATE_UPDATE_INTERVAL:
-                dof_data = get_dof_rate()
-                fixer_data = get_fixer_rate()
-                banxico_data = get_banxico_rate()
-                last_rate.pk = None
-                if dof_data is not None:
-                    last_rate.dof_rate = dof_data['rate']
-                    last_rate.dof_date = dof_data['date']
-                    last_rate.dof_last_updated = dt
-
-                if fixer_data is not None:
-                    last_rate.fixer_rate = fixer_data['rate']
-                    last_rate.fixer_date = fixer_data['date']
-                    last_rate.fixer_last_updated = dt
-
-                if banxico_data is not None:
-                    last_rate.banxico_rate = banxico_data['rate']
-                    last_rate.banxico_date = banxico_data['date']
-                    last_rate.banxico_last_updated = dt
-
-                last_rate.save()
-
-        user.usage = user.usage + 1
-        user.save(update_fields=['usage'])
-
-        return Response(exchange_rate_format(last_rate), status=status.HTTP_200_OK)
+
+class RatesView(ApiKeyView):
+    """
+    Rates of one unit of base in each of symbols (every currency by
+    default), sliced from the cross rates of the latest Fixer update.
+    """
+
+    def get(self, request, format=None):
+        user = self.get_user(request)
+        query = RatesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        filters = query.validated_data
+
+        cross_rates = cross_rates_cache.get()
+        if cross_rates is None:
+            return Response(
+                {
+                    'detail': 'No data available',
+                },
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        base = filters['base']
+        symbols = filters.get('symbols') or None
+        if base not in cross_rates.index:
+            raise ValidationError({'base': [f'Unknown currency {base}.']})
+        unknown = [symbol for symbol in symbols or [] if symbol not in cross_rates.index]
+        if unknown:
+            raise ValidationError({'symbols': [f'Unknown currencies {",".join(unknown)}.']})
+
+        usage_counter.add(user)
+        return Response(
+            {
+                'base': base,
+                'date': cross_rates.date,
+                'timestamp': cross_rates.timestamp,
+                'rates': cross_rates.rates(base, symbols),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class ProviderStatusView(APIView):
+    """State of the circuit breaker and connections of the providers"""
+    permission_classes = [
+        SuperOnly,
+    ]
+
+    def get(self, request, format=None):
+        return Response(
+            {
+                'providers': breakers_status(PROVIDERS),
+                'connections': connection_stats(),
+                'latest_rate_cache': latest_rate_cache.stats(),
+                'api_key_cache': api_key_cache.stats(),
+            },
+            status=status.HTTP_200_OK,
+        )
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -1,6 +1,9 @@
-echo "migrate"
-python3 manage.py migrate
-echo "collectstatic"
-python3 manage.py collectstatic --noinput
+echo "prepare"
+# migrate and collectstatic, skipped when there is nothing to do
+python3 manage.py prepare
 echo "run"
-gunicorn exchange_rate.wsgi -w 3 -b :3000 --reload --error-logfile error.log --log-level=debug --timeout 3600 --capture-output
+if [ "$EXCHANGE_RATE_ASYNC" = "true" ]; then
+    uvicorn exchange_rate.asgi:application --host 0.0.0.0 --port 3000 --workers 3
+else
+    gunicorn exchange_rate.wsgi -w 3 -b :3000 --reload --error-logfile error.log --log-level=debug --timeout 3600 --capture-output
+fi
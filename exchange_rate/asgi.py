@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'exchange_rate.settings')
 
-application = get_asgi_application()
+# get_asgi_application() with the handler of the async streams
+django.setup(set_prefix=False)
+
+from utils.asgi import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()
@@ -37,9 +37,91 @@ INTERNAL_IPS = ['127.0.0.1']
 
 
 BANXICO_TOKEN = environ.get('BANXICO_TOKEN', '')
+BANXICO_API_URL = environ.get(
+    'BANXICO_API_URL',
+    'https://www.banxico.org.mx/SieAPIRest/service/v1',
+)
+# Banxico SIE series of each provider, used by the backfill
+BANXICO_SERIES = {
+    'banxico': 'SF43718',
+    'dof': 'SF60653',
+}
 FIXER_TOKEN = environ.get('FIXER_TOKEN', '')
+FIXER_API_URL = environ.get('FIXER_API_URL', 'http://data.fixer.io/api')
+DOF_URL = environ.get('DOF_URL', 'https://www.banxico.org.mx/tipcamb/tipCamMIAction.do')
 EXCHANGE_RATE_UPDATE_INTERVAL = int(environ.get('EXCHANGE_RATE_UPDATE_INTERVAL', '60'))
 MAX_REQUEST_USAGE = int(environ.get('MAX_REQUEST_USAGE', '100'))
+# When 'true' the rates are only refreshed by the refresh_rates worker
+EXCHANGE_RATE_BACKGROUND_REFRESH = (
+    environ.get('EXCHANGE_RATE_BACKGROUND_REFRESH', 'false') == 'true'
+)
+# When 'true' /latest/ is served by the async view and /events/ is enabled,
+# for the ASGI server
+EXCHANGE_RATE_ASYNC = environ.get('EXCHANGE_RATE_ASYNC', 'false') == 'true'
+# Seconds between the checks of the latest rate for the /events/ streams
+# and between their heartbeats
+EVENTS_POLL_INTERVAL = float(environ.get('EVENTS_POLL_INTERVAL', '1'))
+EVENTS_HEARTBEAT = int(environ.get('EVENTS_HEARTBEAT', '15'))
+# Rows sent again at most to a stream resuming from an old Last-Event-ID
+EVENTS_REPLAY_LIMIT = int(environ.get('EVENTS_REPLAY_LIMIT', '100'))
+EXCHANGE_RATE_LEASE_SECONDS = int(environ.get('EXCHANGE_RATE_LEASE_SECONDS', '120'))
+EXCHANGE_RATE_WORKER_POLL = int(environ.get('EXCHANGE_RATE_WORKER_POLL', '30'))
+# Seconds a /latest/?since=&wait= long poll can wait for a new rate
+LATEST_MAX_WAIT = int(environ.get('LATEST_MAX_WAIT', '60'))
+# Seconds an outdated latest rate stays cached while it is refreshed
+LATEST_RATE_CACHE_RETRY = int(environ.get('LATEST_RATE_CACHE_RETRY', '5'))
+# Directory of the memory mapped files shared by the workers of a node
+SHARED_SNAPSHOT_DIR = environ.get(
+    'SHARED_SNAPSHOT_DIR',
+    '/dev/shm' if os.path.isdir('/dev/shm') else '',
+)
+# Api keys resolved to their user kept by each process and seconds
+# until a key is read again from the database
+API_KEY_CACHE_SIZE = int(environ.get('API_KEY_CACHE_SIZE', '1024'))
+API_KEY_CACHE_TTL = int(environ.get('API_KEY_CACHE_TTL', '60'))
+# Seconds between the checks of the api keys version in the database, a
+# key changed in other node stops working after them at most
+API_KEY_VERSION_CHECK = int(environ.get('API_KEY_VERSION_CHECK', '5'))
+# Seconds the usage is counted in memory before it is written, and
+# number of locks the counters are split in
+USAGE_FLUSH_INTERVAL = int(environ.get('USAGE_FLUSH_INTERVAL', '5'))
+USAGE_STRIPES = int(environ.get('USAGE_STRIPES', '16'))
+# Requests per second and per minute of /latest/ of each api key and of
+# each user in every worker, 0 disables the limit
+RATE_LIMIT_KEY = (
+    int(environ.get('RATE_LIMIT_KEY_SECOND', '10')),
+    int(environ.get('RATE_LIMIT_KEY_MINUTE', '300')),
+)
+RATE_LIMIT_USER = (
+    int(environ.get('RATE_LIMIT_USER_SECOND', '20')),
+    int(environ.get('RATE_LIMIT_USER_MINUTE', '600')),
+)
+
+# HTTP client shared by the providers, timeouts in seconds
+PROVIDER_TIMEOUT = float(environ.get('PROVIDER_TIMEOUT', '10'))
+PROVIDER_TIMEOUTS = {
+    'banxico': float(environ.get('BANXICO_TIMEOUT', PROVIDER_TIMEOUT)),
+    'dof': float(environ.get('DOF_TIMEOUT', PROVIDER_TIMEOUT)),
+    'fixer': float(environ.get('FIXER_TIMEOUT', PROVIDER_TIMEOUT)),
+}
+PROVIDER_RETRIES = int(environ.get('PROVIDER_RETRIES', '2'))
+PROVIDER_RETRY_BACKOFF = float(environ.get('PROVIDER_RETRY_BACKOFF', '0.5'))
+PROVIDER_POOL_HOSTS = int(environ.get('PROVIDER_POOL_HOSTS', '10'))
+PROVIDER_POOL_SIZE = int(environ.get('PROVIDER_POOL_SIZE', '4'))
+# Days the exchange rate history is kept in the database by the
+# archive_history command (0 keeps it forever) and directory of the
+# gzip CSV files of the archived rows
+HISTORY_RETENTION_DAYS = int(environ.get('HISTORY_RETENTION_DAYS', '0'))
+HISTORY_ARCHIVE_DIR = environ.get('HISTORY_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+# Rows fetched from the database at a time by the history exports
+HISTORY_EXPORT_CHUNK_SIZE = int(environ.get('HISTORY_EXPORT_CHUNK_SIZE', '2000'))
+# Amounts accepted by /convert/ in one request
+CONVERT_MAX_AMOUNTS = int(environ.get('CONVERT_MAX_AMOUNTS', '50000'))
+
+# Failures in a row that open the circuit of a provider and seconds
+# until it is tried again
+CIRCUIT_BREAKER_FAILURES = int(environ.get('CIRCUIT_BREAKER_FAILURES', '3'))
+CIRCUIT_BREAKER_RESET = int(environ.get('CIRCUIT_BREAKER_RESET', '300'))
 
 # Application definition
 
@@ -13,12 +13,15 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.urls import path, include
 
 from rest_framework.routers import DefaultRouter
 
 from core import views as core
 
+latest_view = core.AsyncExchangeRateView if settings.EXCHANGE_RATE_ASYNC else core.ExchageRateView
+
 router = DefaultRouter()
 router.register(r'users', core.UserViewSet, 'user')
 router.register(r'key', core.ApiKeyViewSet, 'key')
@@ -26,5 +29,13 @@ router.register(r'key', core.ApiKeyViewSet, 'key')
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/', include('rest_framework.urls')),
-    path('latest/', core.ExchageRateView.as_view(), name='latest'),
+    path('latest/', latest_view.as_view(), name='latest'),
+    path('history/', core.HistoryView.as_view(), name='history'),
+    path('convert/', core.ConvertView.as_view(), name='convert'),
+    path('rates/', core.RatesView.as_view(), name='rates'),
+    path('rollups/', core.RollupView.as_view(), name='rollups'),
+    path('status/', core.ProviderStatusView.as_view(), name='status'),
 ]
+
+if settings.EXCHANGE_RATE_ASYNC:
+    urlpatterns.append(path('events/', core.RateEventsView.as_view(), name='events'))
@@ -0,0 +1,69 @@
+import os
+import csv
+import gzip
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import ExchangeRateHistory
+
+
+def archive_columns():
+    return [field.attname for field in ExchangeRateHistory._meta.concrete_fields]
+
+
+def archive_value(value):
+    if value is None:
+        return ''
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def write_archive(path, columns, rows):
+    """
+    Write the rows to a gzip CSV file, through a temporary file so a
+    file with the final name is always complete.
+    """
+    temp_path = f'{path}.tmp'
+    with gzip.open(temp_path, 'wt', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    os.replace(temp_path, path)
+
+
+def archive_history(days, directory, batch_size=10000):
+    """
+    Move the rows created more than ``days`` ago to gzip CSV files in
+    directory, one file per batch, deleting each batch once its file is
+    written. The latest row is always kept. The files are named after
+    the ids they hold, so a batch interrupted before the delete is
+    written again to the same file. Yields the path and rows of every
+    batch.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    latest = ExchangeRateHistory.objects.order_by('-created').values_list('pk', flat=True).first()
+    columns = archive_columns()
+    pk, created = columns.index('id'), columns.index('created')
+    old_rows = ExchangeRateHistory.objects.filter(created__lt=cutoff).exclude(pk=latest)
+    os.makedirs(directory, exist_ok=True)
+
+    while True:
+        rows = list(old_rows.order_by('created', 'pk').values_list(*columns)[:batch_size])
+        if not rows:
+            break
+
+        first, last = rows[0], rows[-1]
+        path = os.path.join(
+            directory,
+            f'exchange_rate_history_{first[created]:%Y%m%d}_{first[pk]}_{last[pk]}.csv.gz',
+        )
+        write_archive(path, columns, ([archive_value(v) for v in row] for row in rows))
+        # The rows up to the last one in (created, pk) order
+        with transaction.atomic():
+            old_rows.filter(
+                Q(created__lt=last[created])
+                | Q(created=last[created], pk__lte=last[pk])
+            ).delete()
+        yield path, len(rows)
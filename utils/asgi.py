@@ -0,0 +1,79 @@
+import asyncio
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+
+from django.core.handlers import asgi
+from django.http.response import HttpResponseBase
+
+# receive of the connection served by the current task
+_receive = ContextVar('receive')
+
+
+class AsyncStreamingResponse(HttpResponseBase):
+    """
+    Response with an async iterator of bytes as content, sent from the
+    event loop by ASGIHandler until it ends or the client disconnects.
+    """
+    streaming = True
+
+    def __init__(self, streaming_content, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streaming_content = streaming_content
+
+
+def response_headers(response):
+    """The headers and cookies of response for http.response.start"""
+    headers = []
+    for header, value in response.items():
+        if isinstance(header, str):
+            header = header.encode('ascii')
+        if isinstance(value, str):
+            value = value.encode('latin1')
+        headers.append((bytes(header), bytes(value)))
+    for cookie in response.cookies.values():
+        headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+    return headers
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    The Django 3.2 ASGIHandler, which iterates the streaming responses
+    synchronously, sending AsyncStreamingResponse without blocking the
+    event loop.
+    """
+
+    async def __call__(self, scope, receive, send):
+        _receive.set(receive)
+        await super().__call__(scope, receive, send)
+
+    async def send_response(self, response, send):
+        if not isinstance(response, AsyncStreamingResponse):
+            return await super().send_response(response, send)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers(response),
+        })
+        stream = asyncio.ensure_future(self.send_stream(response, send))
+        disconnect = asyncio.ensure_future(wait_disconnect(_receive.get()))
+        try:
+            await asyncio.wait({stream, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stream.cancel()
+            disconnect.cancel()
+            await asyncio.wait({stream, disconnect})
+        if not stream.cancelled():
+            stream.result()
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    async def send_stream(self, response, send):
+        async for part in response.streaming_content:
+            await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+        await send({'type': 'http.response.body'})
@@ -0,0 +1,53 @@
+import asyncio
+import weakref
+
+import httpx
+
+from django.conf import settings
+
+# Status codes retried like the requests session of http_client
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def build_client():
+    """
+    Return an async client with keep-alive connection pools, connection
+    errors are retried by the transport and server errors by get().
+    """
+    limits = httpx.Limits(
+        max_connections=settings.PROVIDER_POOL_HOSTS * settings.PROVIDER_POOL_SIZE,
+        max_keepalive_connections=settings.PROVIDER_POOL_HOSTS * settings.PROVIDER_POOL_SIZE,
+    )
+    transport = httpx.AsyncHTTPTransport(retries=settings.PROVIDER_RETRIES, limits=limits)
+    return httpx.AsyncClient(transport=transport)
+
+
+def get_client():
+    """
+    Return the client shared by the providers in the running event
+    loop, its connections can not be used from other loops.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = build_client()
+    return client
+
+
+async def get(provider, url, **kwargs):
+    """
+    GET url with the client and the timeout of the provider, the server
+    errors are retried with exponential backoff.
+    """
+    kwargs.setdefault(
+        'timeout',
+        settings.PROVIDER_TIMEOUTS.get(provider, settings.PROVIDER_TIMEOUT),
+    )
+    client = get_client()
+    for attempt in range(settings.PROVIDER_RETRIES + 1):
+        response = await client.get(url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == settings.PROVIDER_RETRIES:
+            return response
+        await asyncio.sleep(settings.PROVIDER_RETRY_BACKOFF * 2 ** attempt)
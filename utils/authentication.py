@@ -0,0 +1,139 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import NotFound
+
+from core.models import ApiKey, CacheVersion
+from core.serializers import UUIDSerializer
+from utils.shared_snapshot import get_snapshot
+
+
+API_KEYS = 'api_keys'
+
+
+def api_keys_snapshot():
+    """Its version changes every time a key or a user changes in the node"""
+    return get_snapshot(API_KEYS, 64)
+
+
+def expire_api_keys():
+    """Drop the keys cached by every process of the node"""
+    return api_keys_snapshot().update(lambda current: b'')
+
+
+def bump_api_keys_version():
+    """Drop the keys cached by the other nodes, in the transaction of the change"""
+    CacheVersion.bump(API_KEYS)
+
+
+class ApiKeyCache:
+    """
+    Bounded LRU of api key to user of this process. The entries expire
+    after API_KEY_CACHE_TTL seconds, and all of them when other process
+    of the node changes a key (the version of the api_keys snapshot) or
+    other node does (the version in the database, read every
+    API_KEY_VERSION_CHECK seconds).
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.users = OrderedDict()
+        self.version = None
+        self.database_version = None
+        self.checked = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_database_version(self):
+        now = self.clock()
+        if self.checked is None or now >= self.checked + settings.API_KEY_VERSION_CHECK:
+            self.database_version = CacheVersion.current(API_KEYS)
+            self.checked = now
+        return self.database_version
+
+    def get(self, api_key):
+        """Return a copy of the user of api_key, None if it does not exist"""
+        version = (api_keys_snapshot().version(), self.get_database_version())
+        with self.lock:
+            if self.version != version:
+                self.users.clear()
+                self.version = version
+            entry = self.users.get(api_key)
+            if entry is not None and self.clock() < entry[1]:
+                self.users.move_to_end(api_key)
+                self.hits += 1
+                return copy.copy(entry[0])
+            self.misses += 1
+
+        key = (
+            ApiKey.objects.select_related('user')
+            .filter(api_key=api_key, user__is_active=True)
+            .first()
+        )
+        if key is None:
+            return None
+
+        with self.lock:
+            # A key changed while it was read is read again next time
+            if self.version == version:
+                self.users[api_key] = (key.user, self.clock() + settings.API_KEY_CACHE_TTL)
+                self.users.move_to_end(api_key)
+                while len(self.users) > settings.API_KEY_CACHE_SIZE:
+                    self.users.popitem(last=False)
+        return copy.copy(key.user)
+
+    def invalidate(self, api_key):
+        with self.lock:
+            self.users.pop(api_key, None)
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+            self.checked = None
+
+    def stats(self):
+        return {
+            'size': len(self.users),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+api_key_cache = ApiKeyCache()
+
+
+class ApiKeyAuthentication(BaseAuthentication):
+    """
+    Api key in the Authorization header with the format 'Token {api_key}'
+    or in the api_key query param.
+    """
+
+    def authenticate(self, request):
+        api_key = (
+            request.headers.get(
+                'Authorization',
+                request.query_params.get('api_key', ''),
+            )
+            .replace('Token ', '')
+            .strip()
+        )
+        if not api_key:
+            return None
+
+        token = UUIDSerializer(
+            data={
+                'api_key': api_key,
+            }
+        )
+        token.is_valid(raise_exception=True)
+
+        user = api_key_cache.get(token.validated_data['api_key'])
+        if user is None:
+            raise NotFound()
+        return user, api_key
@@ -0,0 +1,128 @@
+import csv
+from decimal import Decimal
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import utc
+
+from core.models import ExchangeRateHistory, ProviderRate
+from utils.exchange_rates_sources import PROVIDERS, get_banxico_series
+from utils.provider_rates import provider_rates
+
+
+def parse_date(value):
+    """Dates of the dumps are ISO or dd/mm/yyyy like Banxico"""
+    value = value.strip()
+    if '/' in value:
+        return datetime.strptime(value, '%d/%m/%Y').date()
+    return date.fromisoformat(value)
+
+
+def read_dump(path, start, end):
+    """
+    Returns the observations between start and end of a CSV dump with
+    the columns provider, date and rate as a dict of date to a dict of
+    provider to rate.
+    """
+    observations = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            provider = row['provider'].strip().lower()
+            if provider not in PROVIDERS:
+                raise ValueError(f'Unknown provider {provider} in {path}')
+            d = parse_date(row['date'])
+            if start <= d <= end and row['rate'].strip() not in ('', 'N/E'):
+                observations.setdefault(d, {})[provider] = Decimal(row['rate'])
+    return observations
+
+
+def banxico_observations(start, end):
+    """Observations of the providers with a Banxico SIE series"""
+    providers = {serie: name for name, serie in settings.BANXICO_SERIES.items()}
+    series = get_banxico_series(list(providers), start, end)
+    if series is None:
+        raise IOError(f'Banxico series not available from {start} to {end}')
+
+    observations = {}
+    for serie, values in series.items():
+        for d, rate in values:
+            if serie in providers and start <= d <= end:
+                observations.setdefault(d, {})[providers[serie]] = rate
+    return observations
+
+
+def date_windows(start, end, days):
+    while start <= end:
+        window_end = min(start + timedelta(days=days - 1), end)
+        yield start, window_end
+        start = window_end + timedelta(days=1)
+
+
+def existing_dates(start, end):
+    """Dates already stored of each provider between start and end"""
+    return {
+        provider: set(
+            ExchangeRateHistory.objects.filter(
+                **{f'{provider}_date__range': (start, end)}
+            ).values_list(f'{provider}_date', flat=True)
+        )
+        for provider in PROVIDERS
+    }
+
+
+def history_rows(observations, existing):
+    """
+    Build one row per date with the providers observed that day which
+    are not stored yet, null for the others like a refresh does.
+    """
+    rows = []
+    for d in sorted(observations):
+        new = {
+            provider: rate
+            for provider, rate in observations[d].items()
+            if d not in existing[provider]
+        }
+        if not new:
+            continue
+
+        created = datetime.combine(d, time.min).replace(tzinfo=utc)
+        row = ExchangeRateHistory(created=created)
+        for provider in PROVIDERS:
+            values = (new[provider], d, created) if provider in new else (None, None, None)
+            setattr(row, f'{provider}_rate', values[0])
+            setattr(row, f'{provider}_date', values[1])
+            setattr(row, f'{provider}_last_updated', values[2])
+        rows.append(row)
+    return rows
+
+
+def backfill(start, end, files=(), use_api=True, window_days=365, batch_size=1000):
+    """
+    Backfill ExchangeRateHistory between start and end from the Banxico
+    series and the CSV dumps, one transaction per window of days. The
+    (provider, date) already stored are skipped, so it can be run again
+    after an interruption. Yields the window and the rows written.
+    """
+    dumps = {}
+    for path in files:
+        for d, values in read_dump(path, start, end).items():
+            dumps.setdefault(d, {}).update(values)
+
+    for window_start, window_end in date_windows(start, end, window_days):
+        observations = {}
+        if use_api:
+            observations = banxico_observations(window_start, window_end)
+        for d, values in dumps.items():
+            if window_start <= d <= window_end:
+                observations.setdefault(d, {}).update(values)
+
+        rows = history_rows(observations, existing_dates(window_start, window_end))
+        with transaction.atomic():
+            ExchangeRateHistory.objects.bulk_create(rows, batch_size=batch_size)
+            ProviderRate.objects.bulk_create(
+                [rate for row in rows for rate in provider_rates(row)],
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+        yield window_start, window_end, len(rows)
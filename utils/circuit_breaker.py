@@ -0,0 +1,106 @@
+import time
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """
+    Stop calling a provider after ``failure_threshold`` consecutive
+    failures. Once ``reset_timeout`` seconds passed it lets one trial
+    call through (half-open), closing again if it succeeds.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def allow_request(self):
+        """Return True if the provider can be called now"""
+        with self.lock:
+            state = self.state
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.warning('Circuit of %s closed', self.name)
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning('Circuit of %s opened', self.name)
+                self.opened_at = self.clock()
+            self.trial = False
+
+    def release(self):
+        """End a call without a result, a half-open circuit lets the next one through"""
+        with self.lock:
+            self.trial = False
+
+    def status(self):
+        state = self.state
+        retry_in = None
+        if state == OPEN:
+            retry_in = round(self.reset_timeout - (self.clock() - self.opened_at), 1)
+        return {
+            'state': state,
+            'failures': self.failures,
+            'retry_in': retry_in,
+        }
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Return the circuit breaker of a provider in this process"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.setdefault(
+                name,
+                CircuitBreaker(
+                    name,
+                    settings.CIRCUIT_BREAKER_FAILURES,
+                    settings.CIRCUIT_BREAKER_RESET,
+                ),
+            )
+    return breaker
+
+
+def breakers_status(names):
+    """Return the state of the circuit breaker of every provider"""
+    return {name: get_breaker(name).status() for name in names}
@@ -0,0 +1,108 @@
+import threading
+from array import array
+
+from core.models import CurrencyRates
+from utils.rate_cache import latest_rate_cache
+
+# Significant digits of the cross rates returned
+CROSS_RATE_DIGITS = 10
+
+
+def pack_rates(base, rates):
+    """The symbols comma separated and their rates packed as doubles"""
+    rates = {symbol: float(rate) for symbol, rate in rates.items() if rate}
+    rates.setdefault(base, 1.0)
+    symbols = sorted(rates)
+    return ','.join(symbols), array('d', (rates[symbol] for symbol in symbols)).tobytes()
+
+
+def store_currency_rates(data, fetched_at):
+    """
+    Store the rates of every currency of a Fixer response, once per
+    Fixer update (timestamp).
+    """
+    symbols, rates = pack_rates(data['base'], data['rates'])
+    row = CurrencyRates(
+        base=data['base'],
+        date=data['date'],
+        timestamp=data['timestamp'],
+        fetched_at=fetched_at,
+        symbols=symbols,
+        rates=rates,
+    )
+    CurrencyRates.objects.bulk_create([row], ignore_conflicts=True)
+
+
+class CrossRates:
+    """
+    The N x N matrix of the rates between every currency of a
+    CurrencyRates row, row i is the value of one unit of the symbol i in
+    each symbol. Computed once per row in a flat array of doubles.
+    """
+
+    def __init__(self, row):
+        self.key = row.pk
+        self.date = row.date
+        self.timestamp = row.timestamp
+        self.symbols = row.symbols.split(',')
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+        rates = array('d')
+        rates.frombytes(bytes(row.rates))
+        self.matrix = array('d')
+        for rate in rates:
+            self.matrix.extend([value / rate for value in rates])
+
+    def rates(self, base, symbols=None):
+        """The rates of one unit of base in symbols, every one by default"""
+        size = len(self.symbols)
+        start = self.index[base] * size
+        row = self.matrix[start:start + size]
+        if symbols is None:
+            symbols = self.symbols
+        return {
+            symbol: float(f'{row[self.index[symbol]]:.{CROSS_RATE_DIGITS}g}')
+            for symbol in symbols
+        }
+
+
+class CrossRatesCache:
+    """
+    Per process cache of the cross rates of the latest CurrencyRates
+    row. It is checked again only when there is a new exchange rate
+    history row, so there is one query per refresh and the matrix is
+    computed once per Fixer update.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.cross_rates = None
+
+    def get(self):
+        """The latest CrossRates, None if no rates were stored"""
+        latest = latest_rate_cache.get()
+        version = None if latest is None else (latest.pk, latest.created)
+        with self.lock:
+            if self.version is not None and self.version == version:
+                return self.cross_rates
+
+        cross_rates = self.cross_rates
+        row = CurrencyRates.objects.order_by('-timestamp').first()
+        if row is None:
+            cross_rates = None
+        elif cross_rates is None or cross_rates.key != row.pk:
+            cross_rates = CrossRates(row)
+
+        with self.lock:
+            self.version = version
+            self.cross_rates = cross_rates
+        return cross_rates
+
+    def clear(self):
+        with self.lock:
+            self.version = None
+            self.cross_rates = None
+
+
+cross_rates_cache = CrossRatesCache()
@@ -1,102 +1,416 @@
-import requests
-from bs4 import BeautifulSoup
+import json
+import asyncio
+import logging
+from io import BytesIO
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
+
 from decimal import Decimal
 from datetime import datetime, date
-from requests.exceptions import RequestException
+from asgiref.sync import sync_to_async
 
 from django.conf import settings
+from django.utils.timezone import utc
 
+from utils.circuit_breaker import get_breaker
 
-def get_banxico_rate():
+# The HTTP clients (requests, httpx) and the parsers (bs4, lxml) are
+# imported by the functions that use them, so a worker only loads them
+# when it fetches a provider.
+
+logger = logging.getLogger(__name__)
+
+# The rates table of the DOF page and the cells with the dates of its rows
+DOF_TABLE = 8
+DOF_CELLS = range(5, 28, 4)
+
+
+def parse_banxico_rate(text):
+    """Returns the first observation of a Banxico SIE XML response"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(text, 'lxml')
+    rate = Decimal(soup.find('obs').find('dato').text)
+    d = datetime.strptime(
+        soup.find('obs').find('fecha').text,
+        '%d/%m/%Y',
+    ).date()
+    return {
+        'date': d,
+        'rate': rate,
+    }
+
+
+def parse_banxico_series(content):
     """
-    Returns the latest exchange rate of US dollars in Mexican peso
-    from Banxico, date and the boolean if it was updated.
+    Returns the observations of every serie of a Banxico SIE XML
+    response as a dict of idSerie to a list of (date, rate), skipping
+    the dates without rate (N/E).
+    """
+    from lxml import etree
+
+    series = {}
+    observations = None
+    values = {}
+    for event, element in etree.iterparse(BytesIO(content), events=('start', 'end')):
+        tag = element.tag.lower() if isinstance(element.tag, str) else ''
+        if event == 'start':
+            if tag == 'serie':
+                observations = series.setdefault(element.get('idSerie'), [])
+            elif tag == 'obs':
+                values = {}
+            continue
+
+        if tag in ('fecha', 'dato'):
+            values[tag] = (element.text or '').strip()
+        elif tag == 'obs':
+            if observations is not None and values.get('dato', 'N/E') != 'N/E':
+                observations.append((
+                    datetime.strptime(values['fecha'], '%d/%m/%Y').date(),
+                    Decimal(values['dato'].replace(',', '')),
+                ))
+            element.clear()
+    return series
+
+
+def get(provider, url, headers):
+    """GET url with the session of the providers, None if it fails"""
+    from requests.exceptions import RequestException
+    from utils import http_client
+
+    try:
+        return http_client.get(provider, url, headers=headers)
+    except RequestException:
+        return None
+
+
+def get_banxico_series(series, start, end):
+    """
+    Returns the observations of the Banxico SIE series between the
+    start and end dates, None if the request fails.
     """
     url = (
-        'https://www.banxico.org.mx/SieAPIRest/service/v1/series/SF43718/datos/oportuno'
+        f'{settings.BANXICO_API_URL}/series/{",".join(series)}'
+        f'/datos/{start.isoformat()}/{end.isoformat()}'
     )
     headers = {
         'Bmx-Token': settings.BANXICO_TOKEN,
         'Accept': 'application/xml',
     }
-    try:
-        req = requests.get(url, headers=headers)
-    except RequestException:
+    req = get('banxico', url, headers)
+    if req is not None and req.ok and req.status_code == 200:
+        return parse_banxico_series(req.content)
+    else:
         return None
 
-    if req.ok and req.status_code == 200:
-        soup = BeautifulSoup(req.text, 'lxml')
-        rate = Decimal(soup.find('obs').find('dato').text)
-        d = datetime.strptime(
-            soup.find('obs').find('fecha').text,
-            '%d/%m/%Y',
-        ).date()
-        return {
-            'date': d,
-            'rate': rate,
-        }
+
+def banxico_request():
+    """URL and headers of the latest Banxico rate"""
+    url = (
+        f'{settings.BANXICO_API_URL}/series/{settings.BANXICO_SERIES["banxico"]}/datos/oportuno'
+    )
+    headers = {
+        'Bmx-Token': settings.BANXICO_TOKEN,
+        'Accept': 'application/xml',
+    }
+    return url, headers
+
+
+def get_banxico_rate():
+    """
+    Returns the latest exchange rate of US dollars in Mexican peso
+    from Banxico, date and the boolean if it was updated.
+    """
+    url, headers = banxico_request()
+    req = get('banxico', url, headers)
+    if req is not None and req.ok and req.status_code == 200:
+        return parse_banxico_rate(req.text)
     else:
         return None
 
 
+class TableCellsParser(HTMLParser):
+    """
+    Collect the text of the cells of one table in a streaming way,
+    without building the document tree. The tables are counted in
+    document order like ``soup.find_all('table')`` and it stops once
+    it has ``max_cells`` cells or the table is closed.
+    """
+
+    def __init__(self, table_index, max_cells):
+        super().__init__(convert_charrefs=True)
+        self.table_index = table_index
+        self.max_cells = max_cells
+        self.tables = 0
+        self.depth = 0
+        self.open_cells = []
+        self.cells = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            if self.depth:
+                self.depth += 1
+            elif self.tables == self.table_index:
+                self.depth = 1
+            self.tables += 1
+        elif tag == 'td' and self.depth and len(self.cells) < self.max_cells:
+            self.cells.append([])
+            self.open_cells.append((len(self.cells) - 1, self.depth))
+
+    def handle_endtag(self, tag):
+        if not self.depth:
+            return
+        if tag == 'td' and self.open_cells:
+            self.open_cells.pop()
+        elif tag == 'table':
+            # The cells still open are closed with their table
+            while self.open_cells and self.open_cells[-1][1] >= self.depth:
+                self.open_cells.pop()
+            self.depth -= 1
+            if not self.depth:
+                self.done = True
+
+        if len(self.cells) >= self.max_cells and not self.open_cells:
+            self.done = True
+
+    def handle_data(self, data):
+        for index, _ in self.open_cells:
+            self.cells[index].append(data)
+
+
+def table_cells(text, table_index, max_cells, chunk_size=8192):
+    """
+    Returns the text of the first ``max_cells`` cells of the table
+    ``table_index`` of an HTML document.
+    """
+    parser = TableCellsParser(table_index, max_cells)
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+        if parser.done:
+            break
+    return [''.join(cell) for cell in parser.cells]
+
+
+def parse_dof_rate(text):
+    """
+    Returns the latest DOF exchange rate from the Banxico tipCamMIAction
+    page, skipping the dates without rate (N/E).
+    """
+    cells = table_cells(text, DOF_TABLE, DOF_CELLS[-1] + 2)
+    for i in DOF_CELLS:
+        temp_date = cells[i]
+        temp_rate = cells[i+1]
+        if 'N/E' not in temp_rate:
+            break
+
+    d = datetime.strptime(
+        temp_date.replace('\r\n', '').strip(),
+        '%d/%m/%Y',
+    ).date()
+    temp_rate = temp_rate.replace('\r\n', '').strip()
+    if temp_rate == 'N/E':
+        return None
+    else:
+        rate = Decimal(temp_rate)
+    return {
+        'date': d,
+        'rate': rate,
+    }
+
+
+def dof_request():
+    """URL and headers of the DOF rates page"""
+    return settings.DOF_URL, {}
+
+
 def get_dof_rate():
     """
     Returns the latest exchange rate of US dollars in Mexican peso
     from DOF, date and the boolean if it was updated.
     """
-    url = 'https://www.banxico.org.mx/tipcamb/tipCamMIAction.do'
-    try:
-        req = requests.get(url)
-    except RequestException:
-        return None
-
-    if req.ok and req.status_code == 200:
-        soup = BeautifulSoup(req.text, 'html.parser')
-        for i in range(5, 28, 4):
-            temp_date = soup.find_all('table')[8].find_all('td')[i].text
-            temp_rate = soup.find_all('table')[8].find_all('td')[i+1].text
-            if 'N/E' not in temp_rate:
-                break
-
-        d = datetime.strptime(
-            temp_date.replace('\r\n', '').strip(),
-            '%d/%m/%Y',
-        ).date()
-        temp_rate = temp_rate.replace('\r\n', '').strip()
-        if temp_rate == 'N/E':
-            return None
-        else:
-            rate = Decimal(temp_rate)
-        return {
-            'date': d,
-            'rate': rate,
-        }
+    url, headers = dof_request()
+    req = get('dof', url, headers)
+    if req is not None and req.ok and req.status_code == 200:
+        return parse_dof_rate(req.text)
     else:
         return None
 
 
+def parse_fixer_rate(data):
+    """
+    Returns the USD to MXN rate of a decoded Fixer latest response, and
+    the rates of every currency against its base at its timestamp.
+    """
+    if data['base'] == 'EUR':
+        rate = Decimal(data['rates']['MXN']) / Decimal(data['rates']['USD'])
+
+    elif data['base'] == 'USD':
+        rate = Decimal(data['rates']['MXN'])
+
+    return {
+        'date': date.fromisoformat(data['date']),
+        'rate': rate.quantize(Decimal('.0001')),
+        'base': data['base'],
+        'timestamp': datetime.fromtimestamp(data['timestamp'], tz=utc),
+        'rates': data['rates'],
+    }
+
+
+def fixer_request():
+    """URL and headers of the latest Fixer rates, every symbol"""
+    return f'{settings.FIXER_API_URL}/latest?access_key={settings.FIXER_TOKEN}', {}
+
+
 def get_fixer_rate():
     """
     Returns the latest exchange rate of US dollars in Mexican peso
-    from Fixer API, date and the boolean if it was updated.
+    from Fixer API, date and the boolean if it was updated. Every symbol
+    is fetched in the same call for the cross rates.
     """
-    url = f'http://data.fixer.io/api/latest?access_key={settings.FIXER_TOKEN}&symbols=USD,MXN'
-    try:
-        req = requests.get(url)
-    except RequestException:
+    url, headers = fixer_request()
+    req = get('fixer', url, headers)
+    if req is not None and req.ok and req.status_code == 200:
+        return parse_fixer_rate(req.json())
+    else:
         return None
 
-    if req.ok and req.status_code == 200:
-        data = req.json()
-        if data['base'] == 'EUR':
-            rate = Decimal(data['rates']['MXN']) / Decimal(data['rates']['USD'])
 
-        elif data['base'] == 'USD':
-            rate = Decimal(data['rates']['MXN'])
+PROVIDERS = {
+    'dof': get_dof_rate,
+    'fixer': get_fixer_rate,
+    'banxico': get_banxico_rate,
+}
+
+
+class ProviderCall:
+    """
+    The circuit breaker bookkeeping of a provider call, for the sync and
+    the async fetches. ``allowed`` is False while the circuit is open,
+    the ``data`` set in the block is recorded on exit (None or an error
+    is a failure). A call cancelled before its result gives back the
+    trial of a half-open circuit.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.breaker = get_breaker(name)
+        self.allowed = False
+        self.data = None
+
+    def __enter__(self):
+        self.allowed = self.breaker.allow_request()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.allowed:
+            return False
+        if exc_type is not None and not issubclass(exc_type, Exception):
+            # CancelledError, KeyboardInterrupt
+            self.breaker.release()
+            return False
+        if exc_type is not None:
+            logger.error('Error fetching the %s exchange rate', self.name, exc_info=(exc_type, exc, tb))
+            self.data = None
+
+        if self.data is None:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return True
+
 
-        return {
-            'date': date.fromisoformat(data['date']),
-            'rate': rate.quantize(Decimal('.0001')),
+def fetch_provider(name, fetch):
+    """
+    Call a provider through its circuit breaker, returns None without
+    calling it while its circuit is open.
+    """
+    with ProviderCall(name) as call:
+        if call.allowed:
+            call.data = fetch()
+    return call.data
+
+
+def fetch_rates(providers=None):
+    """
+    Fetch all the providers concurrently, so a refresh takes as long as
+    the slowest provider. Returns a dict with the data of each provider,
+    None for the ones that failed or whose circuit is open.
+    """
+    if providers is None:
+        providers = PROVIDERS
+
+    with ThreadPoolExecutor(max_workers=len(providers)) as executor:
+        futures = {
+            name: executor.submit(fetch_provider, name, fetch)
+            for name, fetch in providers.items()
         }
+    return {name: future.result() for name, future in futures.items()}
+
+
+async def get_async(provider, request, parse):
+    """
+    GET the request of a provider with the async client and parse the
+    text of the response, None if it fails.
+    """
+    import httpx
+    from utils import async_http_client
+
+    url, headers = request()
+    try:
+        response = await async_http_client.get(provider, url, headers=headers)
+    except httpx.HTTPError:
+        return None
+
+    if response.status_code == 200:
+        return parse(response.text)
     else:
         return None
+
+
+async def get_banxico_rate_async():
+    """get_banxico_rate without blocking the event loop while it waits"""
+    return await get_async('banxico', banxico_request, parse_banxico_rate)
+
+
+async def get_dof_rate_async():
+    """get_dof_rate without blocking the event loop while it waits"""
+    return await get_async('dof', dof_request, parse_dof_rate)
+
+
+async def get_fixer_rate_async():
+    """get_fixer_rate without blocking the event loop while it waits"""
+    return await get_async('fixer', fixer_request, lambda text: parse_fixer_rate(json.loads(text)))
+
+
+# The async version of each provider, the others run in a thread
+ASYNC_PROVIDERS = {
+    get_dof_rate: get_dof_rate_async,
+    get_fixer_rate: get_fixer_rate_async,
+    get_banxico_rate: get_banxico_rate_async,
+}
+
+
+async def fetch_provider_async(name, fetch):
+    """fetch_provider in the event loop"""
+    with ProviderCall(name) as call:
+        if call.allowed and fetch in ASYNC_PROVIDERS:
+            call.data = await ASYNC_PROVIDERS[fetch]()
+        elif call.allowed:
+            call.data = await sync_to_async(fetch, thread_sensitive=False)()
+    return call.data
+
+
+async def fetch_rates_async(providers=None):
+    """
+    fetch_rates in the event loop, the providers are fetched
+    concurrently without a thread each.
+    """
+    if providers is None:
+        providers = PROVIDERS
+
+    names = list(providers)
+    results = await asyncio.gather(*(
+        fetch_provider_async(name, providers[name]) for name in names
+    ))
+    return dict(zip(names, results))
@@ -21,3 +21,12 @@ def exchange_rate_format(data):
         },
         'created': data.created,
     }
+
+
+def history_columns(providers):
+    """Columns of the history rows with the values of the providers"""
+    return ['id', 'created'] + [
+        f'{provider}_{field}'
+        for provider in providers
+        for field in ('rate', 'date', 'last_updated')
+    ]
@@ -0,0 +1,86 @@
+import os
+import threading
+
+from django.conf import settings
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+
+def build_session():
+    """
+    Return a session with keep-alive connection pools and bounded
+    retries with exponential backoff for the idempotent requests.
+    """
+    # Imported with the first session, the workers that never fetch a
+    # provider do not load them
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=settings.PROVIDER_RETRIES,
+        backoff_factor=settings.PROVIDER_RETRY_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=('GET', 'HEAD'),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings.PROVIDER_POOL_HOSTS,
+        pool_maxsize=settings.PROVIDER_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """
+    Return the session shared by the providers of this process, a new
+    one is built after a fork so the workers never share sockets.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = build_session()
+                _session_pid = pid
+    return _session
+
+
+def get(provider, url, **kwargs):
+    """GET url with the session and the timeout of the provider"""
+    kwargs.setdefault(
+        'timeout',
+        settings.PROVIDER_TIMEOUTS.get(provider, settings.PROVIDER_TIMEOUT),
+    )
+    return get_session().get(url, **kwargs)
+
+
+def connection_stats():
+    """
+    Return the connections opened and reused by the session of this
+    process, taken from the urllib3 pool of every host.
+    """
+    stats = {
+        'requests': 0,
+        'opened': 0,
+        'reused': 0,
+    }
+    if _session is None or _session_pid != os.getpid():
+        return stats
+
+    adapters = {id(adapter): adapter for adapter in _session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats['requests'] += pool.num_requests
+            stats['opened'] += pool.num_connections
+    stats['reused'] = max(stats['requests'] - stats['opened'], 0)
+    return stats
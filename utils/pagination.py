@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination
+
+
+class HistoryPagination(CursorPagination):
+    """Keyset pagination of the history, newest first"""
+    ordering = ('-created', '-id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class RollupPagination(CursorPagination):
+    """Keyset pagination of the rollups, newest first"""
+    ordering = ('-bucket', 'provider')
+    page_size = 500
+    page_size_query_param = 'page_size'
+    max_page_size = 2000
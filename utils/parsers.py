@@ -0,0 +1,27 @@
+import csv
+import codecs
+
+from django.conf import settings
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class CSVParser(BaseParser):
+    """
+    Parser of a CSV body of amounts, the first column of each row. The
+    first row is skipped if it is the amount header.
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            lines = codecs.iterdecode(stream, encoding)
+            rows = [row for row in csv.reader(lines) if row]
+        except (UnicodeDecodeError, csv.Error) as exc:
+            raise ParseError(f'CSV parse error - {exc}')
+        if rows and rows[0][0].strip().lower() == 'amount':
+            rows = rows[1:]
+        return {'amounts': [row[0] for row in rows]}
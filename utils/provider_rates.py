@@ -0,0 +1,94 @@
+from django.db.models import OuterRef, Subquery
+
+from core.models import ExchangeRateHistory, ProviderRate
+from utils.exchange_rates_sources import PROVIDERS
+
+# The values of a provider in a history row and their ProviderRate field
+PROVIDER_FIELDS = [('rate', 'rate'), ('date', 'date'), ('last_updated', 'fetched_at')]
+
+
+def provider_rates(row, providers=None):
+    """
+    The ProviderRate of each provider with a rate in a history row,
+    fetched when the row says it was last updated.
+    """
+    if providers is None:
+        providers = PROVIDERS
+
+    rates = []
+    for provider in providers:
+        rate = getattr(row, f'{provider}_rate', None)
+        date = getattr(row, f'{provider}_date', None)
+        fetched_at = getattr(row, f'{provider}_last_updated', None)
+        if rate is not None and date is not None and fetched_at is not None:
+            rates.append(ProviderRate(provider=provider, date=date, fetched_at=fetched_at, rate=rate))
+    return rates
+
+
+def latest_provider_rate(provider, until=None):
+    """The rates of provider fetched up to until, the latest first"""
+    rates = ProviderRate.objects.filter(provider=provider)
+    if until is not None:
+        rates = rates.filter(fetched_at__lte=until)
+    return rates.order_by('-fetched_at', '-id')
+
+
+def latest_provider_rates(providers=None):
+    """
+    The latest ProviderRate of each provider by name, one query with a
+    subquery per provider on the (provider, fetched_at) index.
+    """
+    if providers is None:
+        providers = PROVIDERS
+
+    latest = [Subquery(latest_provider_rate(provider).values('pk')[:1]) for provider in providers]
+    return {rate.provider: rate for rate in ProviderRate.objects.filter(pk__in=latest)}
+
+
+def with_latest_rates(rows, providers=None):
+    """
+    The history rows with the rates of the providers that did not answer
+    their refresh (null in the row) taken from the latest ProviderRate
+    fetched up to the row, read in the same query with a subquery per
+    provider and value on the (provider, fetched_at) index.
+    """
+    if providers is None:
+        providers = PROVIDERS
+
+    annotations = {}
+    for provider in providers:
+        latest = latest_provider_rate(provider, until=OuterRef('created'))
+        for field, rate_field in PROVIDER_FIELDS:
+            annotations[f'latest_{provider}_{field}'] = Subquery(latest.values(rate_field)[:1])
+
+    return [fill_rates(row, row, providers, prefix='latest_') for row in rows.annotate(**annotations)]
+
+
+def fill_rates(row, previous, providers=None, prefix=''):
+    """
+    The history row with the values of the providers that did not answer
+    (null in it) copied from previous, the row before it.
+    """
+    if providers is None:
+        providers = PROVIDERS
+
+    if previous is not None:
+        for provider in providers:
+            if getattr(row, f'{provider}_rate') is None:
+                for field, _ in PROVIDER_FIELDS:
+                    setattr(row, f'{provider}_{field}', getattr(previous, f'{prefix}{provider}_{field}'))
+    return row
+
+
+def complete_rate(row):
+    """with_latest_rates of a single row, without a query if it has every rate"""
+    if all(getattr(row, f'{provider}_rate') is not None for provider in PROVIDERS):
+        return row
+    rows = with_latest_rates(ExchangeRateHistory.objects.filter(pk=row.pk))
+    return rows[0] if rows else row
+
+
+def latest_rate():
+    """The latest history row with the latest rate of every provider, in one query"""
+    rows = with_latest_rates(ExchangeRateHistory.objects.order_by('-created')[:1])
+    return rows[0] if rows else None
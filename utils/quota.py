@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, Q, Value, When
+from django.utils.timezone import utc
+
+USAGE_PERIOD = timedelta(days=30)
+
+
+def utc_today():
+    return datetime.utcnow().replace(tzinfo=utc).date()
+
+
+def usage_window(usage, usage_end_date, today=None):
+    """
+    The usage and the end date of the current usage window. A window
+    without end date or already over is a new one starting today, it is
+    only written by the next usage flush or by reset_usage_windows.
+    """
+    today = today or utc_today()
+    if usage is None or usage_end_date is None or today >= usage_end_date:
+        return 0, today + USAGE_PERIOD
+    return usage, usage_end_date
+
+
+def over_limit(usage):
+    return usage >= settings.MAX_REQUEST_USAGE
+
+
+def expired_windows(today=None):
+    """Users whose usage window has no end date or is over"""
+    today = today or utc_today()
+    return (
+        Q(usage__isnull=True)
+        | Q(usage_end_date__isnull=True)
+        | Q(usage_end_date__lte=today)
+    )
+
+
+def add_usage(n, today=None):
+    """
+    Values of an UPDATE adding n requests to the usage, the users with an
+    expired window start a new one with n requests.
+    """
+    today = today or utc_today()
+    return {
+        'usage': Case(
+            When(expired_windows(today), then=Value(n)),
+            default=F('usage') + n,
+        ),
+        'usage_end_date': Case(
+            When(expired_windows(today), then=Value(today + USAGE_PERIOD)),
+            default=F('usage_end_date'),
+        ),
+    }
+
+
+def reset_windows(queryset, today=None):
+    """Start a new usage window for every expired one in a single UPDATE"""
+    today = today or utc_today()
+    return queryset.filter(expired_windows(today)).update(
+        usage=0,
+        usage_end_date=today + USAGE_PERIOD,
+    )
@@ -0,0 +1,218 @@
+import json
+import asyncio
+import hashlib
+import weakref
+import threading
+from collections import namedtuple
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from rest_framework.renderers import JSONRenderer
+
+from core.models import ExchangeRateHistory
+from utils.format_data import exchange_rate_format
+from utils.provider_rates import latest_rate
+from utils.shared_snapshot import get_snapshot
+
+SNAPSHOT_SIZE = 4096
+
+
+def encode_rate(rate):
+    """The values of the row as JSON bytes"""
+    values = {}
+    for field in rate._meta.concrete_fields:
+        value = getattr(rate, field.attname)
+        if value is not None and not isinstance(value, int):
+            value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        values[field.attname] = value
+    return json.dumps(values).encode()
+
+
+def decode_rate(data):
+    """The row encoded by encode_rate, as if it was read from the database"""
+    values = json.loads(data)
+    fields = ExchangeRateHistory._meta.concrete_fields
+    return ExchangeRateHistory.from_db(
+        'default',
+        [field.attname for field in fields],
+        [
+            None if values[field.attname] is None else field.to_python(values[field.attname])
+            for field in fields
+        ],
+    )
+
+
+# JSON body of a row with its validators for conditional requests
+RenderedRate = namedtuple('RenderedRate', ['key', 'body', 'etag', 'last_modified'])
+
+
+def render_rate(rate):
+    """Render the /latest/ JSON body of a row once"""
+    body = JSONRenderer().render(exchange_rate_format(rate))
+    return RenderedRate(
+        key=(rate.pk, rate.created),
+        body=body,
+        etag='"%s"' % hashlib.sha1(body).hexdigest(),
+        last_modified=int(rate.created.timestamp()),
+    )
+
+
+def schema_fingerprint():
+    """Short hash of the fields of the rows, it changes with the model"""
+    fields = ','.join(field.attname for field in ExchangeRateHistory._meta.concrete_fields)
+    return hashlib.sha1(fields.encode()).hexdigest()[:8]
+
+
+def latest_snapshot():
+    """
+    The latest row shared by the processes of this node, one snapshot
+    per schema so a deploy never reads the rows of the previous one.
+    """
+    return get_snapshot(f'latest_rate_{schema_fingerprint()}', SNAPSHOT_SIZE)
+
+
+def read_rate(data):
+    """decode_rate, None if there is no data or it can not be decoded"""
+    if not data:
+        return None
+    try:
+        return decode_rate(data)
+    except (KeyError, TypeError, ValueError, ValidationError):
+        return None
+
+
+def publish_rate(rate):
+    """Share rate with the other processes, unless they have a newer one"""
+    def replace(current):
+        shared = read_rate(current)
+        if shared is not None:
+            if (shared.created, shared.pk) >= (rate.created, rate.pk):
+                return None
+        return encode_rate(rate)
+
+    return latest_snapshot().update(replace)
+
+
+class LatestRateCache:
+    """
+    Per process cache of the latest ExchangeRateHistory row, with the
+    latest rate of the providers it does not have (latest_rate). It expires
+    when the next refresh is due or when other process shares a new row
+    in the snapshot of the node, so it only reads the database when the
+    snapshot is outdated.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.async_locks = weakref.WeakKeyDictionary()
+        self.rate = None
+        self.version = None
+        self.expires = None
+        self.rendered = None
+        self.hits = 0
+        self.misses = 0
+
+    def due(self, rate):
+        """When the refresh of the row is due"""
+        return rate.created + timedelta(minutes=settings.EXCHANGE_RATE_UPDATE_INTERVAL)
+
+    def expiry(self, rate):
+        """
+        The row is valid until its refresh is due, an outdated row (or
+        no row) is checked again after LATEST_RATE_CACHE_RETRY seconds.
+        """
+        retry = timezone.now() + timedelta(seconds=settings.LATEST_RATE_CACHE_RETRY)
+        if rate is None:
+            return retry
+        return max(self.due(rate), retry)
+
+    def cached(self):
+        """
+        Return (True, row) while the row of this process is valid, and
+        (False, None) when get() has to read the snapshot or the database.
+        """
+        snapshot = latest_snapshot()
+        with self.lock:
+            if (
+                self.expires is not None
+                and self.version == snapshot.version()
+                and timezone.now() < self.expires
+            ):
+                self.hits += 1
+                return True, self.rate
+            self.misses += 1
+        return False, None
+
+    def get(self):
+        """Return the latest row, from the snapshot or the database on a miss"""
+        hit, rate = self.cached()
+        if hit:
+            return rate
+
+        version, data = latest_snapshot().read()
+        rate = read_rate(data)
+        if rate is None or timezone.now() >= self.due(rate):
+            latest = latest_rate()
+            if latest is not None:
+                version = publish_rate(latest)
+                if rate is None or (latest.created, latest.pk) > (rate.created, rate.pk):
+                    rate = latest
+
+        with self.lock:
+            self.rate = rate
+            self.version = version
+            self.expires = self.expiry(rate)
+        return rate
+
+    async def get_async(self):
+        """
+        get() for the async views, on a miss one coroutine of the event
+        loop reads the row in a thread and the others wait for it.
+        """
+        hit, rate = self.cached()
+        if hit:
+            return rate
+
+        loop = asyncio.get_running_loop()
+        lock = self.async_locks.get(loop)
+        if lock is None:
+            lock = self.async_locks[loop] = asyncio.Lock()
+        async with lock:
+            hit, rate = self.cached()
+            if hit:
+                return rate
+            return await sync_to_async(self.get)()
+
+    def render(self, rate):
+        """The rendered body of rate, kept until there is a new row"""
+        rendered = self.rendered
+        if rendered is None or rendered.key != (rate.pk, rate.created):
+            rendered = render_rate(rate)
+            self.rendered = rendered
+        return rendered
+
+    def invalidate(self):
+        """Read the row again on the next get"""
+        with self.lock:
+            self.expires = None
+
+    def clear(self):
+        """Forget the row of this process and of the shared snapshot"""
+        self.invalidate()
+        latest_snapshot().clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'version': self.version,
+            'expires': self.expires,
+        }
+
+
+latest_rate_cache = LatestRateCache()
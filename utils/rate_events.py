@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import weakref
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db.models import Q
+
+from core.models import ExchangeRateHistory
+from utils.provider_rates import with_latest_rates
+from utils.rate_cache import latest_rate_cache, render_rate
+from utils.refresh import rate_is_outdated, refresh_if_outdated_async
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = b': heartbeat\n\n'
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def rate_event(rate, body):
+    """The 'rate' event of a row, its id is the id of the row"""
+    return b'id: %d\nevent: rate\ndata: %s\n\n' % (rate.pk, body)
+
+
+def missed_rates(last_event_id, limit):
+    """
+    The newest rows (up to limit) after the row last_event_id, oldest
+    first, None if that row does not exist.
+    """
+    last = ExchangeRateHistory.objects.filter(pk=last_event_id).values_list('created', 'pk').first()
+    if last is None:
+        return None
+    created, pk = last
+    rows = ExchangeRateHistory.objects.filter(
+        Q(created__gt=created) | Q(created=created, pk__gt=pk)
+    ).order_by('-created', '-id')[:limit]
+    return with_latest_rates(rows)[::-1]
+
+
+async def current_rate():
+    """The latest row like the async /latest/, refreshed when it is due"""
+    rate = await latest_rate_cache.get_async()
+    if not settings.EXCHANGE_RATE_BACKGROUND_REFRESH:
+        rate = await refresh_if_outdated_async(rate)
+    return rate
+
+
+def log_refresh_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('Refreshing the rate of the event streams failed', exc_info=task.exception())
+
+
+class Message:
+    """An event of the streams, linked to the next one once it is published"""
+    __slots__ = ('data', 'key', 'next', 'ready')
+
+    def __init__(self, data=None, key=None):
+        self.data = data
+        self.key = key
+        self.next = None
+        self.ready = asyncio.Event()
+
+
+class RateBroadcaster:
+    """
+    Fan-out of the new rates to the event streams of an event loop. One
+    task checks the cached latest row every EVENTS_POLL_INTERVAL seconds
+    (no query while the shared snapshot does not change) and appends its
+    event, or a heartbeat, to a linked list of messages. Each stream
+    waits for the next message of the list, so an idle stream is only a
+    pending wait and a new rate is rendered once for all of them.
+    """
+
+    def __init__(self):
+        self.tail = Message()
+        self.key = None
+        self.subscribers = 0
+        self.task = None
+        self.refreshing = None
+
+    def publish(self, data, key=None):
+        message = Message(data, key)
+        tail, self.tail = self.tail, message
+        tail.next = message
+        tail.ready.set()
+
+    def join(self):
+        """Return the current tail, the messages after it are for the caller"""
+        self.subscribers += 1
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return self.tail
+
+    def leave(self):
+        self.subscribers -= 1
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        heartbeat = loop.time() + settings.EVENTS_HEARTBEAT
+        while True:
+            try:
+                rate = await latest_rate_cache.get_async()
+            except Exception:
+                logger.exception('Checking the latest rate of the event streams failed')
+            else:
+                if not settings.EXCHANGE_RATE_BACKGROUND_REFRESH:
+                    self.refresh(rate)
+                if rate is not None and (rate.created, rate.pk) != self.key:
+                    self.key = (rate.created, rate.pk)
+                    self.publish(rate_event(rate, latest_rate_cache.render(rate).body), self.key)
+            if loop.time() >= heartbeat:
+                heartbeat = loop.time() + settings.EVENTS_HEARTBEAT
+                self.publish(HEARTBEAT)
+            await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
+
+
+    def refresh(self, rate):
+        """
+        Refresh an outdated rate in a task of its own, the new row is sent
+        by a next check of the cache. The last stream that leaves cancels
+        the checks, a cancelled refresh would leave the fetches half done.
+        """
+        if not rate_is_outdated(rate):
+            return
+        if self.refreshing is None or self.refreshing.done():
+            self.refreshing = asyncio.ensure_future(refresh_if_outdated_async(rate))
+            self.refreshing.add_done_callback(log_refresh_error)
+
+
+def get_broadcaster():
+    """The broadcaster of the running event loop"""
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        broadcaster = _broadcasters[loop] = RateBroadcaster()
+    return broadcaster
+
+
+async def rate_events(last_event_id=None):
+    """
+    The event stream of a client, the latest rate (or the rows missed
+    since last_event_id) and then every new rate and heartbeat.
+    """
+    broadcaster = get_broadcaster()
+    message = broadcaster.join()
+    try:
+        rate = await current_rate()
+        sent = None
+        if rate is not None and rate.pk == last_event_id:
+            sent = (rate.created, rate.pk)
+        elif rate is not None and last_event_id is not None:
+            missed = await sync_to_async(missed_rates)(last_event_id, settings.EVENTS_REPLAY_LIMIT)
+            for row in missed or []:
+                yield rate_event(row, render_rate(row).body)
+                sent = (row.created, row.pk)
+
+        if rate is not None and (sent is None or sent < (rate.created, rate.pk)):
+            yield rate_event(rate, latest_rate_cache.render(rate).body)
+            sent = (rate.created, rate.pk)
+
+        while True:
+            await message.ready.wait()
+            message = message.next
+            if message.key is None:
+                yield message.data
+            elif sent is None or message.key > sent:
+                yield message.data
+                sent = message.key
+    finally:
+        broadcaster.leave()
+
+
+async def next_rate(is_new, timeout):
+    """
+    Wait up to timeout seconds for a latest row for which is_new(row) is
+    true, with the streams of the event loop, None if there is none.
+    Only a pending wait is kept meanwhile, no thread or connection.
+    """
+    broadcaster = get_broadcaster()
+    message = broadcaster.join()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        # A row published before the join is already in the cache
+        rate = await latest_rate_cache.get_async()
+        while rate is None or not is_new(rate):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(message.ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+            message = message.next
+            if message.key is not None:
+                rate = await latest_rate_cache.get_async()
+        return rate
+    finally:
+        broadcaster.leave()
@@ -0,0 +1,144 @@
+import os
+import socket
+import threading
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import utc
+
+from core.models import ExchangeRateHistory, Lease, ProviderRate
+from utils.currency_rates import store_currency_rates
+from utils.exchange_rates_sources import fetch_rates, fetch_rates_async
+from utils.provider_rates import fill_rates, latest_rate
+
+REFRESH_LEASE = 'exchange-rate-refresh'
+
+_refresh_lock = threading.Lock()
+
+
+def rate_is_outdated(last_rate, dt=None):
+    """Return True if last_rate is older than the update interval"""
+    if last_rate is None:
+        return True
+    if dt is None:
+        dt = datetime.utcnow().replace(tzinfo=utc)
+    diff_dt = dt - last_rate.created
+    return diff_dt.total_seconds() / 60.0 > settings.EXCHANGE_RATE_UPDATE_INTERVAL
+
+
+def refresh_exchange_rate(last_rate=None):
+    """
+    Fetch the providers and save a new ExchangeRateHistory row and a
+    ProviderRate with the rates of each provider that answered, and the
+    rates of every currency of a new Fixer update. Returns the new row
+    with the values of ``last_rate`` for the providers that failed, None
+    if there is no previous row and some provider failed.
+    """
+    dt = datetime.utcnow().replace(tzinfo=utc)
+    return save_rates(last_rate, fetch_rates(), dt)
+
+
+def save_rates(last_rate, data, dt):
+    """Save the rates fetched at dt like refresh_exchange_rate"""
+    if last_rate is None and any(value is None for value in data.values()):
+        return None
+
+    # Null for the providers that did not answer, their rates are not copied
+    rate = ExchangeRateHistory(created=dt)
+    fetched = []
+    for provider, value in data.items():
+        values = (None, None, None)
+        if value is not None:
+            values = (value['rate'], value['date'], dt)
+            fetched.append(ProviderRate(provider=provider, date=value['date'], fetched_at=dt, rate=value['rate']))
+        setattr(rate, f'{provider}_rate', values[0])
+        setattr(rate, f'{provider}_date', values[1])
+        setattr(rate, f'{provider}_last_updated', values[2])
+
+    with transaction.atomic():
+        rate.save()
+        ProviderRate.objects.bulk_create(fetched)
+        if data.get('fixer') and data['fixer'].get('rates'):
+            store_currency_rates(data['fixer'], dt)
+    return fill_rates(rate, last_rate)
+
+
+def begin_refresh(last_rate):
+    """
+    Take the refresh if last_rate is outdated, only one caller across
+    the threads and processes refreshes at a time (single-flight).
+    Returns the owner of the lease, None if there is nothing to refresh
+    or another caller refreshes, and the row to refresh from. Release
+    it with end_refresh.
+    """
+    if not rate_is_outdated(last_rate):
+        return None, last_rate
+
+    if not _refresh_lock.acquire(blocking=False):
+        return None, last_rate
+
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    try:
+        if not Lease.acquire(
+            REFRESH_LEASE,
+            owner,
+            settings.EXCHANGE_RATE_LEASE_SECONDS,
+        ):
+            _refresh_lock.release()
+            return None, last_rate
+
+        # Other process could refresh before this one got the lease
+        latest = latest_rate()
+    except BaseException:
+        end_refresh(owner)
+        raise
+
+    if not rate_is_outdated(latest):
+        end_refresh(owner)
+        return None, latest
+    return owner, latest
+
+
+def end_refresh(owner):
+    try:
+        Lease.release(REFRESH_LEASE, owner)
+    finally:
+        _refresh_lock.release()
+
+
+def refresh_if_outdated(last_rate):
+    """
+    Refresh the rates if last_rate is outdated, the callers that do not
+    get the refresh return last_rate right away instead of waiting.
+    """
+    owner, latest = begin_refresh(last_rate)
+    if owner is None:
+        return latest
+
+    try:
+        return refresh_exchange_rate(latest)
+    finally:
+        end_refresh(owner)
+
+
+async def refresh_if_outdated_async(last_rate):
+    """
+    refresh_if_outdated in the event loop, the providers are fetched
+    with the async client and the database is used from a thread.
+    """
+    if not rate_is_outdated(last_rate):
+        return last_rate
+
+    owner, latest = await sync_to_async(begin_refresh)(last_rate)
+    if owner is None:
+        return latest
+
+    try:
+        dt = datetime.utcnow().replace(tzinfo=utc)
+        data = await fetch_rates_async()
+        return await sync_to_async(save_rates)(latest, data, dt)
+    finally:
+        await sync_to_async(end_refresh)(owner)
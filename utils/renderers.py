@@ -0,0 +1,68 @@
+import csv
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class Echo:
+    """File like object of csv.writer returning the line written"""
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Renderer of a sequence of rows, stream() yields them one by one for
+    a StreamingHttpResponse. render() renders a dict (an error) or a
+    list of dicts at once.
+    """
+
+    def stream(self, columns, rows):
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = [data]
+        columns = list(data[0]) if data else []
+        return b''.join(self.stream(columns, ([row[c] for c in columns] for row in data)))
+
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def stream(self, columns, rows):
+        encoder = JSONEncoder()
+        for row in rows:
+            yield (encoder.encode(dict(zip(columns, row))) + '\n').encode()
+
+
+class CSVRenderer(StreamingRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, columns, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns).encode()
+        for row in rows:
+            yield writer.writerow([csv_value(value) for value in row]).encode()
+
+
+class EventStreamRenderer(BaseRenderer):
+    """The errors of an event stream request, as an 'error' event"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return b'event: error\ndata: %s\n\n' % JSONRenderer().render(data)
@@ -0,0 +1,193 @@
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Case, Count, DateTimeField, DecimalField, ExpressionWrapper, F, Max, Min,
+    Sum, Value, When, Window)
+from django.db.models.functions import Cast, FirstValue, Greatest, LastValue, Least, Trunc
+from django.db.models.expressions import RowRange
+from django.utils.timezone import utc
+
+from core.models import ExchangeRateHistory, RateRollup
+
+# The providers stored in ExchangeRateHistory
+RATE_PROVIDERS = ['dof', 'fixer', 'banxico']
+SPREAD = 'spread'
+ROLLUP_PROVIDERS = RATE_PROVIDERS + [SPREAD]
+PERIODS = [RateRollup.HOUR, RateRollup.DAY]
+
+RATE = DecimalField(max_digits=16, decimal_places=6)
+
+
+def start_of_day(d):
+    return datetime.combine(d, time.min).replace(tzinfo=utc)
+
+
+def bucket_start(created, period):
+    """Start of the hour or the day (UTC) of created"""
+    created = created.astimezone(utc)
+    if period == RateRollup.HOUR:
+        return created.replace(minute=0, second=0, microsecond=0)
+    return start_of_day(created.date())
+
+
+def row_values(row):
+    """
+    The rate of each provider of a history row, and their spread (the
+    highest minus the lowest) when every provider has a rate.
+    """
+    values = {}
+    for provider in RATE_PROVIDERS:
+        rate = getattr(row, f'{provider}_rate')
+        if rate is not None:
+            values[provider] = rate
+    if len(values) == len(RATE_PROVIDERS):
+        values[SPREAD] = max(values.values()) - min(values.values())
+    return values
+
+
+def add_to_rollup(period, provider, created, rate):
+    """Add one rate to its rollup, creating it if it is the first one"""
+    bucket = bucket_start(created, period)
+    # Cast, SQLite compares the decimal parameters as text
+    value = Cast(Value(rate, output_field=RATE), RATE)
+    created_value = Value(created, output_field=DateTimeField())
+    rollup = RateRollup.objects.filter(period=period, provider=provider, bucket=bucket)
+    update = {
+        'open': Case(When(first_created__gt=created, then=value), default=F('open')),
+        'first_created': Least('first_created', created_value),
+        'close': Case(When(last_created__lte=created, then=value), default=F('close')),
+        'last_created': Greatest('last_created', created_value),
+        'high': Greatest('high', value),
+        'low': Least('low', value),
+        'sum': F('sum') + value,
+        'count': F('count') + 1,
+    }
+    if rollup.update(**update):
+        return
+
+    try:
+        with transaction.atomic():
+            RateRollup.objects.create(
+                period=period,
+                provider=provider,
+                bucket=bucket,
+                open=rate,
+                high=rate,
+                low=rate,
+                close=rate,
+                sum=rate,
+                count=1,
+                first_created=created,
+                last_created=created,
+            )
+    except IntegrityError:
+        # Created by a concurrent row
+        rollup.update(**update)
+
+
+def update_rollups(row):
+    """Add a new history row to the rollups of every period"""
+    for provider, rate in row_values(row).items():
+        for period in PERIODS:
+            add_to_rollup(period, provider, row.created, rate)
+
+
+def rollup_value(provider):
+    """Expression of the value of provider in a history row"""
+    if provider == SPREAD:
+        rates = [F(f'{p}_rate') for p in RATE_PROVIDERS]
+        return ExpressionWrapper(Greatest(*rates) - Least(*rates), output_field=RATE)
+    return F(f'{provider}_rate')
+
+
+def compute_rollups(period, provider, start=None, end=None):
+    """
+    The rollups of provider in the history between start and end
+    computed by the database, one row per bucket with window functions.
+    """
+    rows = ExchangeRateHistory.objects.all()
+    if start is not None:
+        rows = rows.filter(created__gte=start)
+    if end is not None:
+        rows = rows.filter(created__lt=end)
+    providers = RATE_PROVIDERS if provider == SPREAD else [provider]
+    rows = rows.filter(**{f'{p}_rate__isnull': False for p in providers})
+
+    bucket = {'partition_by': [F('bucket')]}
+    ordered = {
+        'partition_by': [F('bucket')],
+        'order_by': [F('created').asc(), F('id').asc()],
+        'frame': RowRange(start=None, end=None),
+    }
+    return (
+        rows.annotate(
+            bucket=Trunc('created', period, tzinfo=utc),
+            value=rollup_value(provider),
+        )
+        .annotate(
+            open=Window(FirstValue('value'), **ordered),
+            close=Window(LastValue('value'), **ordered),
+            high=Window(Max('value'), **bucket),
+            low=Window(Min('value'), **bucket),
+            sum=Window(Sum('value'), **bucket),
+            count=Window(Count('id'), **bucket),
+            first_created=Window(Min('created'), **bucket),
+            last_created=Window(Max('created'), **bucket),
+        )
+        .values(
+            'bucket', 'open', 'close', 'high', 'low', 'sum', 'count',
+            'first_created', 'last_created',
+        )
+        .order_by()
+        .distinct()
+    )
+
+
+def archived_until():
+    """
+    Start of the first day whose history is whole, None if no rollup
+    is older than the history. The rollups of the archived rows, and of
+    the day the archive cut, can not be computed again.
+    """
+    oldest = ExchangeRateHistory.objects.order_by('created').values_list('created', flat=True).first()
+    rollups = RateRollup.objects.all()
+    if oldest is not None:
+        rollups = rollups.filter(first_created__lt=oldest)
+    if not rollups.exists():
+        return None
+    if oldest is None:
+        return datetime.max.replace(tzinfo=utc)
+    return start_of_day(oldest.astimezone(utc).date() + timedelta(days=1))
+
+
+def rebuild_rollups(start=None, end=None, batch_size=1000):
+    """
+    Replace the rollups of the buckets between start and end (whole days)
+    with the ones computed from the history, the ones of the archived
+    days are kept. Returns the rollups written by period.
+    """
+    written = {period: 0 for period in PERIODS}
+    with transaction.atomic():
+        until = archived_until()
+        if until is not None:
+            start = until if start is None else max(start, until)
+            if end is not None and start >= end:
+                return written
+
+        rollups = RateRollup.objects.all()
+        if start is not None:
+            rollups = rollups.filter(bucket__gte=start)
+        if end is not None:
+            rollups = rollups.filter(bucket__lt=end)
+        rollups.delete()
+
+        for period in PERIODS:
+            for provider in ROLLUP_PROVIDERS:
+                new = [
+                    RateRollup(period=period, provider=provider, **values)
+                    for values in compute_rollups(period, provider, start, end)
+                ]
+                RateRollup.objects.bulk_create(new, batch_size=batch_size)
+                written[period] += len(new)
+    return written
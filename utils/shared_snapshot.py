@@ -0,0 +1,128 @@
+import os
+import mmap
+import fcntl
+import struct
+import hashlib
+import tempfile
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+# seq (even when the data is consistent) and length of the data
+HEADER = struct.Struct('<QI')
+# Reads retried while a write is in progress before giving up, a writer
+# killed in the middle of a write leaves the seq odd until the next one
+READ_RETRIES = 1000
+
+
+class SharedSnapshot:
+    """
+    Small blob shared by every process of a node through a memory
+    mapped file. Writers take an exclusive flock and bump a sequence
+    number around the write (seqlock), readers never lock, they retry
+    if the sequence changed while they copied the data.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.map = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        """
+        Map the file, again after a fork because the flock of a file
+        descriptor inherited from the parent does not exclude it.
+        """
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                    if os.fstat(fd).st_size < self.size:
+                        os.ftruncate(fd, self.size)
+                    self.fd = fd
+                    self.map = mmap.mmap(fd, self.size)
+                    self.pid = os.getpid()
+        return self.map
+
+    def version(self):
+        """Number of writes, it changes every time the data changes"""
+        return HEADER.unpack_from(self.open(), 0)[0] // 2
+
+    def read(self):
+        """
+        Return the version and the data, None if there is no data or it
+        could not be read consistently (the caller reads the source).
+        """
+        data = self.open()
+        for _ in range(READ_RETRIES):
+            seq, length = HEADER.unpack_from(data, 0)
+            if seq % 2:
+                continue
+            value = data[HEADER.size:HEADER.size + length]
+            if HEADER.unpack_from(data, 0)[0] == seq:
+                return seq // 2, (value or None)
+        return seq // 2, None
+
+    def update(self, func):
+        """
+        Replace the data with func(current data) while holding the write
+        lock, nothing is written if it returns None. Returns the version.
+        """
+        data = self.open()
+        # The flock excludes the other processes, not the other threads
+        # of this one since they share the file description
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                seq, length = HEADER.unpack_from(data, 0)
+                if seq % 2:
+                    # A writer died in the middle of a write, its data is torn
+                    seq += 1
+                    length = 0
+                    HEADER.pack_into(data, 0, seq, length)
+                value = func(data[HEADER.size:HEADER.size + length] or None)
+                if value is None:
+                    return seq // 2
+                if HEADER.size + len(value) > self.size:
+                    raise ValueError(f'Snapshot of {len(value)} bytes is too big')
+
+                HEADER.pack_into(data, 0, seq + 1, length)
+                data[HEADER.size:HEADER.size + len(value)] = value
+                HEADER.pack_into(data, 0, seq + 2, len(value))
+                return seq // 2 + 1
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def clear(self):
+        """Remove the data, it is a new version without data"""
+        return self.update(lambda current: b'')
+
+
+_snapshots = {}
+_lock = threading.Lock()
+
+
+def snapshot_path(name):
+    """
+    Path of a snapshot in SHARED_SNAPSHOT_DIR, one per database so a
+    test run never shares it with a server.
+    """
+    db = connection.settings_dict
+    key = hashlib.sha1(
+        f'{db["ENGINE"]}:{db.get("HOST")}:{db.get("PORT")}:{db["NAME"]}'.encode()
+    ).hexdigest()[:12]
+    directory = settings.SHARED_SNAPSHOT_DIR or tempfile.gettempdir()
+    return os.path.join(directory, f'exchange_rate_{name}_{key}.snapshot')
+
+
+def get_snapshot(name, size):
+    """Return the shared snapshot called name of this process"""
+    path = snapshot_path(name)
+    snapshot = _snapshots.get(path)
+    if snapshot is None:
+        with _lock:
+            snapshot = _snapshots.setdefault(path, SharedSnapshot(path, size))
+    return snapshot
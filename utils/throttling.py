@@ -0,0 +1,149 @@
+import math
+import time
+import threading
+
+from django.conf import settings
+
+from rest_framework.throttling import BaseThrottle
+
+SECOND = 1
+MINUTE = 60
+
+
+class SlidingWindowLimiter:
+    """
+    Sliding window counters kept in the memory of the process. Each key
+    only keeps the count of the current and the previous fixed window,
+    the count of the sliding window is the current one plus the part of
+    the previous one still inside it. The keys are split in stripes with
+    their own lock.
+    """
+
+    def __init__(self, stripes=16, max_keys=100000, clock=time.monotonic):
+        self.clock = clock
+        self.max_keys = max_keys
+        self.stripes = [(threading.Lock(), {}) for _ in range(stripes)]
+
+    def stripe(self, key):
+        return self.stripes[hash(key) % len(self.stripes)]
+
+    @staticmethod
+    def estimate(counter, window, now):
+        """Current count of the sliding window, and the counter moved to now"""
+        start, current, previous = counter
+        bucket = now - now % window
+        if bucket != start:
+            previous = current if bucket - start == window else 0
+            current = 0
+        elapsed = now - bucket
+        return previous * (1 - elapsed / window) + current, [bucket, current, previous]
+
+    @staticmethod
+    def wait(counter, limit, window, now):
+        """Seconds until one more request fits in the window"""
+        bucket, current, previous = counter
+        elapsed = now - bucket
+        if current + 1 > limit:
+            # Once the window moves the current count becomes the previous
+            return window - elapsed + window * (1 - (limit - 1) / current)
+        return max(window * (1 - (limit - 1 - current) / previous) - elapsed, 0)
+
+    def hit(self, group, limits):
+        """
+        Count one request of every key of group (a list of (key, limit,
+        window)) only if all of them are under their limit. Returns if
+        it was allowed, the seconds to wait if it was not, and the
+        (limit, remaining, reset) of the window with less requests left.
+        """
+        lock, counters = self.stripe(group)
+        now = self.clock()
+        with lock:
+            estimates = []
+            for key, limit, window in limits:
+                estimate, counter = self.estimate(
+                    counters.get(key, (0, 0, 0)), window, now,
+                )
+                estimates.append((key, limit, window, estimate, counter))
+
+            waits = [
+                self.wait(counter, limit, window, now)
+                for key, limit, window, estimate, counter in estimates
+                if estimate + 1 > limit
+            ]
+            allowed = not waits
+            status = None
+            for key, limit, window, estimate, counter in estimates:
+                if allowed:
+                    counter[1] += 1
+                    estimate += 1
+                counters[key] = counter
+                remaining = max(int(limit - estimate), 0)
+                if status is None or remaining < status[1]:
+                    status = (limit, remaining, math.ceil(window - (now - counter[0])))
+
+            if len(counters) > self.max_keys // len(self.stripes):
+                self.prune(counters, now)
+        return allowed, max(waits, default=None), status
+
+    def prune(self, counters, now):
+        """Remove the counters of keys without requests in two windows"""
+        for key, (start, _, _) in list(counters.items()):
+            if now - start >= 2 * key[-1]:
+                del counters[key]
+
+    def clear(self):
+        for lock, counters in self.stripes:
+            with lock:
+                counters.clear()
+
+
+rate_limiter = SlidingWindowLimiter()
+
+
+class ApiKeyRateThrottle(BaseThrottle):
+    """
+    Requests per second and per minute of each api key and of each user
+    (all his keys and his session), 0 disables a limit. The limits are
+    counted by every worker process on its own.
+    """
+
+    def get_limits(self, request):
+        limits = []
+        scopes = [('user', request.user.pk, settings.RATE_LIMIT_USER)]
+        if isinstance(request.auth, str):
+            scopes.append(('key', request.auth, settings.RATE_LIMIT_KEY))
+        for scope, ident, (per_second, per_minute) in scopes:
+            for limit, window in ((per_second, SECOND), (per_minute, MINUTE)):
+                if limit:
+                    limits.append(((scope, ident, window), limit, window))
+        return limits
+
+    def allow_request(self, request, view):
+        self.delay = None
+        if not request.user.is_authenticated:
+            return True
+        limits = self.get_limits(request)
+        if not limits:
+            return True
+
+        allowed, self.delay, status = rate_limiter.hit(request.user.pk, limits)
+        limit, remaining, reset = status
+        request.rate_limit_headers = {
+            'X-RateLimit-Limit': str(limit),
+            'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset': str(reset),
+        }
+        return allowed
+
+    def wait(self):
+        return self.delay
+
+
+class RateLimitHeadersMixin:
+    """Add the X-RateLimit-* headers of ApiKeyRateThrottle to the response"""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        for header, value in getattr(request, 'rate_limit_headers', {}).items():
+            response[header] = value
+        return response
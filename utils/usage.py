@@ -0,0 +1,157 @@
+import os
+import time
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from core.models import User
+from utils.quota import add_usage, over_limit, usage_window
+
+logger = logging.getLogger(__name__)
+
+
+class UsageCounter:
+    """
+    Requests of each user counted in memory and added to User.usage in
+    one UPDATE ... SET usage = usage + n per flush. The counts are split
+    in stripes with their own lock so concurrent requests of different
+    users do not wait for each other, and a hot user costs one UPDATE of
+    its row per flush instead of one per request.
+
+    The flush runs in the request that finds it due, every
+    USAGE_FLUSH_INTERVAL seconds (0 flushes every request), and when the
+    process exits. The quota check adds the counts not flushed yet, so
+    it can only miss the counts of the other processes since their last
+    flush.
+    """
+
+    def __init__(self, stripes=None, clock=time.monotonic):
+        self.clock = clock
+        self.stripes = [
+            (threading.Lock(), {})
+            for _ in range(stripes or settings.USAGE_STRIPES)
+        ]
+        self.flush_lock = threading.Lock()
+        self.flushed_at = clock()
+        # User.usage read back after the last flushes of each user
+        self.stored = {}
+
+    def stripe(self, user_id):
+        return self.stripes[user_id % len(self.stripes)]
+
+    def add(self, user, n=1):
+        """Count n requests of user, flushing if it is due"""
+        self.count(user, n)
+        if self.flush_due():
+            self.flush(blocking=False)
+
+    def count(self, user, n=1):
+        """Count n requests of user without flushing, for the async views"""
+        lock, counts = self.stripe(user.pk)
+        with lock:
+            counts[user.pk] = counts.get(user.pk, 0) + n
+
+    def flush_due(self):
+        return self.clock() - self.flushed_at >= settings.USAGE_FLUSH_INTERVAL
+
+    def pending(self, user_id):
+        """Requests of the user counted but not flushed yet"""
+        lock, counts = self.stripe(user_id)
+        with lock:
+            return counts.get(user_id, 0)
+
+    def usage(self, user):
+        """
+        The usage of the current window of user including the requests
+        not flushed yet
+        """
+        usage, usage_end_date = user.usage_window()
+        stored = self.stored.get(user.pk)
+        if stored is not None:
+            stored = usage_window(stored[0], stored[1])
+            if stored[1] == usage_end_date:
+                usage = max(usage, stored[0])
+        return usage + self.pending(user.pk)
+
+    def check_usage_limit(self, user):
+        """User.check_usage_limit with the usage counted by this process"""
+        return over_limit(self.usage(user))
+
+    def take(self):
+        """Remove and return the counts of every stripe"""
+        taken = {}
+        for lock, counts in self.stripes:
+            with lock:
+                if counts:
+                    taken.update(counts)
+                    counts.clear()
+        return taken
+
+    def restore(self, taken):
+        for user_id, n in taken.items():
+            lock, counts = self.stripe(user_id)
+            with lock:
+                counts[user_id] = counts.get(user_id, 0) + n
+
+    def flush(self, blocking=True):
+        """
+        Add the counts to the database, one UPDATE per distinct count
+        which also starts a new window for the users with an expired one.
+        Returns the number of requests flushed.
+        """
+        if not self.flush_lock.acquire(blocking):
+            return 0
+        try:
+            self.flushed_at = self.clock()
+            taken = self.take()
+            if not taken:
+                return 0
+
+            by_count = {}
+            for user_id, n in taken.items():
+                by_count.setdefault(n, []).append(user_id)
+            try:
+                with transaction.atomic():
+                    for n, user_ids in by_count.items():
+                        User.objects.filter(pk__in=user_ids).update(**add_usage(n))
+            except Exception:
+                # Counted again in the next flush, nothing is lost
+                logger.exception('Error flushing the usage of %s users', len(taken))
+                self.restore(taken)
+                return 0
+
+            self.store(taken)
+            return sum(taken.values())
+        finally:
+            self.flush_lock.release()
+
+    def store(self, user_ids):
+        """
+        Read back the usage of the users flushed, kept while the cached
+        users of the api keys can be older than it.
+        """
+        now = self.clock()
+        for user_id, usage, usage_end_date in User.objects.filter(
+            pk__in=list(user_ids),
+        ).order_by().values_list('pk', 'usage', 'usage_end_date'):
+            self.stored[user_id] = (usage, usage_end_date, now)
+
+        ttl = settings.API_KEY_CACHE_TTL
+        for user_id, (_, _, read_at) in list(self.stored.items()):
+            if now - read_at > ttl:
+                self.stored.pop(user_id, None)
+
+    def clear(self):
+        """Forget the counts without flushing them"""
+        self.take()
+        self.stored.clear()
+
+
+usage_counter = UsageCounter()
+
+# The counts of the parent belong to the parent
+os.register_at_fork(after_in_child=usage_counter.clear)
+atexit.register(usage_counter.flush)